@@ -2,12 +2,35 @@ import sys
 import json
 import time
 import random
+import argparse
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from web3 import Web3, constants
 from pathlib import Path
+from eth_abi import decode, encode
+from eth_utils import get_abi_output_types
 from web3.middleware import ExtraDataToPOAMiddleware
 
 
+# contract address -> bridge_events.EventDecoder
+_event_decoders = {}
+
+LOAD_ACCOUNT_OFFSET = 100  # HD wallet index of the first load generator account (lower indices are left for grading)
+LOAD_GAS = 200000  # Gas limit for load generator transactions
+LOAD_WORKERS = 16  # Threads sending load generator transactions
+LOAD_TIMEOUT = 600  # Seconds to wait for setup transactions, and for the bridge to relay the generated deposits
+_chain_ids = {}  # id(w3) -> chain id
+_underlying_tokens = {}  # (destination contract address, wrapped token address) -> underlying token address
+
+# Multicall3 is deployed at the same address on Fuji, BSC testnet and most other chains
+# On a fresh anvil chain it has to be deployed (or anvil_setCode'd) there first; until then calls are made one by one
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+AGGREGATE3_SELECTOR = Web3.keccak(text="aggregate3((address,bool,bytes)[])")[:4]
+MINTER_ROLE = Web3.keccak(text="MINTER_ROLE")
+_multicall_available = {}  # (id(w3), multicall address) -> whether Multicall3 is deployed there
+
+
 class bcolors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -119,6 +142,75 @@ def get_erc20s(w3, chain, n, erc20s_file, erc20s_abi_file):
     return tokens
 
 
+def multicall(w3, calls, address=MULTICALL3_ADDRESS):
+    """
+        w3 - web3 instance
+        calls - (list) bound contract view calls, e.g. token.functions.balanceOf(user)
+        Makes all the calls in a single eth_call through Multicall3's aggregate3
+        Falls back to one eth_call per call if Multicall3 is not deployed at address
+        Returns the decoded results in call order (a single return value is unwrapped),
+        with None for any call that reverted
+    """
+    if not calls:
+        return []
+    key = (id(w3), address)
+    if key not in _multicall_available:
+        _multicall_available[key] = len(w3.eth.get_code(Web3.to_checksum_address(address))) > 0
+
+    if not _multicall_available[key]:
+        results = []
+        for call in calls:
+            try:
+                results.append(call.call())
+            except Exception:
+                results.append(None)
+        return results
+
+    data = encode(['(address,bool,bytes)[]'],
+                  [[(call.address, True, Web3.to_bytes(hexstr=call._encode_transaction_data())) for call in calls]])
+    raw = w3.eth.call({'to': Web3.to_checksum_address(address), 'data': AGGREGATE3_SELECTOR + data})
+    results = []
+    for call, (success, return_data) in zip(calls, decode(['(bool,bytes)[]'], raw)[0]):
+        if not success:
+            results.append(None)
+            continue
+        values = decode(get_abi_output_types(call.abi), return_data)
+        values = [Web3.to_checksum_address(v) if typ == 'address' else v
+                  for typ, v in zip(get_abi_output_types(call.abi), values)]
+        results.append(values[0] if len(values) == 1 else tuple(values))
+    return results
+
+
+def read_token_state(source_contract, destination_contract, tokens, holders, minter):
+    """
+        tokens - (list of contract objects) underlying tokens on the source chain
+        holders - (list of addresses) accounts whose balances are needed
+        minter - (account object) the grader's minter
+        Reads everything the preflight checks need with one multicall per chain
+        Returns {token address: {'approved', 'is_minter', 'balances': {holder: balance}, 'wrapped'}}
+    """
+    source_calls = []
+    for token in tokens:
+        source_calls += [source_contract.functions.approved(token.address),
+                         token.functions.hasRole(MINTER_ROLE, minter.address)]
+        source_calls += [token.functions.balanceOf(holder) for holder in holders]
+    source_results = multicall(source_contract.w3, source_calls)
+    wrapped = multicall(destination_contract.w3,
+                        [destination_contract.functions.wrapped_tokens(token.address) for token in tokens])
+
+    state = {}
+    per_token = 2 + len(holders)
+    for n, token in enumerate(tokens):
+        results = source_results[n * per_token:(n + 1) * per_token]
+        state[token.address] = {
+            'approved': bool(results[0]),
+            'is_minter': bool(results[1]),
+            'balances': dict(zip(holders, results[2:])),
+            'wrapped': wrapped[n],
+        }
+    return state
+
+
 def get_eth_keys(filename, keyId = 0):
     """
     Generate a persistent Ethereum account
@@ -204,7 +296,8 @@ def sign_and_send(contract, function, signer, argdict, confirm=True, force_nonce
         return None
 
     if confirm:
-        tx_receipt = w3.eth.wait_for_transaction_receipt(signed_tx.hash)
+        from bridge_receipts import get_receipt_tracker
+        tx_receipt = get_receipt_tracker(w3).wait(signed_tx.hash)
         if tx_receipt.status:
             print(f"{bcolors.OKGREEN}SUCCESS{bcolors.ENDC}: in sign_and_send, Transaction confirmed for '{function}' at block {tx_receipt.blockNumber}")
         else:
@@ -214,26 +307,29 @@ def sign_and_send(contract, function, signer, argdict, confirm=True, force_nonce
     return signed_tx.hash.hex(), nonce
 
 
-def ensure_balance(token, user, bal, minter):
+def ensure_balance(token, user, bal, minter, current_balance=None, is_minter=None):
     """
         token - (contract object) an ERC20 token
         user - (address)
         bal - (int)
+        current_balance, is_minter - values already read by read_token_state, so they are not read again
         Ensure the address "user" has a balance of at least bal in the ERC20 token.
         If the user's balance is below bal, new tokens are minted
     """
 
-    current_balance = token.functions.balanceOf(user).call()
+    if current_balance is None:
+        current_balance = token.functions.balanceOf(user).call()
     if current_balance >= bal:
         return True
 
-    try:
-        is_minter = token.functions.hasRole(token.functions.MINTER_ROLE().call(), minter.address)
-    except Exception as e:
-        print(f"Failed to call 'hasRole'")
-        print("Contact your instructor")
-        print(e)
-        return False
+    if is_minter is None:
+        try:
+            is_minter = token.functions.hasRole(MINTER_ROLE, minter.address).call()
+        except Exception as e:
+            print(f"Failed to call 'hasRole'")
+            print("Contact your instructor")
+            print(e)
+            return False
 
     if not is_minter:
         print(f"{minter.address} is not allowed to mint tokens on {token.address}")
@@ -245,16 +341,18 @@ def ensure_balance(token, user, bal, minter):
     sign_and_send(token, 'mint', minter, {'to': user, 'amount': bal - current_balance})
 
 
-def get_wrapped_token(token, destination_w3, destination_contract, erc20s_abi_file):
+def get_wrapped_token(token, destination_w3, destination_contract, erc20s_abi_file, wrapped_token_address=None):
     """
         token - (contract object) underlying token on source chain
+        wrapped_token_address - (address) the wrapped token, if already read by read_token_state
         Returns a contract object corresponding to the wrapped version of this asset on the destination chain
     """
-    try:
-        wrapped_token_address = destination_contract.functions.wrapped_tokens(token.address).call()
-    except Exception as e:
-        print(f"Failed to get wrapped token for {token.address} on contract {destination_contract.address}\n{e}")
-        return None
+    if wrapped_token_address is None:
+        try:
+            wrapped_token_address = destination_contract.functions.wrapped_tokens(token.address).call()
+        except Exception as e:
+            print(f"Failed to get wrapped token for {token.address} on contract {destination_contract.address}\n{e}")
+            return None
 
     with open(erc20s_abi_file, 'r') as f:
         erc20_abi = json.load(f)
@@ -269,23 +367,29 @@ def get_wrapped_token(token, destination_w3, destination_contract, erc20s_abi_fi
     return wrapped_token
 
 
-def check_token_registration(source_contract, deposits, destination_contract, minter):
+def check_token_registration(source_contract, deposits, destination_contract, minter, state=None):
     """
        check erc20s are registered on contracts
+       state - (dictionary) from read_token_state; read here (one multicall per chain) if not given
     """
+    if state is None:
+        state = read_token_state(source_contract, destination_contract, [d['token'] for d in deposits],
+                                 sorted({d['sender'].address for d in deposits}), minter)
     not_registered = []
     for d in deposits:
         token = d['token']  # Contract object (not address)
         sender = d['sender']  # Account object (not address)
+        token_state = state[token.address]
 
-        if not source_contract.functions.approved(token.address).call():
+        if not token_state['approved']:
             print(f"\n{bcolors.WARNING}INCOMPLETE{bcolors.ENDC}: you need to call registerToken({token.address})\n"
                   f"Before submitting your assignment")
             not_registered.append(token.address)
         else:
-            ensure_balance(token, sender.address, 10 ** 6, minter)
+            ensure_balance(token, sender.address, 10 ** 6, minter,
+                           token_state['balances'].get(sender.address), token_state['is_minter'])
 
-        if constants.ADDRESS_ZERO == destination_contract.functions.wrapped_tokens(token.address).call():
+        if token_state['wrapped'] in (None, constants.ADDRESS_ZERO):
             print(f"\n{bcolors.WARNING}INCOMPLETE{bcolors.ENDC}:  you need to call createToken({token.address})\n"
                   f"Before submitting your assignment")
             not_registered.append(token.address)
@@ -362,13 +466,252 @@ def make_withdrawals(withdrawals, destination_contract):
             print(f"{bcolors.FAIL}ERROR{bcolors.ENDC}: unwrap transaction failed on destination chain\n{e}\n")
 
 
+def get_hd_accounts(filename, n, keyId=0, offset=LOAD_ACCOUNT_OFFSET):
+    """
+        filename - file of mnemonics, as used by get_eth_keys
+        n (integer) - how many accounts to derive
+        keyId (integer) - which mnemonic to derive them from
+        Returns n accounts derived from the mnemonic at HD wallet indices offset .. offset + n - 1
+    """
+    w3 = Web3()
+    w3.eth.account.enable_unaudited_hdwallet_features()
+    get_eth_keys(filename, keyId)  # Creates the mnemonic if it does not exist yet
+    with open(filename, 'r') as f:
+        mnemonic_secret = f.readlines()[keyId].rstrip()
+    return [w3.eth.account.from_mnemonic(mnemonic_secret, account_path=f"m/44'/60'/0'/0/{offset + i}")
+            for i in range(n)]
+
+
+class LocalNonces:
+    """
+        Hands out nonces for many senders without asking the chain each time
+        Each sender's pending nonce is read once, then counted up locally
+    """
+    def __init__(self, w3):
+        self.w3 = w3
+        self.lock = threading.Lock()
+        self.nonces = {}
+
+    def next(self, address):
+        with self.lock:
+            if address not in self.nonces:
+                self.nonces[address] = self.w3.eth.get_transaction_count(address, 'pending')
+            nonce = self.nonces[address]
+            self.nonces[address] += 1
+            return nonce
+
+    def reset(self, address):
+        """
+            Forgets address's count, e.g. after a failed send left it ahead of the chain; the next
+            nonce is read from the chain again
+        """
+        with self.lock:
+            self.nonces.pop(address, None)
+
+
+def send_fast(contract, function, signer, argdict, nonce, gas_price):
+    """
+        Like sign_and_send(confirm=False), but with a caller-supplied nonce and gas price, so the
+        only RPC call is eth_sendRawTransaction
+        Returns the transaction hash, or None if the transaction was rejected
+    """
+    w3 = contract.w3
+    tx = getattr(contract.functions, function)(**argdict).build_transaction(
+        {'nonce': nonce, 'gasPrice': gas_price, 'from': signer.address, 'gas': LOAD_GAS, 'chainId': chain_id(w3)})
+    signed_tx = w3.eth.account.sign_transaction(tx, signer.key)
+    try:
+        return w3.eth.send_raw_transaction(signed_tx.raw_transaction).hex()
+    except Exception as e:
+        print(f"{bcolors.FAIL}ERROR{bcolors.ENDC}: load generator failed to send '{function}' "
+              f"from {signer.address} (nonce {nonce})\n{e}")
+        return None
+
+
+def chain_id(w3):
+    if id(w3) not in _chain_ids:
+        _chain_ids[id(w3)] = w3.eth.chain_id
+    return _chain_ids[id(w3)]
+
+
+def send_load(w3, jobs, rate=0, workers=LOAD_WORKERS, nonces=None):
+    """
+        w3 - web3 instance the transactions are sent on
+        jobs - (list of tuples) (contract, function, signer, argdict) transactions to send
+        rate - (float) target transactions per second, 0 sends as fast as possible
+        nonces - (LocalNonces) nonce counter shared with earlier sends on w3, so senders that already
+            sent are not re-read from a node that may not have seen those transactions yet
+        Sends every job without waiting for confirmation, from a thread pool
+        Nonces are managed locally; each sender's jobs are sent in job order by a single worker, so its
+        nonces reach the node in sequence. When one of a sender's sends fails, its later jobs would be
+        stuck behind the nonce gap, so they are not sent and the sender's count is read from the chain again
+        Returns the transaction hashes in job order (None for jobs that failed or were not sent)
+    """
+    nonces = nonces or LocalNonces(w3)
+    gas_price = w3.eth.gas_price
+    by_sender = {}
+    for n, (_, _, signer, _) in enumerate(jobs):
+        by_sender.setdefault(signer.address, []).append(n)
+    job_nonces = [nonces.next(signer.address) for _, _, signer, _ in jobs]
+
+    hashes = [None] * len(jobs)
+    pace_lock = threading.Lock()
+    pace = {'next': time.time()}
+
+    def wait_for_slot():
+        if not rate:
+            return
+        with pace_lock:
+            slot = pace['next'] = max(pace['next'] + 1 / rate, time.time())
+        time.sleep(max(0.0, slot - time.time()))
+
+    def send_all(indices):
+        for n in indices:
+            contract, function, signer, argdict = jobs[n]
+            wait_for_slot()
+            hashes[n] = send_fast(contract, function, signer, argdict, job_nonces[n], gas_price)
+            if hashes[n] is None:
+                skipped = len(indices) - indices.index(n) - 1
+                if skipped:
+                    print(f"Skipping the remaining {skipped} transaction(s) from {signer.address}")
+                nonces.reset(signer.address)
+                return
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(send_all, by_sender.values()))
+    elapsed = time.time() - start
+    sent = sum(h is not None for h in hashes)
+    print(f"Load generator sent {sent}/{len(jobs)} transactions in {elapsed:.1f}s "
+          f"({sent / elapsed if elapsed else 0:.1f} tx/s)")
+    return hashes
+
+
+def fund_accounts(w3, funder, accounts, value, nonces=None):
+    """
+        Tops up the native balance of every account to at least value (in wei), from funder
+        nonces - (LocalNonces) nonce counter to take funder's nonces from, see send_load
+        Returns the hash of the last transfer, or None if nothing needed topping up
+    """
+    nonces = nonces or LocalNonces(w3)
+    gas_price = w3.eth.gas_price
+    tx_hash = None
+    for acct in accounts:
+        missing = value - w3.eth.get_balance(acct.address)
+        if missing > 0:
+            tx = {'nonce': nonces.next(funder.address), 'gasPrice': gas_price, 'gas': 21000,
+                  'to': acct.address, 'value': missing, 'chainId': chain_id(w3)}
+            tx_hash = w3.eth.send_raw_transaction(w3.eth.account.sign_transaction(tx, funder.key).raw_transaction)
+    return tx_hash
+
+
+def wait_for_hashes(w3, hashes):
+    """
+        Waits for the last transaction of every sender in hashes to be mined, which means all of them are
+        The receipts are polled per block by a shared bridge_receipts.ReceiptTracker
+    """
+    from bridge_receipts import get_receipt_tracker
+    tracker = get_receipt_tracker(w3)
+    hashes = [tx_hash for tx_hash in hashes if tx_hash is not None]
+    for tx_hash in hashes:
+        tracker.track(tx_hash)
+    for tx_hash in hashes:
+        tracker.wait(tx_hash, timeout=LOAD_TIMEOUT)
+
+
+def make_load(n, rate, num_accounts, code_path, keys_file, erc20s_file, erc20s_abi_file, unwrap=False):
+    """
+        n (integer) - how many deposits (and, with unwrap, how many unwraps) to generate
+        rate (float) - target transactions per second, 0 for as fast as possible
+        num_accounts (integer) - how many HD wallet accounts to spread the traffic over
+        Generates synthetic bridge traffic from many accounts derived from keys_file, without waiting for
+        confirmations. Each account approves the Source contract once, then deposits to its own address,
+        so the same accounts can unwrap the wrapped tokens once the bridge has relayed the deposits.
+    """
+    contract_file = code_path / "contract_info.json"
+    source_w3 = connect_to('avax')
+    destination_w3 = connect_to('bsc')
+    deposit = get_source_contract(contract_file)
+    source_contract = source_w3.eth.contract(abi=deposit['abi'], address=deposit['address'])
+    withdrawal = get_destination_contract(contract_file)
+    destination_contract = destination_w3.eth.contract(abi=withdrawal['abi'], address=withdrawal['address'])
+
+    minter = get_eth_keys(keys_file, keyId=1)
+    senders = get_hd_accounts(keys_file, num_accounts)
+    tokens = get_erc20s(source_w3, 'avax', 2, erc20s_file, erc20s_abi_file)
+
+    deposits = [(source_contract, 'deposit', senders[i % num_accounts],
+                 {'_token': tokens[i % len(tokens)].address, '_recipient': senders[i % num_accounts].address,
+                  '_amount': random.randint(10, 1000)}) for i in range(n)]
+    needed = {}  # (sender, token) -> total deposited
+    for _, _, sender, d in deposits:
+        needed[(sender.address, d['_token'])] = needed.get((sender.address, d['_token']), 0) + d['_amount']
+
+    # One nonce counter per chain for every send below: the minter funds and then mints back to back,
+    # and re-reading its pending nonce in between can reuse nonces on load-balanced RPCs
+    source_nonces = LocalNonces(source_w3)
+    destination_nonces = LocalNonces(destination_w3)
+
+    # Setup: gas money and tokens for every sender, mined before any deposit is sent
+    print(f"Funding {num_accounts} load generator accounts")
+    per_sender = -(-n // num_accounts) + len(tokens)
+    last_transfer = fund_accounts(source_w3, minter, senders, per_sender * LOAD_GAS * source_w3.eth.gas_price,
+                                  source_nonces)
+    token_by_address = {token.address: token for token in tokens}
+    balances = multicall(source_w3, [token_by_address[token].functions.balanceOf(sender) for sender, token in needed])
+    mints = [(token_by_address[token], 'mint', minter, {'to': sender, 'amount': amount})
+             for ((sender, token), amount), balance in zip(needed.items(), balances) if (balance or 0) < amount]
+    wait_for_hashes(source_w3, [last_transfer] + send_load(source_w3, mints, nonces=source_nonces)[-1:])
+
+    approvals = [(token_by_address[token], 'approve', next(s for s in senders if s.address == sender),
+                  {'spender': source_contract.address, 'amount': amount})
+                 for (sender, token), amount in needed.items()]
+    print(f"\n----- Load generator sending {len(approvals)} approvals and {n} deposits -----")
+    # One job list, so each sender's approvals get lower nonces than its deposits
+    send_load(source_w3, approvals + deposits, rate, nonces=source_nonces)
+
+    if not unwrap:
+        return
+
+    wrapped = {token.address: get_wrapped_token(token, destination_w3, destination_contract, erc20s_abi_file)
+               for token in tokens}
+    fund_accounts(destination_w3, minter, senders, per_sender * LOAD_GAS * destination_w3.eth.gas_price,
+                  destination_nonces)
+    print("Waiting for the bridge to relay the deposits")
+    deadline = time.time() + LOAD_TIMEOUT
+    pending = dict(needed)
+    while pending and time.time() < deadline:
+        for (sender, token), amount in list(pending.items()):
+            if wrapped[token].functions.balanceOf(sender).call() >= amount:
+                del pending[(sender, token)]
+        if pending:
+            time.sleep(5)
+    if pending:
+        print(f"{bcolors.WARNING}WARNING{bcolors.ENDC}: {len(pending)} sender(s) never received their wrapped "
+              f"tokens, unwrapping what was relayed")
+
+    unwraps = [(destination_contract, 'unwrap', sender,
+                {'_wrapped_token': wrapped[d['_token']].address, '_recipient': sender.address, '_amount': d['_amount']})
+               for _, _, sender, d in deposits if (sender.address, d['_token']) not in pending]
+    print(f"\n----- Load generator sending {len(unwraps)} unwraps -----")
+    send_load(destination_w3, unwraps, rate, nonces=destination_nonces)
+
+
+def get_event_query(w3, contract, event_name):
+    """
+        Returns a bridge_events.LogQuery that fetches and decodes event_name logs from contract
+        Decoders are built once per contract address
+    """
+    from bridge_events import EventDecoder, LogQuery
+    if contract.address not in _event_decoders:
+        _event_decoders[contract.address] = EventDecoder(contract.abi)
+    return LogQuery(w3, contract.address, _event_decoders[contract.address], [event_name])
+
+
 def check_for_wrap(destination_w3, destination_contract):
     end_block = destination_w3.eth.get_block_number()
     start_block = end_block - 10
     print(f"Autograder scanning blocks {start_block} - {end_block} on destination")
-    event_filter = destination_contract.events.Wrap.create_filter(from_block=start_block, to_block=end_block,
-                                                                  argument_filters={})
-    events = event_filter.get_all_entries()
+    events = get_event_query(destination_w3, destination_contract, 'Wrap').get_logs(start_block, end_block)
     print(f"Autograder found {len(events)} events")
 
     wrap_events = []
@@ -376,11 +719,11 @@ def check_for_wrap(destination_w3, destination_contract):
         data = {
             'event': evt.event,  # Wrap
             'block_number': evt.blockNumber,
-            'underlying_token': evt.args['underlying_token'],
-            'wrapped_token': evt.args['wrapped_token'],
-            'to': evt.args['to'],
-            'amount': evt.args['amount'],
-            'transactionHash': evt.transactionHash.hex(),
+            'underlying_token': evt.underlying_token,
+            'wrapped_token': evt.wrapped_token,
+            'to': evt.to,
+            'amount': evt.amount,
+            'transactionHash': evt.transactionHash,
             'address': evt.address,
         }
         print(json.dumps(data, indent=2))
@@ -393,9 +736,7 @@ def check_for_withdrawal(source_w3, source_contract):
     end_block = source_w3.eth.get_block_number()
     start_block = end_block - 10
     print(f"Autograder scanning blocks {start_block} - {end_block} on source")
-    event_filter = source_contract.events.Withdrawal.create_filter(from_block=start_block, to_block=end_block,
-                                                                   argument_filters={})
-    events = event_filter.get_all_entries()
+    events = get_event_query(source_w3, source_contract, 'Withdrawal').get_logs(start_block, end_block)
     print(f"Autograder found {len(events)} Withdrawal events")
 
     withdrawal_events = []
@@ -403,10 +744,10 @@ def check_for_withdrawal(source_w3, source_contract):
         data = {
             'event': evt.event,  # Withdrawal
             'block_number': evt.blockNumber,
-            'token': evt.args['token'],
-            'recipient': evt.args['recipient'],
-            'amount': evt.args['amount'],
-            'transactionHash': evt.transactionHash.hex(),
+            'token': evt.token,
+            'recipient': evt.recipient,
+            'amount': evt.amount,
+            'transactionHash': evt.transactionHash,
             'address': evt.address,
         }
         print(json.dumps(data, indent=2))
@@ -414,6 +755,36 @@ def check_for_withdrawal(source_w3, source_contract):
     return withdrawal_events
 
 
+def get_underlying_tokens(destination_contract, wrapped_tokens):
+    """
+        wrapped_tokens - (iterable) wrapped token addresses on the destination chain
+        Returns {wrapped token address: underlying token address}
+        Each mapping is read from the destination contract once and cached
+    """
+    for wrapped in set(wrapped_tokens):
+        key = (destination_contract.address, wrapped)
+        if key not in _underlying_tokens:
+            _underlying_tokens[key] = destination_contract.functions.underlying_tokens(wrapped).call()
+    return {wrapped: _underlying_tokens[(destination_contract.address, wrapped)] for wrapped in wrapped_tokens}
+
+
+def count_matches(expected, events, key_fields):
+    """
+        expected - (list of tuples) the (recipient, amount, token) each expected transfer should produce
+        events - (list of dictionaries) events found on chain
+        key_fields - (tuple) the event fields that hold recipient, amount and token, in that order
+        Returns how many expected transfers have a matching event, using a hash index of the events
+    """
+    index = {tuple(evt[f] for f in key_fields) for evt in events}
+    score = 0
+    for key in expected:
+        if key in index:
+            score += 1
+        else:
+            print(f"No event found for recipient {key[0]}, amount {key[1]}, token {key[2]}")
+    return score
+
+
 def validate(code_path):
 
     contract_file = code_path / "contract_info.json"
@@ -473,14 +844,17 @@ def validate(code_path):
          'sender': user_a,
          'receiver': user_b.address,
          'amount': random.randint(10, 1000)} for token in tokens]
+    # Every view call the preflight needs, in one multicall per chain
+    state = read_token_state(source_contract, destination_contract, tokens, [user_a.address], minter)
     withdrawals = [
-        {'token': get_wrapped_token(t['token'], destination_w3, destination_contract, erc20s_abi_file),
+        {'token': get_wrapped_token(t['token'], destination_w3, destination_contract, erc20s_abi_file,
+                                    state[t['token'].address]['wrapped']),
          'sender': user_b,
          'receiver': user_a.address,
          'amount': t['amount']} for t in deposits]
 
     # Verify that the student registered the tokens they recorded in the erc20s.csv
-    if not check_token_registration(source_contract, deposits, destination_contract, minter):
+    if not check_token_registration(source_contract, deposits, destination_contract, minter, state):
         return setup_points
     else:
         print(f"{bcolors.OKGREEN}SUCCESS{bcolors.ENDC}: ERC20s are valid and registered")
@@ -511,16 +885,8 @@ def validate(code_path):
     if len(wrap_events) == 0:
         time.sleep(5)
         wrap_events = check_for_wrap(destination_w3, destination_contract)
-    score = 0
-    for d in deposits:
-        for w in wrap_events:
-            if d['receiver'] == w['to'] and d['amount'] == w['amount'] and d['token'].address == w['underlying_token']:
-                score += 1
-                break
-            else:
-                print(f"{d['receiver']} ?= {w['to']}\n"
-                      f"{d['amount']} ?= {w['amount']}\n"
-                      f"{d['token'].address} ?= {w['underlying_token']}")
+    score = count_matches([(d['receiver'], d['amount'], d['token'].address) for d in deposits],
+                          wrap_events, ('to', 'amount', 'underlying_token'))
 
     ############################################################
     # Now we test the reverse direction
@@ -542,23 +908,30 @@ def validate(code_path):
     withdrawal_events = check_for_withdrawal(source_w3, source_contract)
     if len(withdrawal_events) == 0:
         time.sleep(5)
-        withdrawal_events = check_for_wrap(destination_w3, destination_contract)
-
-    for u in withdrawals:
-        for w in withdrawal_events:
-            if u['receiver'] == w['recipient'] and \
-                    u['amount'] == w['amount'] and \
-                    destination_contract.functions.underlying_tokens(u['token'].address).call() == w['token']:
-                score += 1
-                break
-            else:
-                print(f"{u['receiver']} ?= {w['recipient']}")
-                print(f"{u['amount']} ?= {w['amount']}")
-                print(f"{destination_contract.functions.underlying_tokens(u['token'].address).call()} ?= {w['token']}")
+        withdrawal_events = check_for_withdrawal(source_w3, source_contract)
+
+    underlying = get_underlying_tokens(destination_contract, [u['token'].address for u in withdrawals])
+    score += count_matches([(u['receiver'], u['amount'], underlying[u['token'].address]) for u in withdrawals],
+                           withdrawal_events, ('recipient', 'amount', 'token'))
 
     return max((100.0 * (float(score) / (2 * len(deposits)))), setup_points)
 
 
 if __name__ == "__main__":
-    final_score = validate(Path(__file__).parent.absolute())
-    print(f"Score = {final_score}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load', type=int, default=0, help="generate this many deposits instead of grading")
+    parser.add_argument('--rate', type=float, default=0, help="load generator transactions per second (0 = unlimited)")
+    parser.add_argument('--accounts', type=int, default=20, help="load generator sender accounts")
+    parser.add_argument('--unwrap', action='store_true', help="also unwrap every deposit on the destination chain")
+    args = parser.parse_args()
+
+    tests_path = Path(__file__).parent.absolute()
+    if args.load:
+        # contract_info.json, erc20s.csv and the bridge modules live in the repository root
+        repo_path = tests_path.parents[1]
+        sys.path.insert(0, str(repo_path))
+        make_load(args.load, args.rate, args.accounts, repo_path, tests_path / "eth_mnemonic.txt",
+                  repo_path / "erc20s.csv", tests_path / "ERC20ABI.json", unwrap=args.unwrap)
+    else:
+        final_score = validate(tests_path)
+        print(f"Score = {final_score}")
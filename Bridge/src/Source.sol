@@ -30,6 +30,18 @@ contract Source is AccessControl {
 
 	function withdraw(address _token, address _recipient, uint256 _amount ) onlyRole(WARDEN_ROLE) public {
 		//YOUR CODE HERE
+    _withdraw(_token, _recipient, _amount);
+	}
+
+	// Relays several unwraps in one transaction; emits one Withdrawal event per item, same as withdraw
+	function batchWithdraw(address[] calldata _tokens, address[] calldata _recipients, uint256[] calldata _amounts ) onlyRole(WARDEN_ROLE) public {
+    require(_tokens.length == _recipients.length && _recipients.length == _amounts.length, "Source: length mismatch");
+    for (uint256 i = 0; i < _amounts.length; i++) {
+      _withdraw(_tokens[i], _recipients[i], _amounts[i]);
+    }
+	}
+
+	function _withdraw(address _token, address _recipient, uint256 _amount ) internal {
     require(approved[_token], "Source: token not registered");
     require(ERC20(_token).balanceOf(address(this)) >= _amount, "Source: insufficient balance");
     ERC20(_token).transfer(_recipient, _amount);
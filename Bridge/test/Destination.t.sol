@@ -131,6 +131,118 @@ contract DestinationTest is Test {
 		destination.unwrap(wtoken, user, amount);
 
 		assertEq( ERC20(wtoken).balanceOf(user), prev_balance - amount );
-	}		
+	}
+
+	function testBatchWrap(address r1, address r2, uint256 amount) public {
+		vm.assume( r1 != address(0) );
+		vm.assume( r2 != address(0) );
+		vm.assume( r1 != r2 );
+		vm.assume( amount > 0 );
+		vm.assume( amount < max_amount / 3 );
+		address wtoken = testCreation();
+
+		address[] memory underlyings = new address[](3);
+		address[] memory recipients = new address[](3);
+		uint256[] memory amounts = new uint256[](3);
+		for (uint256 i = 0; i < 3; i++) {
+			underlyings[i] = address(underlying_token);
+			amounts[i] = amount;
+		}
+		recipients[0] = r1;
+		recipients[1] = r2;
+		recipients[2] = r1;
+
+		vm.expectEmit(true,true,true,true);
+		emit Wrap(address(underlying_token),wtoken,r1,amount);
+		vm.expectEmit(true,true,true,true);
+		emit Wrap(address(underlying_token),wtoken,r2,amount);
+		vm.expectEmit(true,true,true,true);
+		emit Wrap(address(underlying_token),wtoken,r1,amount);
+		vm.prank(admin);
+		destination.batchWrap(underlyings, recipients, amounts);
+
+		assertEq( ERC20(wtoken).balanceOf(r1), 2*amount );
+		assertEq( ERC20(wtoken).balanceOf(r2), amount );
+	}
+
+	function testUnapprovedBatchWrap(address user, address d_recipient, uint256 amount) public {
+		vm.assume( user != admin );
+		testCreation();
+
+		address[] memory underlyings = new address[](1);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](1);
+		underlyings[0] = address(underlying_token);
+		recipients[0] = d_recipient;
+		amounts[0] = amount;
+
+		vm.prank(user);
+		vm.expectRevert();
+		destination.batchWrap(underlyings, recipients, amounts);
+	}
+
+	function testBatchWrapLengthMismatch() public {
+		testCreation();
+
+		address[] memory underlyings = new address[](2);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](2);
+
+		vm.prank(admin);
+		vm.expectRevert("Destination: length mismatch");
+		destination.batchWrap(underlyings, recipients, amounts);
+	}
+
+	function testBatchWrapUnregistered(address token_address) public {
+		vm.assume( token_address != address(underlying_token) );
+		testCreation();
+
+		address[] memory underlyings = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](2);
+		underlyings[0] = address(underlying_token);
+		underlyings[1] = token_address;
+		recipients[0] = token_owner;
+		recipients[1] = token_owner;
+		amounts[0] = 1;
+		amounts[1] = 1;
+
+		// One bad item reverts the whole batch
+		vm.prank(admin);
+		vm.expectRevert("Destination: asset not registered");
+		destination.batchWrap(underlyings, recipients, amounts);
+	}
+
+	function testBatchWrapGas() public {
+		uint256 n = 20;
+		address wtoken = testCreation();
+
+		address[] memory underlyings = new address[](n);
+		address[] memory recipients = new address[](n);
+		uint256[] memory amounts = new uint256[](n);
+		for (uint256 i = 0; i < n; i++) {
+			underlyings[i] = address(underlying_token);
+			recipients[i] = vm.addr(i + 1);
+			amounts[i] = 100;
+		}
+
+		// Fresh recipients for the single wraps, so both sides pay for new balance slots
+		uint256 single_gas = 0;
+		for (uint256 i = 0; i < n; i++) {
+			vm.prank(admin);
+			uint256 before = gasleft();
+			destination.wrap(address(underlying_token), vm.addr(n + i + 1), 100);
+			single_gas += before - gasleft();
+		}
+
+		vm.prank(admin);
+		uint256 start = gasleft();
+		destination.batchWrap(underlyings, recipients, amounts);
+		uint256 batch_gas = start - gasleft();
+
+		assertEq( ERC20(wtoken).balanceOf(vm.addr(n)), 100 );
+		// gasleft() does not see the 21000 base cost, which the single wraps pay n times and the batch once
+		assertLt( batch_gas + 21000, single_gas + 21000 * n );
+	}
 
 }
@@ -159,4 +159,100 @@ contract SourceTest is Test {
 
     }
 
+    function testApprovedBatchWithdrawal(address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 10 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+		MToken token = MToken(token_address);
+		uint256 previous_balance = token.balanceOf(depositor);
+		uint256 previous_source_balance = token.balanceOf(address(source));
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](2);
+		tokens[0] = token_address;
+		tokens[1] = token_address;
+		recipients[0] = depositor;
+		recipients[1] = depositor;
+		amounts[0] = 10;
+		amounts[1] = amount - 10;
+
+		vm.expectEmit(true,true,false,true);
+		emit Withdrawal( token_address, depositor, 10 );
+		vm.expectEmit(true,true,false,true);
+		emit Withdrawal( token_address, depositor, amount - 10 );
+		vm.prank(admin);
+		source.batchWithdraw( tokens, recipients, amounts );
+
+		assertEq( amount, token.balanceOf(depositor) - previous_balance );
+		assertEq( amount, previous_source_balance - token.balanceOf(address(source)) );
+    }
+
+    function testUnapprovedBatchWithdrawal(address withdrawer, address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( withdrawer != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 20 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+
+		address[] memory tokens = new address[](1);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](1);
+		tokens[0] = token_address;
+		recipients[0] = depositor;
+		amounts[0] = amount - 10;
+
+		vm.prank(withdrawer);
+		vm.expectRevert();
+		source.batchWithdraw( tokens, recipients, amounts );
+    }
+
+    function testBatchWithdrawalLengthMismatch() public {
+		address[] memory tokens = new address[](1);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](1);
+
+		vm.prank(admin);
+		vm.expectRevert("Source: length mismatch");
+		source.batchWithdraw( tokens, recipients, amounts );
+    }
+
+    function testBatchWithdrawalInsufficientBalance(address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<249 );
+		vm.assume( amount > 10 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](2);
+		tokens[0] = token_address;
+		tokens[1] = token_address;
+		recipients[0] = depositor;
+		recipients[1] = depositor;
+		amounts[0] = amount;
+		amounts[1] = 1;
+
+		// The second item overdraws the bridge, so the whole batch reverts
+		vm.prank(admin);
+		vm.expectRevert("Source: insufficient balance");
+		source.batchWithdraw( tokens, recipients, amounts );
+    }
+
 }
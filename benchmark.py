@@ -0,0 +1,263 @@
+"""
+    Throughput benchmark for the bridge relayer
+    Starts two local anvil chains, deploys Source, Destination and an underlying BridgeToken from Bridge/src,
+    then generates N deposits (relayed by scan_blocks('source')) followed by N unwraps (relayed by
+    scan_blocks('destination')). Reports events per second, end-to-end latency percentiles and RPC calls
+    per event for each direction, as JSON, so results can be compared between versions.
+
+    Usage: python benchmark.py [-n 200] [--rate 0] [--batch-rpc] [--confirmations 0] [--out bench.json]
+    Needs anvil and forge (Foundry) on the PATH.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from web3 import Web3
+
+import bridge
+from bridge_metrics import METRICS
+from bridge_store import CONFIRMED
+
+
+BRIDGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Bridge")
+ANVIL_PORTS = {'source': 8545, 'destination': 8546}
+CHAIN_IDS = {'source': 43113, 'destination': 97}  # Same ids as Fuji and BSC testnet
+# anvil's default dev accounts: the first is the bridge admin and warden, the second generates traffic
+ADMIN_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+USER_KEY = "0x59c6995e998f97a5a0044966f0945389dc9e86dae88c7a8412f4603b6b78690d"
+EVENT_AMOUNT = 10**18  # Amount moved by every deposit and unwrap
+TX_GAS = 300000  # Gas limit for the generated transactions, so they skip eth_estimateGas
+RELAY_TIMEOUT = 600  # Seconds to wait for all events of one direction to be relayed
+SCAN_INTERVAL = 0.1  # Seconds between scan_blocks calls
+ANVIL_STARTUP = 10  # Seconds to wait for anvil to accept requests
+
+
+def start_anvil(chain, block_time=None):
+    """
+        Starts anvil for chain on ANVIL_PORTS[chain] and waits until it answers
+        block_time - (int) seconds per block; by default every transaction is mined immediately
+    """
+    cmd = ['anvil', '--port', str(ANVIL_PORTS[chain]), '--chain-id', str(CHAIN_IDS[chain]), '--silent']
+    if block_time:
+        cmd += ['--block-time', str(block_time)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    w3 = Web3(Web3.HTTPProvider(f"http://127.0.0.1:{ANVIL_PORTS[chain]}"))
+    deadline = time.time() + ANVIL_STARTUP
+    while time.time() < deadline:
+        if w3.is_connected():
+            return proc, w3
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"anvil for {chain} did not start on port {ANVIL_PORTS[chain]}")
+
+
+def load_artifact(name):
+    """
+        Returns (abi, bytecode) for contract name, building Bridge/ with forge if needed
+    """
+    path = os.path.join(BRIDGE_DIR, "out", f"{name}.sol", f"{name}.json")
+    if not os.path.exists(path):
+        subprocess.run(['forge', 'build'], cwd=BRIDGE_DIR, check=True)
+    with open(path) as f:
+        artifact = json.load(f)
+    return artifact['abi'], artifact['bytecode']['object']
+
+
+def transact(w3, key, call, nonce=None):
+    """
+        Signs and sends call (a contract function or constructor) from key's account
+        Returns the transaction hash without waiting for it to be mined
+    """
+    account = w3.eth.account.from_key(key)
+    tx = call.build_transaction({
+        'from': account.address,
+        'nonce': w3.eth.get_transaction_count(account.address, 'pending') if nonce is None else nonce,
+        'gas': TX_GAS,
+        'gasPrice': w3.eth.gas_price,
+    })
+    return w3.eth.send_raw_transaction(account.sign_transaction(tx).raw_transaction)
+
+
+def deploy(w3, name, *args):
+    abi, bytecode = load_artifact(name)
+    factory = w3.eth.contract(abi=abi, bytecode=bytecode)
+    account = w3.eth.account.from_key(ADMIN_KEY)
+    tx = factory.constructor(*args).build_transaction({
+        'from': account.address,
+        'nonce': w3.eth.get_transaction_count(account.address, 'pending'),
+    })
+    tx_hash = w3.eth.send_raw_transaction(account.sign_transaction(tx).raw_transaction)
+    rcpt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    return w3.eth.contract(address=rcpt.contractAddress, abi=abi)
+
+
+def setup(w3s, n, contract_info):
+    """
+        Deploys the bridge on both chains, registers one token and funds the traffic account
+        Writes the addresses, ABIs and warden key to contract_info in the format bridge.py reads
+        Returns (source, destination, token, wrapped) contract objects
+    """
+    admin = w3s['source'].eth.account.from_key(ADMIN_KEY).address
+    user = w3s['source'].eth.account.from_key(USER_KEY).address
+
+    source = deploy(w3s['source'], 'Source', admin)
+    token = deploy(w3s['source'], 'BridgeToken', admin, 'Benchmark Token', 'BNCH', admin)
+    destination = deploy(w3s['destination'], 'Destination', admin)
+
+    for chain, call in [('source', source.functions.registerToken(token.address)),
+                        ('source', token.functions.mint(user, n * EVENT_AMOUNT)),
+                        ('destination', destination.functions.createToken(token.address, 'Wrapped Benchmark', 'wBNCH'))]:
+        w3s[chain].eth.wait_for_transaction_receipt(transact(w3s[chain], ADMIN_KEY, call))
+    w3s['source'].eth.wait_for_transaction_receipt(
+        transact(w3s['source'], USER_KEY, token.functions.approve(source.address, n * EVENT_AMOUNT)))
+
+    wrapped_address = destination.functions.wrapped_tokens(token.address).call()
+    wrapped = w3s['destination'].eth.contract(address=wrapped_address, abi=token.abi)
+
+    with open(contract_info, 'w') as f:
+        json.dump({
+            'source': {'address': source.address, 'abi': source.abi, 'warden_key': ADMIN_KEY},
+            'destination': {'address': destination.address, 'abi': destination.abi, 'warden_key': ADMIN_KEY},
+        }, f)
+    return source, destination, token, wrapped
+
+
+def generate(w3, calls, rate, sent_at):
+    """
+        Sends calls from the traffic account back to back, or at rate transactions per second
+        Records the wall-clock send time of each transaction in sent_at (tx hash -> time)
+    """
+    account = w3.eth.account.from_key(USER_KEY)
+    nonce = w3.eth.get_transaction_count(account.address, 'pending')
+    start = time.time()
+    for i, call in enumerate(calls):
+        if rate:
+            time.sleep(max(0.0, start + i / rate - time.time()))
+        tx_hash = transact(w3, USER_KEY, call, nonce + i)
+        sent_at[Web3.to_hex(tx_hash)] = time.time()
+
+
+def rpc_calls():
+    counters = METRICS.snapshot()[0]
+    return sum(value for (name, _), value in counters.items() if name == 'rpc_requests')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run_direction(chain, w3, calls, args):
+    """
+        chain - (string) the chain the events are generated on
+        calls - (list) contract calls that each emit one bridge event
+        Generates the events on a background thread while scan_blocks relays them, until all are relayed
+        Returns the measurements for this direction
+    """
+    # Start the checkpoint just before the generated traffic, so nothing is missed or rescanned
+    bridge.save_cursor(chain, w3.eth.block_number, args.cursor_file)
+    sent_at = {}
+    calls_before = rpc_calls()
+
+    generator = threading.Thread(target=generate, args=(w3, calls, args.rate, sent_at))
+    start = time.time()
+    generator.start()
+
+    scans = 0
+    db = sqlite3.connect(args.relay_db)
+    done = {}
+    while len(done) < len(calls) and time.time() - start < RELAY_TIMEOUT:
+        bridge.scan_blocks(chain, args.contract_info, args.cursor_file, args.confirmations, args.batch_rpc,
+                           args.relay_db, args.net_window, event_cache=None)
+        scans += 1
+        time.sleep(SCAN_INTERVAL)
+        done = dict(db.execute("SELECT tx_hash, updated FROM relays WHERE chain = ? AND status = ?",
+                               (chain, CONFIRMED)).fetchall())
+    elapsed = time.time() - start
+    generator.join()
+    db.close()
+
+    latencies = [done[tx_hash] - sent for tx_hash, sent in sent_at.items() if tx_hash in done]
+    relayed = len(latencies)
+    calls_made = rpc_calls() - calls_before
+    return {
+        'events': len(calls),
+        'relayed': relayed,
+        'seconds': elapsed,
+        'scans': scans,
+        'events_per_second': relayed / elapsed if elapsed else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p90': percentile(latencies, 90),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': max(latencies) if latencies else None,
+        'rpc_calls': calls_made,
+        'rpc_calls_per_event': calls_made / relayed if relayed else None,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scan_blocks against a local anvil pair")
+    parser.add_argument('-n', type=int, default=200, help="events generated in each direction")
+    parser.add_argument('--rate', type=float, default=0, help="events per second to generate (0 = as fast as possible)")
+    parser.add_argument('--block-time', type=int, default=None, help="anvil block time (default: automine)")
+    parser.add_argument('--confirmations', type=int, default=0)
+    parser.add_argument('--batch-rpc', action='store_true')
+    parser.add_argument('--net-window', type=int, default=0)
+    parser.add_argument('--out', default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bridge_bench_")
+    args.contract_info = os.path.join(workdir, "contract_info.json")
+    args.cursor_file = os.path.join(workdir, "bridge_cursor.json")
+    args.relay_db = os.path.join(workdir, "bridge_relays.db")
+
+    procs = []
+    try:
+        w3s = {}
+        for chain in ANVIL_PORTS:
+            proc, w3s[chain] = start_anvil(chain, args.block_time)
+            procs.append(proc)
+            bridge.RPC_URLS[chain] = [f"http://127.0.0.1:{ANVIL_PORTS[chain]}"]
+
+        source, destination, token, wrapped = setup(w3s, args.n, args.contract_info)
+        user = w3s['source'].eth.account.from_key(USER_KEY).address
+
+        results = {}
+        deposits = [source.functions.deposit(token.address, user, EVENT_AMOUNT) for _ in range(args.n)]
+        results['deposit'] = run_direction('source', w3s['source'], deposits, args)
+        unwraps = [destination.functions.unwrap(wrapped.address, user, EVENT_AMOUNT) for _ in range(args.n)]
+        results['unwrap'] = run_direction('destination', w3s['destination'], unwraps, args)
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+    report = {
+        'version': git_version(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('contract_info', 'cursor_file', 'relay_db', 'out')},
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
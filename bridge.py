@@ -1,23 +1,171 @@
-from web3 import Web3
-from web3.providers.rpc import HTTPProvider
+from web3 import AsyncWeb3, Web3
+from web3.providers.rpc import AsyncHTTPProvider, HTTPProvider
+from web3.providers.persistent import WebSocketProvider
 from web3.middleware import ExtraDataToPOAMiddleware #Necessary for POA chains
+from web3.exceptions import TimeExhausted
 from datetime import datetime
+import asyncio
+import heapq
 import json
+import os
 import pandas as pd
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from random import uniform
+from requests import Session
+from requests.adapters import HTTPAdapter
+from bridge_events import AsyncLogQuery, ConfirmationBuffer, EventDecoder, LogQuery
+from bridge_metrics import METRICS, METRICS_PORT, count_requests, serve_metrics
+from bridge_receipts import get_receipt_tracker
+from bridge_rpc import RATE_LIMIT_PHRASES, RPCPool, is_throttled_error, limit_requests
+from bridge_store import CONFIRMED, PENDING, RELAY_DB, REVERTED, SENT, get_relay_index
 
 
-def connect_to(chain):
-    if chain == 'source':  # The source contract chain is avax
-        api_url = f"https://avalanche-fuji.core.chainstack.com/ext/bc/C/rpc/ba45fe90bc27fb4a71a9ae07fef143f3" #AVAX C-chain testnet
+# RPC endpoints for each chain, in order of preference. With more than one endpoint, requests go
+# through a bridge_rpc.RPCPool that picks the fastest healthy one and fails over between them.
+RPC_URLS = {
+    'source': [  # AVAX C-chain testnet
+        "https://avalanche-fuji.core.chainstack.com/ext/bc/C/rpc/ba45fe90bc27fb4a71a9ae07fef143f3",
+        "https://api.avax-test.network/ext/bc/C/rpc",
+    ],
+    'destination': [  # BSC testnet
+        "https://bsc-testnet.core.chainstack.com/617ec8fbe82ed75f59d20f6d3166a214",
+        "https://data-seed-prebsc-1-s1.binance.org:8545/",
+    ],
+}
 
-    if chain == 'destination':  # The destination contract chain is bsc
-        api_url = f"https://bsc-testnet.core.chainstack.com/617ec8fbe82ed75f59d20f6d3166a214" #BSC testnet
+# WebSocket endpoints for subscribe mode (same Chainstack nodes as RPC_URLS)
+WS_URLS = {
+    'source': "wss://avalanche-fuji.core.chainstack.com/ext/bc/C/ws/ba45fe90bc27fb4a71a9ae07fef143f3",
+    'destination': "wss://bsc-testnet.core.chainstack.com/ws/617ec8fbe82ed75f59d20f6d3166a214",
+}
 
-    if chain in ['source','destination']:
-        w3 = Web3(Web3.HTTPProvider(api_url))
-        # inject the poa compatibility middleware to the innermost layer
+# chain scanned -> (event to watch, function called on the other chain, event args passed to that function)
+RELAY_ROUTES = {
+    'source': ('Deposit', 'wrap', ('token', 'recipient', 'amount')),
+    'destination': ('Unwrap', 'withdraw', ('underlying_token', 'to', 'amount')),
+}
+
+# relay function -> the contract's batched version of it, which takes one array per argument
+RELAY_BATCH_FUNCTIONS = {'wrap': 'batchWrap', 'withdraw': 'batchWithdraw'}
+
+CURSOR_FILE = "bridge_cursor.json"  # Last fully processed block for each chain
+DEFAULT_LOOKBACK = 10  # How far back to look on a chain that has no checkpoint yet
+LOG_RETRIES = 5  # Attempts on a single block before it is skipped
+RANGE_RETRIES = 2  # Attempts on a multi-block range that fails for a reason other than its size, before it is bisected
+LOG_SPAN_PROBE = 20  # Requests served at an endpoint's span limit before the limit is doubled again
+# Phrases providers use when an eth_getLogs range or its result is too big (error messages are lowercased)
+LOG_RANGE_ERRORS = ('range', 'limit', 'exceed', 'too many', 'too large', 'too big', 'more than', 'response size')
+POLL_INTERVAL = 2  # Seconds between head checks in the relay daemon
+CONFIRMATIONS = {'source': 0, 'destination': 0}  # Default confirmation depth of each chain in the relay daemon
+WS_MAX_FAILURES = 5  # Consecutive WebSocket connection failures before falling back to polling
+HTTP_POOL_SIZE = 10  # Keep-alive connections kept open to each RPC endpoint
+GAS_CACHE_TTL = 300  # Seconds a cached gas estimate is trusted before it is refreshed
+GAS_CACHE_MARGIN = 20000  # Extra gas on top of cached estimates, covers a recipient's first balance slot
+FALLBACK_GAS = 200000  # Gas limit of a relay call that could not be estimated (always sent on its own)
+FEE_HISTORY_BLOCKS = 5  # Blocks sampled from eth_feeHistory for the priority fee
+FEE_PERCENTILE = 50  # Reward percentile used as the priority fee
+NET_WINDOW = 0  # Blocks over which repeat deposits to the same (token, recipient) are summed into one relay; 0 disables netting
+BACKFILL_CHUNK = 2000  # Blocks per eth_getLogs request when backfilling (capped by the endpoint's known limit)
+BACKFILL_WORKERS = 4  # Concurrent eth_getLogs requests per chain when backfilling, at most HTTP_POOL_SIZE
+BACKFILL_RELAY_WINDOW = 500  # Events relayed per window during a backfill
+BLOOM_MAX_SPAN = 10  # Below this eth_getLogs span limit, block headers' logsBloom is checked before querying logs
+BLOOM_BATCH = 100  # Block headers per batch request when checking logsBloom
+EVENT_CACHE_DIR = "bridge_event_cache"  # Default bridge_cache directory (see bridge_cache.py)
+EVENT_CACHE_DEPTH = 64  # Blocks are only cached once they are this deep, so reorgs can't leave stale events
+MAX_RELAY_BATCH = 25  # Events per batchWrap/batchWithdraw transaction, keeps each well under the block gas limit
+RELAY_TIMEOUT = 120  # Seconds to wait for a relay transaction's receipt
+
+# Largest block span each RPC endpoint has served after rejecting a bigger get_logs request
+_log_span_limit = {}
+# endpoint -> get_logs requests served at the span limit since it last changed
+_log_span_successes = {}
+_log_span_lock = threading.Lock()
+# (endpoint, address) -> NonceManager
+_nonce_managers = {}
+# endpoint -> chain id, so building a relay transaction never has to ask for it
+_chain_ids = {}
+# (contract address, function, token) -> (gas estimate, time it was taken)
+_gas_cache = {}
+# chain -> ConfirmationBuffer of events waiting to be deep enough to relay
+_confirmation_buffers = {}
+# chain -> last block scanned into the confirmation buffer (may run ahead of the durable cursor)
+_scan_positions = {}
+# chain -> (first block not cached yet, events released since then), for the blocks scan_blocks has
+# relayed but that are not deep enough to cache yet
+_cache_pending = {}
+# Serializes read-modify-write of the cursor file
+_cursor_lock = threading.Lock()
+
+# Process-wide client registry, so repeated scans pay no setup cost
+_registry_lock = threading.Lock()
+_sessions = {}  # endpoint -> keep-alive requests.Session
+_clients = {}  # (endpoints, batch) -> Web3
+_contract_files = {}  # contract_info path -> (mtime, parsed contents)
+_contracts = {}  # (contract_info path, chain, batch) -> (contract info it was built from, contract object)
+_decoders = {}  # (contract_info path, chain) -> (contract info it was built from, EventDecoder)
+
+
+def rpc_endpoints(chain):
+    """
+        Returns the list of RPC endpoints configured for chain (a single URL is accepted too)
+    """
+    urls = RPC_URLS[chain]
+    return [urls] if isinstance(urls, str) else list(urls)
+
+
+def get_session(api_url):
+    """
+        Returns the keep-alive requests.Session for api_url, creating it on first use
+        Must be called with _registry_lock held
+    """
+    if api_url not in _sessions:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[api_url] = session
+    return _sessions[api_url]
+
+
+def connect_to(chain, batch=False):
+    """
+        chain - (string) should be either "source" or "destination"
+        batch - (boolean) send independent reads made through rpc_batch as a single JSON-RPC batch request
+        Clients are cached, so every call for the same endpoints shares one Web3 instance and one
+        keep-alive HTTP session per endpoint (up to HTTP_POOL_SIZE connections)
+        Every request goes through its endpoint's bridge_rpc.RateLimiter
+    """
+    w3 = None
+    if chain in RPC_URLS:
+        api_urls = tuple(rpc_endpoints(chain))
+        with _registry_lock:
+            if (api_urls, batch) not in _clients:
+                sessions = {api_url: get_session(api_url) for api_url in api_urls}
+                if len(api_urls) > 1:
+                    provider = RPCPool(list(api_urls), sessions)
+                else:
+                    provider = limit_requests(Web3.HTTPProvider(api_urls[0], session=sessions[api_urls[0]],
+                                                                exception_retry_configuration=None))
+                w3 = Web3(count_requests(provider, chain))
+                # inject the poa compatibility middleware to the innermost layer
+                w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+                w3.batch_rpc = batch
+                _clients[(api_urls, batch)] = w3
+            w3 = _clients[(api_urls, batch)]
+    return w3
+
+
+async def connect_to_async(chain):
+    """
+        Same as connect_to, but returns an AsyncWeb3 instance for the relay daemon
+        The daemon talks to the chain's first (preferred) endpoint only
+    """
+    if chain in RPC_URLS:
+        provider = limit_requests(AsyncHTTPProvider(rpc_endpoints(chain)[0], exception_retry_configuration=None))
+        w3 = AsyncWeb3(count_requests(provider, chain))
         w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
     return w3
 
@@ -26,21 +174,891 @@ def get_contract_info(chain, contract_info):
     """
         Load the contract_info file into a dictionary
         This function is used by the autograder and will likely be useful to you
+        The parsed file is cached and only re-read when its modification time changes
     """
+    path = os.fspath(contract_info)
     try:
-        with open(contract_info, 'r')  as f:
-            contracts = json.load(f)
+        mtime = os.path.getmtime(path)
+        cached = _contract_files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r')  as f:
+                cached = (mtime, json.load(f))
+            _contract_files[path] = cached
     except Exception as e:
         print( f"Failed to read contract info\nPlease contact your instructor\n{e}" )
         return 0
-    return contracts[chain]
+    return cached[1][chain]
+
+
+def get_contract(chain, contract_info="contract_info.json", batch=False):
+    """
+        chain - (string) should be either "source" or "destination"
+        Returns (w3, contract) for the bridge contract on chain
+        The contract object is reused until contract_info changes on disk
+    """
+    info = get_contract_info(chain, contract_info)
+    w3 = connect_to(chain, batch)
+    key = (os.fspath(contract_info), chain, batch)
+    cached = _contracts.get(key)
+    if cached is None or cached[0] is not info or cached[1].w3 is not w3:
+        cached = (info, w3.eth.contract(address=info['address'], abi=info['abi']))
+        _contracts[key] = cached
+    return w3, cached[1]
+
 
+def get_decoder(chain, contract_info="contract_info.json"):
+    """
+        chain - (string) should be either "source" or "destination"
+        Returns the EventDecoder for the bridge contract on chain
+        The decoder is reused until contract_info changes on disk
+    """
+    info = get_contract_info(chain, contract_info)
+    key = (os.fspath(contract_info), chain)
+    cached = _decoders.get(key)
+    if cached is None or cached[0] is not info:
+        cached = (info, EventDecoder(info['abi']))
+        _decoders[key] = cached
+    return cached[1]
+
+
+def open_event_cache(event_cache):
+    """
+        event_cache - (string) bridge_cache directory, or None
+        Returns the bridge_cache.EventCache for event_cache, or None if it is not set
+        bridge_cache (and pyarrow) is only imported here, so the relayer runs without it; if it is not
+        installed the cache is skipped with a warning
+    """
+    if not event_cache:
+        return None
+    try:
+        from bridge_cache import get_event_cache
+    except ImportError as e:
+        print(f"[WARN] Event cache disabled, bridge_cache could not be imported: {e}")
+        return None
+    return get_event_cache(event_cache)
 
 
-def scan_blocks(chain, contract_info="contract_info.json"):
+def load_cursor(chain, cursor_file=CURSOR_FILE):
     """
         chain - (string) should be either "source" or "destination"
-        Scan the last 5 blocks of the source and destination chains
+        Returns the last fully processed block number for chain, or None if no checkpoint has been recorded
+    """
+    try:
+        with open(cursor_file, 'r') as f:
+            cursors = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print( f"Failed to read block cursor from {cursor_file}\n{e}" )
+        return None
+    return cursors.get(chain)
+
+
+def save_cursor(chain, block, cursor_file=CURSOR_FILE):
+    """
+        chain - (string) should be either "source" or "destination"
+        block - (int) the last block on chain whose events have all been relayed
+        The file is rewritten atomically so a crash mid-write never loses the other chain's checkpoint
+        Saves are serialized, since the chains may be backfilled or relayed from different threads
+    """
+    with _cursor_lock:
+        try:
+            with open(cursor_file, 'r') as f:
+                cursors = json.load(f)
+        except Exception:
+            cursors = {}
+        cursors[chain] = block
+
+        tmp_file = f"{cursor_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(cursors, f)
+        os.replace(tmp_file, cursor_file)
+
+
+def is_range_error(error):
+    """
+        Returns True if error (from a get_logs call) is the provider rejecting the block range or the size
+        of the result, rather than a transient failure such as a timeout or a 5xx
+    """
+    if is_throttled_error(error):
+        return False
+    message = str(error).lower()
+    if any(phrase in message for phrase in RATE_LIMIT_PHRASES):
+        return False
+    return any(phrase in message for phrase in LOG_RANGE_ERRORS)
+
+
+def record_log_span(endpoint, size):
+    """
+        Counts a get_logs request of size blocks that endpoint served
+        After LOG_SPAN_PROBE requests at the endpoint's span limit, the limit is doubled, so a limit learned
+        from a rejection is raised again once the provider keeps up; a probe that is rejected halves it back
+    """
+    with _log_span_lock:
+        span = _log_span_limit.get(endpoint)
+        if span is None or size < span:
+            return
+        _log_span_successes[endpoint] = _log_span_successes.get(endpoint, 0) + 1
+        if _log_span_successes[endpoint] >= LOG_SPAN_PROBE:
+            _log_span_limit[endpoint] = span * 2
+            _log_span_successes[endpoint] = 0
+
+
+def shrink_log_span(endpoint, size):
+    """
+        Records that endpoint rejected a get_logs range longer than size blocks
+    """
+    with _log_span_lock:
+        _log_span_limit[endpoint] = min(_log_span_limit.get(endpoint, size), size)
+        _log_span_successes[endpoint] = 0
+
+
+def log_fetch_plan(endpoint, start_blk, end_blk, retries=LOG_RETRIES, bloom=False):
+    """
+        endpoint - (string) the RPC endpoint the logs are read from, whose span limit is used and updated
+        start_blk, end_blk - (int) inclusive block range
+        bloom - (boolean) whether the query can be narrowed with block headers' logsBloom (see bloom_ranges)
+        The request plan shared by get_logs and get_logs_async, as a generator so the same splitting and
+        retry rules drive both the sync and the async client. It yields one step at a time and is sent
+        the step's result:
+        ('logs', lo, hi) - fetch the logs of blocks lo to hi; send the logs, or the exception raised
+        ('bloom', lo, hi, span) - send the ranges bloom_ranges keeps for lo to hi
+        ('sleep', seconds) - send None once the time has passed
+        Returns (logs, skipped) as the generator's return value
+    """
+    # Ranges are popped from the end, so they are always pushed latest first
+    pending = [(start_blk, end_blk)]
+    logs, skipped = [], []
+    while pending:
+        lo, hi = pending.pop()
+        span = _log_span_limit.get(endpoint)
+        if span and hi - lo + 1 > span:
+            if bloom and span <= BLOOM_MAX_SPAN:
+                ranges = yield ('bloom', lo, hi, span)
+            else:
+                # Only the first span is split off, so the rest is cut at whatever the limit is by then
+                ranges = [(lo, lo + span - 1), (lo + span, hi)]
+            pending.extend(ranges[::-1])
+            continue
+
+        # A single block gets every retry before it is skipped; a wider range is retried once, then bisected
+        attempts = retries if lo == hi else min(retries, RANGE_RETRIES)
+        split = False
+        for attempt in range(attempts):
+            if attempt:
+                yield ('sleep', min(2 ** attempt + uniform(0.1, 0.6), 10))
+            result = yield ('logs', lo, hi)
+            if not isinstance(result, Exception):
+                logs.extend(result)
+                record_log_span(endpoint, hi - lo + 1)
+                break
+            if lo < hi and is_range_error(result):
+                print(f"get_logs rejected blocks {lo}-{hi}, splitting range: {result}")
+                shrink_log_span(endpoint, (hi - lo) // 2 + 1)
+                split = True
+                break
+            print(f"Attempt {attempt + 1}/{attempts} failed on blocks {lo}-{hi}: {result}")
+        else:
+            if lo == hi:
+                print(f"[WARN] Skipped block {lo} after retries")
+                skipped.append(lo)
+            else:
+                # Still failing without saying the range is too big: try the halves, but keep the span
+                # limit, since the failure may have nothing to do with the range
+                split = True
+        if split:
+            mid = (lo + hi) // 2
+            pending.append((mid + 1, hi))
+            pending.append((lo, mid))
+
+    logs.sort(key=lambda log: (log.blockNumber, log.logIndex))
+    return logs, skipped
+
+
+def get_logs(event, start_blk, end_blk, retries=LOG_RETRIES):
+    """
+        event - (LogQuery or contract event object) e.g. contract.events.Deposit()
+        start_blk, end_blk - (int) inclusive block range
+        Fetch every log for event in the range with as few requests as the provider allows
+        The whole range is requested first. When the provider rejects it (range or result size limits,
+        see is_range_error) the range is bisected, and the span it accepts is remembered for that endpoint
+        so later calls start at a size it accepts; the span is raised again after LOG_SPAN_PROBE successes.
+        Other errors (timeouts, 5xx) are retried on the same range and, if it keeps failing, the range is
+        bisected without lowering the span. A single block that keeps failing is retried with backoff and
+        then skipped.
+        When that span is at most BLOOM_MAX_SPAN blocks and event is a LogQuery, only the blocks whose
+        logsBloom may hold the event are queried (see bloom_ranges).
+        Returns (logs, skipped) where logs are sorted by (blockNumber, logIndex) and skipped is the
+        sorted list of blocks that could not be read
+    """
+    if start_blk > end_blk:
+        return [], []
+
+    plan = log_fetch_plan(event.w3.provider.endpoint_uri, start_blk, end_blk, retries, hasattr(event, 'might_match'))
+    result = None
+    try:
+        while True:
+            step = plan.send(result)
+            if step[0] == 'logs':
+                try:
+                    result = event.get_logs(from_block=step[1], to_block=step[2])
+                except Exception as e:
+                    result = e
+            elif step[0] == 'bloom':
+                result = bloom_ranges(event, *step[1:])
+            else:
+                time.sleep(step[1])
+                result = None
+    except StopIteration as done:
+        return done.value
+
+
+def bloom_keep(query, start_blk, headers, span):
+    """
+        query - (LogQuery) the events to look for
+        start_blk - (int) number of the first header
+        headers - (list) raw block headers of consecutive blocks from start_blk, None for any that couldn't be read
+        span - (int) the most blocks one eth_getLogs request may cover
+        Keeps the blocks whose logsBloom may contain a log of query (blocks whose header or bloom can't be
+        read are kept too)
+        Returns the kept blocks as ranges of consecutive blocks, at most span long, in order
+    """
+    ranges = []
+    for n, header in enumerate(headers, start_blk):
+        if header is not None and header.get('logsBloom') and not query.might_match(header['logsBloom']):
+            continue
+        if ranges and ranges[-1][1] == n - 1 and n - ranges[-1][0] < span:
+            ranges[-1] = (ranges[-1][0], n)
+        else:
+            ranges.append((n, n))
+    if query.chain is not None:
+        METRICS.inc('blocks_bloom_skipped', len(headers) - sum(hi - lo + 1 for lo, hi in ranges), chain=query.chain)
+    return ranges
+
+
+def header_requests(lo, hi):
+    return [('eth_getBlockByNumber', [hex(n), False]) for n in range(lo, hi + 1)]
+
+
+def bloom_ranges(query, start_blk, end_blk, span, workers=1):
+    """
+        query - (LogQuery) the events to look for
+        start_blk, end_blk - (int) inclusive block range
+        span - (int) the most blocks one eth_getLogs request may cover
+        workers - (int) header batches fetched concurrently
+        Reads the block headers in batches of BLOOM_BATCH and filters them with bloom_keep
+        Returns the kept blocks as ranges of consecutive blocks, at most span long, in order
+    """
+    batches = [(lo, min(lo + BLOOM_BATCH - 1, end_blk)) for lo in range(start_blk, end_blk + 1, BLOOM_BATCH)]
+    read = lambda r: rpc_batch(query.w3, header_requests(*r), batch=True)
+    if workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            headers = [header for result in pool.map(read, batches) for header in result]
+    else:
+        headers = [header for r in batches for header in read(r)]
+    return bloom_keep(query, start_blk, headers, span)
+
+
+async def bloom_ranges_async(query, start_blk, end_blk, span):
+    """
+        Same as bloom_ranges, for an AsyncLogQuery
+        The header batches are sent concurrently
+    """
+    async def read(lo, hi):
+        requests = header_requests(lo, hi)
+        responses = await query.w3.provider.make_batch_request(requests)
+        if not isinstance(responses, list):
+            responses = await asyncio.gather(*[query.w3.provider.make_request(method, params)
+                                               for method, params in requests])
+        return [None if 'error' in resp else resp.get('result') for resp in responses]
+
+    results = await asyncio.gather(*[read(lo, min(lo + BLOOM_BATCH - 1, end_blk))
+                                     for lo in range(start_blk, end_blk + 1, BLOOM_BATCH)])
+    return bloom_keep(query, start_blk, [header for result in results for header in result], span)
+
+
+class NonceManager:
+    """
+        Hands out nonces for one account locally so transactions can be sent back to back
+        The pending transaction count is read from the chain once, then incremented locally.
+        Call settle() once an allocated nonce's transaction is mined, or was never sent, and resync()
+        after a failed send or a receipt timeout so the next nonce matches the chain again.
+    """
+    def __init__(self, w3, address):
+        self.w3 = w3
+        self.address = address
+        self.next_nonce = None
+        self.in_flight = 0  # Nonces allocated whose transactions have not been settled
+        self.lock = threading.Lock()
+
+    def allocate(self):
+        with self.lock:
+            if self.next_nonce is None:
+                self.next_nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            self.in_flight += 1
+            return nonce
+
+    def settle(self):
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+
+    def resync(self, abandoned=False):
+        """
+            abandoned - (boolean) the transactions in flight will not be waited on any more (e.g. after a
+                receipt timeout), so none are counted as in flight
+        """
+        with self.lock:
+            self.next_nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+            if abandoned:
+                self.in_flight = 0
+
+    def prime(self, pending_nonce):
+        """
+            Use a pending transaction count that was fetched elsewhere (e.g. in a batch)
+            A local count that is already ahead of it is kept while transactions are in flight. Once none
+            are, the chain's count is used even if it is lower, so a gap left by a dropped transaction is
+            filled instead of every later transaction queueing behind it.
+        """
+        with self.lock:
+            if self.in_flight:
+                self.next_nonce = max(self.next_nonce or 0, pending_nonce)
+            else:
+                self.next_nonce = pending_nonce
+
+
+def get_nonce_manager(w3, address):
+    """
+        Returns the NonceManager for address on the chain w3 is connected to
+        One manager is kept per (endpoint, account) for the life of the process
+    """
+    key = (w3.provider.endpoint_uri, address)
+    if key not in _nonce_managers:
+        _nonce_managers[key] = NonceManager(w3, address)
+    return _nonce_managers[key]
+
+
+def get_chain_id(w3):
+    """
+        Returns the chain id of the chain w3 is connected to, read from the node once per endpoint
+    """
+    endpoint = w3.provider.endpoint_uri
+    if endpoint not in _chain_ids:
+        _chain_ids[endpoint] = w3.eth.chain_id
+    return _chain_ids[endpoint]
+
+
+async def get_chain_id_async(w3):
+    """
+        Same as get_chain_id, for an AsyncWeb3 connection
+    """
+    endpoint = w3.provider.endpoint_uri
+    if endpoint not in _chain_ids:
+        _chain_ids[endpoint] = await w3.eth.chain_id
+    return _chain_ids[endpoint]
+
+
+def rpc_batch(w3, requests, batch=None):
+    """
+        w3 - (Web3) connection from connect_to
+        requests - (list) (method, params) JSON-RPC calls that do not depend on each other
+        batch - (boolean) overrides whether to batch; by default the calls are sent as one JSON-RPC batch
+            if w3 was created with connect_to(chain, batch=True), otherwise as one request each
+        Returns the raw results in request order, with None for any call that returned an error
+    """
+    responses = None
+    if getattr(w3, 'batch_rpc', False) if batch is None else batch:
+        responses = w3.provider.make_batch_request(requests)
+        if not isinstance(responses, list):
+            print(f"Batch request rejected, falling back to single requests: {responses.get('error')}")
+            w3.batch_rpc = False
+            responses = None
+    if responses is None:
+        responses = [w3.provider.make_request(method, params) for method, params in requests]
+    return [None if 'error' in resp else resp.get('result') for resp in responses]
+
+
+def relay_read_requests(contract, function, args_list, signer):
+    """
+        contract - (contract object) bridge contract on the chain the relay transactions will be sent on
+        function - (string) 'wrap' or 'withdraw'
+        args_list - (list of tuples) arguments of every relay call in the window
+        signer - (account object) the warden account
+        Returns (requests, stale) where requests are the JSON-RPC reads a relay window needs: gas price,
+        fee history, the warden's pending nonce, and an estimate for each (function, token) whose
+        cached gas estimate is missing or older than GAS_CACHE_TTL. stale lists the gas cache keys
+        being estimated, in request order.
+    """
+    requests = [
+        ('eth_gasPrice', []),
+        ('eth_feeHistory', [hex(FEE_HISTORY_BLOCKS), 'latest', [FEE_PERCENTILE]]),
+        ('eth_getTransactionCount', [signer.address, 'pending']),
+    ]
+    now = time.time()
+    stale = []
+    for args in args_list:
+        key = (contract.address, function, args[0])
+        cached = _gas_cache.get(key)
+        if (cached is None or now - cached[1] > GAS_CACHE_TTL) and key not in stale:
+            stale.append(key)
+            requests.append(('eth_estimateGas', [{
+                'from': signer.address,
+                'to': contract.address,
+                'data': contract.encode_abi(function, args=args),
+            }]))
+    return requests, stale
+
+
+def fee_fields(gas_price, fee_history):
+    """
+        gas_price - (string) raw eth_gasPrice result
+        fee_history - (dict) raw eth_feeHistory result
+        Returns the fee fields for a relay transaction
+        Chains with a non-zero base fee get an EIP-1559 (type 2) transaction: the tip is the median
+        FEE_PERCENTILE reward of the sampled blocks, and the fee cap leaves room for the base fee to
+        double. Other chains get a legacy gasPrice.
+    """
+    gas_price = int(gas_price, 16) if gas_price else None
+    base_fees = (fee_history or {}).get('baseFeePerGas') or []
+    base_fee = int(base_fees[-1], 16) if base_fees else 0  # the last entry is the next block's base fee
+    if base_fee == 0:
+        return {'gasPrice': gas_price}
+
+    tips = sorted(int(reward[0], 16) for reward in fee_history.get('reward') or [] if reward)
+    if tips:
+        priority_fee = tips[len(tips) // 2]
+    else:
+        priority_fee = max((gas_price or base_fee) - base_fee, 0)
+    return {'type': 2, 'maxFeePerGas': 2 * base_fee + priority_fee, 'maxPriorityFeePerGas': priority_fee}
+
+
+def apply_relay_reads(results, stale, contract, function, args_list, nonces=None):
+    """
+        results - (list) raw results for the requests built by relay_read_requests
+        stale - (list) gas cache keys returned by relay_read_requests
+        Updates the gas cache (and nonces, if given) from the results
+        Returns (fees, gas_limits) for the calls in args_list. The gas limit of a call whose token has no
+        usable estimate is None: the estimate most likely failed because the call would revert.
+    """
+    gas_price, fee_history, pending_nonce = results[:3]
+    if nonces is not None and pending_nonce:
+        nonces.prime(int(pending_nonce, 16))
+
+    now = time.time()
+    for key, gas in zip(stale, results[3:]):
+        if gas:
+            _gas_cache[key] = (int(gas, 16), now)
+
+    gas_limits = []
+    for args in args_list:
+        cached = _gas_cache.get((contract.address, function, args[0]))
+        gas_limits.append(int(cached[0] * 1.2) + GAS_CACHE_MARGIN if cached else None)
+    return fee_fields(gas_price, fee_history), gas_limits
+
+
+def prefetch_relay_reads(w3, contract, function, args_list, signer, nonces):
+    """
+        w3 - (Web3) connection to the chain the relay transactions will be sent on
+        contract - (contract object) bridge contract on that chain
+        function - (string) 'wrap' or 'withdraw'
+        args_list - (list of tuples) arguments of every relay call in the window
+        signer - (account object) the warden account
+        nonces - (NonceManager) nonce allocator for signer on this chain
+        Fetch everything a relay window needs (see relay_read_requests) together, in one round trip
+        when batching is on
+        Returns (fees, gas_limits)
+    """
+    requests, stale = relay_read_requests(contract, function, args_list, signer)
+    results = rpc_batch(w3, requests)
+    if not results[0]:
+        results[0] = hex(w3.eth.gas_price)
+    return apply_relay_reads(results, stale, contract, function, args_list, nonces)
+
+
+def net_events(events, arg_names, net_window=NET_WINDOW):
+    """
+        events - (list) decoded events to relay, in (blockNumber, logIndex) order
+        arg_names - (tuple) the event args passed to the relay function; the last one is the amount
+        net_window - (int) how many blocks a group may span; 0 relays every event on its own
+        Sum the amounts of events that go to the same (token, recipient), so each group needs only one relay
+        A group is closed once an event arrives net_window or more blocks after the group's first event
+        Returns (groups, args_list): the events folded into each relay, and that relay's arguments
+    """
+    if net_window <= 0:
+        return [[evt] for evt in events], [tuple(getattr(evt, a) for a in arg_names) for evt in events]
+
+    open_groups = {}  # (token, recipient) -> index of the group still accepting events
+    groups, args_list = [], []
+    for evt in events:
+        key = tuple(getattr(evt, a) for a in arg_names[:-1])
+        n = open_groups.get(key)
+        if n is None or evt.blockNumber - groups[n][0].blockNumber >= net_window:
+            open_groups[key] = len(groups)
+            groups.append([evt])
+            args_list.append(key + (getattr(evt, arg_names[-1]),))
+        else:
+            groups[n].append(evt)
+            args_list[n] = key + (args_list[n][-1] + getattr(evt, arg_names[-1]),)
+    return groups, args_list
+
+
+def relay_batches(contract, function, groups, args_list, gas_limits, max_batch=MAX_RELAY_BATCH):
+    """
+        contract - (contract object) bridge contract on the chain the relay transactions will be sent on
+        function - (string) 'wrap' or 'withdraw'
+        groups - (list) for each relay call, the events folded into it (see net_events)
+        args_list - (list of tuples) the arguments of each relay call
+        gas_limits - (list) the gas limit of each single relay call, from apply_relay_reads (None if it
+            could not be estimated)
+        Group the relay calls into transactions of at most max_batch calls each
+        A batch reverts as a whole, so calls that could not be estimated are never batched: each gets its
+        own transaction with FALLBACK_GAS, and only that call fails if it reverts
+        If the deployed contract has no batch function, every call gets its own transaction
+        Returns a list of (function, args, events, gas_limit), one per transaction
+    """
+    batch_function = RELAY_BATCH_FUNCTIONS.get(function)
+    has_batch = any(item.get('name') == batch_function for item in contract.abi)
+    if not has_batch or max_batch < 2:
+        return [(function, args, group, gas or FALLBACK_GAS) for group, args, gas in zip(groups, args_list, gas_limits)]
+
+    batches = [(function, args, group, FALLBACK_GAS)
+               for group, args, gas in zip(groups, args_list, gas_limits) if gas is None]
+    calls = [(group, args, gas) for group, args, gas in zip(groups, args_list, gas_limits) if gas is not None]
+    for i in range(0, len(calls), max_batch):
+        chunk = calls[i:i + max_batch]
+        events = [evt for group, _, _ in chunk for evt in group]
+        if len(chunk) == 1:
+            batches.append((function, chunk[0][1], events, chunk[0][2]))
+            continue
+        # The single-call estimates include the base transaction cost once per call, so their sum
+        # is a safe upper bound for the batch
+        columns = tuple(list(column) for column in zip(*[args for _, args, _ in chunk]))
+        batches.append((batch_function, columns, events, sum(gas for _, _, gas in chunk)))
+    return batches
+
+
+def send_relay(w3, contract, function, args, signer, nonces, fees, gas_limit, chain=None):
+    """
+        w3 - (Web3) connection to the chain the relay transaction is sent on
+        contract - (contract object) bridge contract on that chain
+        function - (string) 'wrap' or 'withdraw', or their batched versions from RELAY_BATCH_FUNCTIONS
+        args - (tuple) the function arguments, in order
+        signer - (account object) the warden account
+        nonces - (NonceManager) nonce allocator for signer on this chain
+        fees - (dictionary) fee fields from fee_fields
+        gas_limit - (int) gas limit for the transaction
+        chain - (string) chain the relayed events came from, used as the metrics label
+        Sign and send one relay transaction without waiting for it to be mined
+        Returns the transaction hash
+    """
+    with METRICS.timer('sign', chain=chain):
+        tx = getattr(contract.functions, function)(*args).build_transaction({
+            'from': signer.address,
+            'chainId': get_chain_id(w3),
+            'nonce': nonces.allocate(),
+            'gas': gas_limit,
+            **fees
+        })
+        signed_tx = w3.eth.account.sign_transaction(tx, signer.key)
+
+    try:
+        with METRICS.timer('send', chain=chain):
+            tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    except Exception:
+        # The allocated nonce was never used, so the local count is now ahead of the chain
+        nonces.settle()
+        nonces.resync()
+        raise
+    print(f"{function} TX sent: {tx_hash.hex()}")
+    return tx_hash
+
+
+async def get_logs_async(event, start_blk, end_blk, retries=LOG_RETRIES):
+    """
+        Same as get_logs, for an event on an AsyncWeb3 contract
+        Follows the same log_fetch_plan, so it shares the per-endpoint span limits with get_logs
+    """
+    if start_blk > end_blk:
+        return [], []
+
+    plan = log_fetch_plan(event.w3.provider.endpoint_uri, start_blk, end_blk, retries, hasattr(event, 'might_match'))
+    result = None
+    try:
+        while True:
+            step = plan.send(result)
+            if step[0] == 'logs':
+                try:
+                    result = await event.get_logs(from_block=step[1], to_block=step[2])
+                except Exception as e:
+                    result = e
+            elif step[0] == 'bloom':
+                result = await bloom_ranges_async(event, *step[1:])
+            else:
+                await asyncio.sleep(step[1])
+                result = None
+    except StopIteration as done:
+        return done.value
+
+
+def get_confirmation_buffer(chain, depth):
+    """
+        Returns the ConfirmationBuffer for chain, which lives for the whole process
+        Changing depth between calls keeps the buffered events
+    """
+    if chain not in _confirmation_buffers:
+        _confirmation_buffers[chain] = ConfirmationBuffer(depth)
+    _confirmation_buffers[chain].depth = depth
+    return _confirmation_buffers[chain]
+
+
+def get_block_hashes(w3, buffer, head):
+    """
+        buffer - (ConfirmationBuffer) buffer whose due blocks should be checked
+        head - (int) current head of the chain
+        Returns {block number: canonical block hash} for the blocks in buffer that are due at head,
+        fetched with rpc_batch. Blocks that could not be fetched are left out.
+    """
+    due = buffer.due(head)
+    if not buffer.depth or not due:
+        # Nothing has been built on top of these blocks yet, so the hash from the log is as current as it gets
+        return {n: buffer.blocks[n][0] for n in due}
+    results = rpc_batch(w3, [('eth_getBlockByNumber', [hex(n), False]) for n in due])
+    return {n: block['hash'] for n, block in zip(due, results) if block}
+
+
+def release_events(chain, buffer, hashes, head, scanned_blk):
+    """
+        chain - (string) the chain the events were read from
+        buffer - (ConfirmationBuffer) the chain's buffer
+        hashes - (dictionary) block number -> canonical hash for the due blocks, from get_block_hashes
+        head - (int) current head of chain
+        scanned_blk - (int) last block that has been scanned into buffer
+        Releases the buffered events whose blocks are still canonical, and drops the rest
+        When orphaned events are found the scan position is rewound so the replacement blocks get rescanned
+        The scan position never moves past head - depth: the blocks above it can still be reorged (including
+        blocks that had no events when they were scanned), so they are scanned again on the next pass
+        Returns (ready, cursor_blk) where cursor_blk is the last block that can safely be checkpointed
+    """
+    ready, orphaned = buffer.release(hashes)
+
+    scanned_blk = min(scanned_blk, head - buffer.depth)
+    if orphaned:
+        METRICS.inc('events_orphaned', len(orphaned), chain=chain)
+        rewind_blk = min(evt.blockNumber for evt in orphaned) - 1
+        print(f"[{chain.upper()}] [WARN] Dropped {len(orphaned)} event(s) from reorged blocks, rescanning from {rewind_blk + 1}")
+        scanned_blk = min(scanned_blk, rewind_blk)
+    _scan_positions[chain] = scanned_blk
+
+    cursor_blk = scanned_blk
+    if buffer.oldest() is not None:
+        cursor_blk = min(cursor_blk, buffer.oldest() - 1)
+    METRICS.set('head_block', head, chain=chain)
+    METRICS.set('cursor_lag_blocks', head - cursor_blk, chain=chain)
+    METRICS.set('events_buffered', len(buffer), chain=chain)
+    return ready, cursor_blk
+
+
+def scan_start(chain, buffer, cursor_blk, head):
+    """
+        Returns the first block to scan: just past whatever has already been scanned into buffer,
+        or the last DEFAULT_LOOKBACK confirmed blocks if the chain has no checkpoint yet
+    """
+    scanned_blk = _scan_positions.get(chain, cursor_blk)
+    if cursor_blk is None or scanned_blk < cursor_blk:
+        scanned_blk = cursor_blk
+    return head - buffer.depth - DEFAULT_LOOKBACK if scanned_blk is None else scanned_blk + 1
+
+
+def record_relayed(chain, events, status):
+    """
+        Count events whose relay transaction was mined, and take them off the events_pending gauge
+    """
+    METRICS.inc('events_relayed', len(events), chain=chain, status=CONFIRMED if status else REVERTED)
+    METRICS.add('events_pending', -len(events), chain=chain)
+
+
+def get_relay_target(chain, contract_info="contract_info.json", batch_rpc=False):
+    """
+        Returns (other_w3, other_contract, signer, nonces) for relaying events from chain to the other chain
+    """
+    other = 'destination' if chain == 'source' else 'source'
+    other_w3, other_contract = get_contract(other, contract_info, batch=batch_rpc)
+    signer = other_w3.eth.account.from_key(get_contract_info(other, contract_info).get('warden_key'))
+    return other_w3, other_contract, signer, get_nonce_manager(other_w3, signer.address)
+
+
+def relay_logs(chain, logs, other_w3, other_contract, signer, nonces, index, net_window=NET_WINDOW):
+    """
+        chain - (string) the chain the events were emitted on
+        logs - (list) decoded events from chain, in (blockNumber, logIndex) order
+        other_w3, other_contract - (Web3, contract object) the bridge contract on the other chain
+        signer - (account object) the warden account on the other chain
+        nonces - (NonceManager) nonce allocator for signer on the other chain
+        index - (RelayIndex) events already relayed are skipped
+        net_window - (int) block window for netting repeat deposits, see net_events
+        Relay every event that has not been relayed yet and record the outcome in index
+    """
+    event_name = RELAY_ROUTES[chain][0]
+    events = index.unhandled(chain, logs)
+    print(f"Found {len(logs)} {event_name} event(s), {len(logs) - len(events)} already relayed")
+    METRICS.inc('events_found', len(logs), chain=chain)
+    METRICS.set('events_pending', len(events), chain=chain)
+    if events:
+        send_relays(chain, events, other_w3, other_contract, signer, nonces, index, net_window)
+
+
+def send_relays(chain, events, other_w3, other_contract, signer, nonces, index, net_window=NET_WINDOW,
+                max_batch=MAX_RELAY_BATCH):
+    """
+        events - (list) decoded events from chain that have not been relayed, in (blockNumber, logIndex) order
+        max_batch - (int) most relay calls per transaction, see relay_batches
+        The rest as in relay_logs
+        The relay transactions are sent back to back, then their receipts are awaited together through the
+        relay chain's shared ReceiptTracker. A batch reverts as a whole, so when one does its events are
+        set back to PENDING and relayed again with one transaction per call; only the calls that revert
+        on their own are recorded as REVERTED
+    """
+    function, arg_names = RELAY_ROUTES[chain][1:]
+    groups, args_list = net_events(events, arg_names, net_window)
+    if len(groups) < len(events):
+        print(f"Netted {len(events)} event(s) into {len(groups)} relay(s)")
+    with METRICS.timer('estimate', chain=chain):
+        fees, gas_limits = prefetch_relay_reads(other_w3, other_contract, function, args_list, signer, nonces)
+    index.mark(chain, events, PENDING)
+
+    tracker = get_receipt_tracker(other_w3)
+    sent = []
+    for idx, (call, args, batch, gas_limit) in enumerate(relay_batches(other_contract, function, groups, args_list,
+                                                                        gas_limits, max_batch)):
+        print(f"[{idx+1}] Calling {call}{args}")
+        tx_hash = send_relay(other_w3, other_contract, call, args, signer, nonces, fees, gas_limit, chain)
+        tracker.track(tx_hash)
+        index.mark(chain, batch, SENT, Web3.to_hex(tx_hash))
+        METRICS.inc('relay_transactions', chain=chain, function=call)
+        sent.append((call, batch, tx_hash))
+
+    retry = []
+    for n, (call, batch, tx_hash) in enumerate(sent):
+        try:
+            with METRICS.timer('confirm', chain=chain):
+                rcpt = tracker.wait(tx_hash, timeout=RELAY_TIMEOUT)
+        except TimeExhausted:
+            # The transaction may have been dropped (e.g. underpriced), and every later nonce would queue
+            # behind the gap it leaves, so start again from the chain's count. The events of this and the
+            # later transactions stay SENT until recover_relays looks them up on the next round
+            nonces.resync(abandoned=True)
+            for _, _, later_hash in sent[n + 1:]:
+                tracker.forget(later_hash)
+            raise
+        nonces.settle()
+        if rcpt.status:
+            print(f"{call} TX {tx_hash.hex()} ({len(batch)} event(s)) confirmed in block {rcpt.blockNumber}")
+        elif call != function:
+            print(f"[WARN] {call} TX {tx_hash.hex()} reverted in block {rcpt.blockNumber}, relaying its "
+                  f"{len(batch)} event(s) one call at a time")
+            index.mark(chain, batch, PENDING)
+            retry += batch
+            continue
+        else:
+            print(f"[WARN] {call} TX {tx_hash.hex()} ({len(batch)} event(s)) reverted in block {rcpt.blockNumber}")
+        index.mark(chain, batch, CONFIRMED if rcpt.status else REVERTED)
+        record_relayed(chain, batch, rcpt.status)
+
+    if retry:
+        send_relays(chain, sorted(retry, key=lambda evt: (evt.blockNumber, evt.logIndex)), other_w3, other_contract,
+                    signer, nonces, index, net_window, max_batch=1)
+
+
+def recover_relay(chain, index, relay_tx, events, sent_at, rcpt, known):
+    """
+        chain - (string) the chain the events were emitted on
+        index - (RelayIndex) the relay index
+        relay_tx - (string) hash of a relay transaction whose events are still SENT
+        events - (list) those events, from RelayIndex.sent
+        sent_at - (float) when they were marked SENT
+        rcpt - (dict) the transaction's raw receipt, or None if there is none yet
+        known - (boolean) False if the node has never heard of the transaction
+        Moves the events to CONFIRMED or REVERTED if the transaction was mined. A reverted transaction that
+        carried several events may have been a batch, so those go back to PENDING and are relayed again
+        (see send_relays). A transaction the node doesn't know was dropped and its events go back to PENDING,
+        but only once RELAY_TIMEOUT has passed since it was sent, since it may not have reached the node yet.
+        Anything else (still waiting in the mempool) is left SENT.
+    """
+    if rcpt:
+        status = CONFIRMED if int(rcpt['status'], 16) else REVERTED if len(events) == 1 else PENDING
+        print(f"[{chain.upper()}] Relay TX {relay_tx} ({len(events)} event(s)) was mined in block "
+              f"{int(rcpt['blockNumber'], 16)}, marking its events {status}")
+    elif not known and time.time() - sent_at > RELAY_TIMEOUT:
+        status = PENDING
+        print(f"[{chain.upper()}] [WARN] Relay TX {relay_tx} was dropped, relaying its {len(events)} event(s) again")
+    else:
+        return
+    index.mark(chain, events, status)
+
+
+def recover_relays(chain, w3, index):
+    """
+        chain - (string) the chain the events were emitted on
+        w3 - (Web3) connection to the other chain, where the relay transactions were sent
+        index - (RelayIndex) the relay index
+        Events stay SENT if the relayer stopped (or its receipt wait timed out) before their relay
+        transaction was mined, and SENT events are never relayed again. This looks up the receipt of every
+        relay transaction still SENT and settles its events with recover_relay. It is called at the start
+        of every relay round, and only costs a database lookup when nothing is left SENT.
+    """
+    sent = index.sent(chain)
+    if not sent:
+        return
+    receipts = rpc_batch(w3, [('eth_getTransactionReceipt', [relay_tx]) for relay_tx in sent])
+    for (relay_tx, (events, sent_at)), rcpt in zip(sent.items(), receipts):
+        known = True
+        if not rcpt:
+            resp = w3.provider.make_request('eth_getTransactionByHash', [relay_tx])
+            known = 'error' in resp or resp.get('result') is not None
+        recover_relay(chain, index, relay_tx, events, sent_at, rcpt, known)
+
+
+def cache_logs(chain, cache, address, event_name, released, first_blk, cache_blk):
+    """
+        chain - (string) the chain the events were read from
+        cache - (EventCache) the event cache
+        address - (string) the chain's bridge contract address
+        event_name - (string) the event scan_blocks relays on chain
+        released - (list) the events release_events returned this round
+        first_blk - (int) the first block after the checkpoint, where caching starts if nothing is pending
+        cache_blk - (int) last block that may be cached: checkpointed and EVENT_CACHE_DEPTH deep
+        Events are released ahead of the checkpoint (e.g. while an older block's hash can't be read), so
+        they are held in _cache_pending until their blocks can be cached; a range is only written once
+        every event released for it is in hand
+    """
+    pending_blk, pending = _cache_pending.get(chain, (first_blk, []))
+    pending = pending + released
+    if cache_blk >= pending_blk:
+        cache.write(chain, address, event_name, pending_blk, cache_blk,
+                    [evt for evt in pending if evt.blockNumber <= cache_blk])
+        pending_blk, pending = cache_blk + 1, [evt for evt in pending if evt.blockNumber > cache_blk]
+    _cache_pending[chain] = (pending_blk, pending)
+
+
+def scan_blocks(chain, contract_info="contract_info.json", cursor_file=CURSOR_FILE, confirmations=0, batch_rpc=False,
+                relay_db=RELAY_DB, net_window=NET_WINDOW, metrics_file=None, event_cache=EVENT_CACHE_DIR):
+    """
+        chain - (string) should be either "source" or "destination"
+        cursor_file - (string) where the last fully processed block of each chain is checkpointed
+        confirmations - (int) how many blocks must be built on an event's block before it is relayed
+            Blocks are scanned right up to the head; events wait in a ConfirmationBuffer until they are deep
+            enough, and events whose block was reorged out in the meantime are dropped. The last confirmations
+            blocks are scanned again on every call, so events a reorg adds to them are picked up too
+        batch_rpc - (boolean) combine the relay chain's independent reads into JSON-RPC batch requests
+        relay_db - (string) SQLite index of relayed events; events already relayed are skipped
+        net_window - (int) if > 0, deposits to the same (token, recipient) within this many blocks are summed
+            into one relay; every event is still recorded in relay_db against the transaction that relayed it
+        metrics_file - (string) if given, the bridge_metrics JSON dump is written here after the scan
+        event_cache - (string) bridge_cache directory the checkpointed blocks' events are appended to once they
+            are EVENT_CACHE_DEPTH deep, or None
+        Scan the blocks after the chain's checkpoint, up to the head
+        On the first run for a chain (no checkpoint yet) the last DEFAULT_LOOKBACK blocks are scanned
         Look for 'Deposit' events on the source chain and 'Unwrap' events on the destination chain
         When Deposit events are found on the source chain, call the 'wrap' function the destination chain
         When Unwrap events are found on the destination chain, call the 'withdraw' function on the source chain
@@ -52,117 +1070,484 @@ def scan_blocks(chain, contract_info="contract_info.json"):
         return 0
     
     #YOUR CODE HERE
-    w3 = connect_to(chain)
-    info = get_contract_info(chain, contract_info)
-    contract = w3.eth.contract(address=info['address'], abi=info['abi'])
+    w3, contract = get_contract(chain, contract_info)
 
-    end_blk = w3.eth.get_block_number()
-    start_blk = end_blk - 10
+    head = w3.eth.get_block_number()
+    last_blk = load_cursor(chain, cursor_file)
+    buffer = get_confirmation_buffer(chain, confirmations)
+    start_blk = scan_start(chain, buffer, last_blk, head)
 
-    print(f"[{chain.upper()}] Checking blocks {start_blk} to {end_blk}")
+    if start_blk > head and not buffer.due(head):
+        print(f"[{chain.upper()}] No new blocks since checkpoint {last_blk}")
+        return
 
-    if chain == 'source':
-        time.sleep(60)
+    print(f"[{chain.upper()}] Checking blocks {start_blk} to {head}")
 
-        dst_w3 = connect_to('destination')
-        dst_info = get_contract_info('destination', contract_info)
-        dst_contract = dst_w3.eth.contract(address=dst_info['address'], abi=dst_info['abi'])
+    event_name, function, arg_names = RELAY_ROUTES[chain]
+    other_w3, other_contract, signer, nonces = get_relay_target(chain, contract_info, batch_rpc)
+    index = get_relay_index(relay_db)
 
-        try:
-            deposits = contract.events.Deposit().get_logs(from_block=start_blk, to_block=end_blk)
-            deposits.sort(key=lambda log: (log.blockNumber, log.logIndex))
-            print(f"Detected {len(deposits)} deposit(s)")
+    try:
+        recover_relays(chain, other_w3, index)
+        query = LogQuery(w3, contract.address, get_decoder(chain, contract_info), [event_name], chain=chain)
+        logs, skipped = get_logs(query, start_blk, head) if start_blk <= head else ([], [])
+        buffer.add(logs)
+        # Never checkpoint past a block we failed to read
+        scanned_blk = skipped[0] - 1 if skipped else head
+        logs, cursor_blk = release_events(chain, buffer, get_block_hashes(w3, buffer, head), head, scanned_blk)
+        relay_logs(chain, logs, other_w3, other_contract, signer, nonces, index, net_window)
+        cache = open_event_cache(event_cache)
+        if cache:
+            cache_logs(chain, cache, contract.address, event_name, logs, start_blk if last_blk is None else last_blk + 1,
+                       min(cursor_blk, head - EVENT_CACHE_DEPTH))
+        save_cursor(chain, cursor_blk, cursor_file)
 
-            for idx, evt in enumerate(deposits):
-                token, user, amt = evt.args['token'], evt.args['recipient'], evt.args['amount']
-                print(f"[{idx+1}] Wrapping {amt} of token {token} to {user}")
+    except Exception as err:
+        # Released events may not have been relayed, so rescan from the checkpoint next time
+        _scan_positions.pop(chain, None)
+        _cache_pending.pop(chain, None)
+        METRICS.inc('scan_errors', chain=chain)
+        print(f"[ERROR] {function} phase failed: {err}")
 
-                key = dst_info.get('warden_key')
-                executor = dst_w3.eth.account.from_key(key)
-                nonce = dst_w3.eth.get_transaction_count(executor.address)
+    if metrics_file:
+        METRICS.dump_json(metrics_file)
 
-                try:
-                    gas = dst_contract.functions.wrap(token, user, amt).estimate_gas({'from': executor.address})
-                    limit = int(gas * 1.2)
-                except:
-                    limit = 200000
 
-                tx = dst_contract.functions.wrap(token, user, amt).build_transaction({
-                    'from': executor.address,
-                    'nonce': nonce,
-                    'gas': limit,
-                    'gasPrice': dst_w3.eth.gas_price
-                })
+def backfill_logs(query, from_block, to_block, chunk=BACKFILL_CHUNK, workers=BACKFILL_WORKERS):
+    """
+        query - (LogQuery) the events to fetch
+        from_block, to_block - (int) inclusive block range
+        Split the range into chunks (no bigger than the endpoint's known span limit) and fetch them with
+        get_logs on a pool of at most workers threads
+        With a span limit of at most BLOOM_MAX_SPAN blocks, only the blocks bloom_ranges keeps are fetched
+        Returns (logs, skipped) like get_logs, with the chunks merged in (blockNumber, logIndex) order
+    """
+    span = min(chunk, _log_span_limit.get(query.w3.provider.endpoint_uri, chunk))
+    if span <= BLOOM_MAX_SPAN:
+        ranges = bloom_ranges(query, from_block, to_block, span, workers)
+    else:
+        ranges = [(lo, min(lo + span - 1, to_block)) for lo in range(from_block, to_block + 1, span)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda r: get_logs(query, *r), ranges))
+    logs = list(heapq.merge(*[logs for logs, _ in results], key=lambda evt: (evt.blockNumber, evt.logIndex)))
+    skipped = sorted(blk for _, blocks in results for blk in blocks)
+    return logs, skipped
+
 
-                signed_tx = dst_w3.eth.account.sign_transaction(tx, key)
-                tx_hash = dst_w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-                print(f"Wrap TX submitted: {tx_hash.hex()}")
+def cached_logs(chain, w3, contract, decoder, event_name, from_block, to_block, head, event_cache=EVENT_CACHE_DIR,
+                workers=BACKFILL_WORKERS):
+    """
+        chain - (string) "source" or "destination"
+        w3, contract, decoder - connection, bridge contract and EventDecoder for chain
+        event_name - (string) the event to load
+        from_block, to_block - (int) inclusive block range
+        head - (int) current head of chain
+        event_cache - (string) bridge_cache directory, or None to always read from the provider
+        Blocks already in the event cache are read from disk; the rest are fetched with backfill_logs and,
+        once they are EVENT_CACHE_DEPTH blocks deep, added to the cache
+        Returns (logs, skipped, number of logs read from the cache), logs sorted by (blockNumber, logIndex)
+    """
+    cache = open_event_cache(event_cache)
+    cached, gaps = [], [(from_block, to_block)]
+    if cache:
+        cached = cache.read_events(chain, contract.address, event_name, decoder, from_block, to_block)
+        gaps = cache.missing(chain, contract.address, event_name, from_block, to_block)
 
-                rcpt = dst_w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-                print(f"Confirmed on block {rcpt.blockNumber}")
+    query = LogQuery(w3, contract.address, decoder, [event_name], chain=chain)
+    fetched, skipped = [], []
+    for lo, hi in gaps:
+        gap_logs, gap_skipped = backfill_logs(query, lo, hi, workers=workers)
+        if cache:
+            # Only cache blocks that were all read and are too deep to be reorged
+            cache_blk = min(head - EVENT_CACHE_DEPTH, gap_skipped[0] - 1 if gap_skipped else hi)
+            cache.write(chain, contract.address, event_name, lo, cache_blk,
+                        [evt for evt in gap_logs if evt.blockNumber <= cache_blk])
+        fetched.append(gap_logs)
+        skipped += gap_skipped
+    logs = list(heapq.merge(cached, *fetched, key=lambda evt: (evt.blockNumber, evt.logIndex)))
+    return logs, skipped, len(cached)
 
-                if idx + 1 < len(deposits):
-                    time.sleep(1)
 
+def load_events(chain, event_name, from_block, to_block=None, contract_info="contract_info.json",
+                event_cache=EVENT_CACHE_DIR, workers=BACKFILL_WORKERS):
+    """
+        chain - (string) "source" or "destination"
+        event_name - (string) any bridge event, e.g. "Wrap" or "Withdrawal"
+        from_block, to_block - (int) inclusive range; to_block defaults to the current head
+        Loads every event_name event of the chain's bridge contract in the range, through the event cache
+        Returns (logs, skipped)
+    """
+    w3, contract = get_contract(chain, contract_info)
+    head = w3.eth.get_block_number()
+    logs, skipped, _ = cached_logs(chain, w3, contract, get_decoder(chain, contract_info), event_name, from_block,
+                                   head if to_block is None else to_block, head, event_cache, workers)
+    return logs, skipped
+
+
+def backfill(chain, from_block, to_block=None, contract_info="contract_info.json", cursor_file=CURSOR_FILE,
+             batch_rpc=False, relay_db=RELAY_DB, net_window=NET_WINDOW, workers=BACKFILL_WORKERS,
+             event_cache=EVENT_CACHE_DIR):
+    """
+        chain - (string) "source" or "destination"
+        from_block, to_block - (int) inclusive range to backfill; to_block defaults to the current head
+        event_cache - (string) bridge_cache directory, or None to always read from the provider
+        Catch up on a range the relayer missed (e.g. after downtime): load the logs of the whole range with
+        cached_logs, then relay them through the normal relay path, BACKFILL_RELAY_WINDOW events at a
+        time. Events already in relay_db are skipped, so overlapping a range that was relayed is safe.
+        If the range reaches the chain's checkpoint and every block was read, the checkpoint is moved to
+        to_block.
+        Returns (number of events found, skipped blocks)
+    """
+    w3, contract = get_contract(chain, contract_info)
+    head = w3.eth.get_block_number()
+    if to_block is None:
+        to_block = head
+    event_name = RELAY_ROUTES[chain][0]
+    other_w3, other_contract, signer, nonces = get_relay_target(chain, contract_info, batch_rpc)
+    index = get_relay_index(relay_db)
+
+    print(f"[{chain.upper()}] Backfilling blocks {from_block} to {to_block} with {workers} workers")
+    start = time.time()
+    logs, skipped, from_cache = cached_logs(chain, w3, contract, get_decoder(chain, contract_info), event_name,
+                                            from_block, to_block, head, event_cache, workers)
+    print(f"[{chain.upper()}] Loaded {len(logs)} {event_name} event(s) ({from_cache} from the cache) in "
+          f"{time.time() - start:.1f}s, {len(skipped)} block(s) skipped")
+
+    recover_relays(chain, other_w3, index)
+    for i in range(0, len(logs), BACKFILL_RELAY_WINDOW):
+        relay_logs(chain, logs[i:i + BACKFILL_RELAY_WINDOW], other_w3, other_contract, signer, nonces, index,
+                   net_window)
+
+    last_blk = load_cursor(chain, cursor_file)
+    if not skipped and last_blk is not None and from_block <= last_blk + 1 <= to_block:
+        save_cursor(chain, to_block, cursor_file)
+    return len(logs), skipped
+
+
+def backfill_chains(ranges, contract_info="contract_info.json", cursor_file=CURSOR_FILE, batch_rpc=False,
+                    relay_db=RELAY_DB, net_window=NET_WINDOW, workers=BACKFILL_WORKERS, event_cache=EVENT_CACHE_DIR):
+    """
+        ranges - (dictionary) chain -> (from_block, to_block), to_block may be None for the head
+        Backfill several chains at once, each with its own pool of workers
+        Returns chain -> (number of events found, skipped blocks)
+    """
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = {chain: pool.submit(backfill, chain, lo, hi, contract_info, cursor_file, batch_rpc, relay_db,
+                                      net_window, workers, event_cache)
+                   for chain, (lo, hi) in ranges.items()}
+    return {chain: future.result() for chain, future in futures.items()}
+
+
+async def prefetch_relay_reads_async(w3, contract, function, args_list, signer):
+    """
+        Same as prefetch_relay_reads, for an AsyncWeb3 connection
+        The reads are sent concurrently rather than batched
+    """
+    requests, stale = relay_read_requests(contract, function, args_list, signer)
+    responses = await asyncio.gather(*[w3.provider.make_request(method, params) for method, params in requests])
+    results = [None if 'error' in resp else resp.get('result') for resp in responses]
+    if not results[0]:
+        results[0] = hex(await w3.eth.gas_price)
+    return apply_relay_reads(results, stale, contract, function, args_list)
+
+
+async def relay_event(w3, contract, function, args, signer, fees, gas_limit, on_sent=None, chain=None):
+    """
+        w3 - (AsyncWeb3) connection to the chain the relay transaction is sent on
+        contract - (contract object) bridge contract on that chain
+        function - (string) 'wrap' or 'withdraw', or their batched versions from RELAY_BATCH_FUNCTIONS
+        args - (tuple) the function arguments, in order
+        signer - (account object) the warden account
+        fees - (dictionary) fee fields from fee_fields
+        gas_limit - (int) gas limit for the transaction
+        on_sent - (function) called with the transaction hash once it has been broadcast
+        chain - (string) chain the relayed events came from, used as the metrics label
+        Sign and send one relay transaction and wait for it to be mined
+    """
+    with METRICS.timer('sign', chain=chain):
+        tx = await getattr(contract.functions, function)(*args).build_transaction({
+            'from': signer.address,
+            'chainId': await get_chain_id_async(w3),
+            'nonce': await w3.eth.get_transaction_count(signer.address, 'pending'),
+            'gas': gas_limit,
+            **fees
+        })
+        signed_tx = w3.eth.account.sign_transaction(tx, signer.key)
+
+    with METRICS.timer('send', chain=chain):
+        tx_hash = await w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    print(f"{function} TX sent: {tx_hash.hex()}")
+    METRICS.inc('relay_transactions', chain=chain, function=function)
+    if on_sent is not None:
+        on_sent(tx_hash)
+
+    with METRICS.timer('confirm', chain=chain):
+        rcpt = await w3.eth.wait_for_transaction_receipt(tx_hash, timeout=RELAY_TIMEOUT)
+    print(f"{function} confirmed in block {rcpt.blockNumber}")
+    return rcpt
+
+
+async def relay_events_async(chain, logs, other_w3, other_contract, signer, index, net_window=NET_WINDOW):
+    """
+        chain - (string) the chain the events were emitted on
+        logs - (list) decoded events from chain, in (blockNumber, logIndex) order
+        other_w3, other_contract - (AsyncWeb3, contract object) the bridge contract on the other chain
+        signer - (account object) the warden account on the other chain
+        index - (RelayIndex) events already relayed are skipped
+        net_window - (int) block window for netting repeat deposits, see net_events
+        Relay every event that has not been relayed yet and record the outcome in index
+    """
+    event_name = RELAY_ROUTES[chain][0]
+    METRICS.inc('events_found', len(logs), chain=chain)
+    events = index.unhandled(chain, logs)
+    if not events:
+        return
+
+    print(f"[{chain.upper()}] Relaying {len(events)} new {event_name} event(s)")
+    METRICS.add('events_pending', len(events), chain=chain)
+    await send_relays_async(chain, events, other_w3, other_contract, signer, index, net_window)
+
+
+async def send_relays_async(chain, events, other_w3, other_contract, signer, index, net_window=NET_WINDOW,
+                            max_batch=MAX_RELAY_BATCH):
+    """
+        Same as send_relays, for an AsyncWeb3 connection
+        Each relay transaction is awaited before the next one is sent
+    """
+    function, arg_names = RELAY_ROUTES[chain][1:]
+    groups, args_list = net_events(events, arg_names, net_window)
+    with METRICS.timer('estimate', chain=chain):
+        fees, gas_limits = await prefetch_relay_reads_async(other_w3, other_contract, function, args_list, signer)
+    index.mark(chain, events, PENDING)
+    retry = []
+    for call, args, batch, gas_limit in relay_batches(other_contract, function, groups, args_list, gas_limits,
+                                                      max_batch):
+        rcpt = await relay_event(other_w3, other_contract, call, args, signer, fees, gas_limit,
+                                 on_sent=lambda tx_hash, batch=batch: index.mark(chain, batch, SENT, Web3.to_hex(tx_hash)),
+                                 chain=chain)
+        if not rcpt.status and call != function:
+            print(f"[WARN] {call} reverted, relaying its {len(batch)} event(s) one call at a time")
+            index.mark(chain, batch, PENDING)
+            retry += batch
+            continue
+        index.mark(chain, batch, CONFIRMED if rcpt.status else REVERTED)
+        record_relayed(chain, batch, rcpt.status)
+
+    if retry:
+        await send_relays_async(chain, sorted(retry, key=lambda evt: (evt.blockNumber, evt.logIndex)), other_w3,
+                                other_contract, signer, index, net_window, max_batch=1)
+
+
+async def recover_relays_async(chain, w3, index):
+    """
+        Same as recover_relays, for an AsyncWeb3 connection
+        The lookups are sent concurrently rather than batched
+    """
+    sent = index.sent(chain)
+    if not sent:
+        return
+    responses = await asyncio.gather(*[w3.provider.make_request('eth_getTransactionReceipt', [relay_tx])
+                                       for relay_tx in sent])
+    for (relay_tx, (events, sent_at)), resp in zip(sent.items(), responses):
+        rcpt = resp.get('result')
+        known = True
+        if not rcpt:
+            resp = await w3.provider.make_request('eth_getTransactionByHash', [relay_tx])
+            known = 'error' in resp or resp.get('result') is not None
+        recover_relay(chain, index, relay_tx, events, sent_at, rcpt, known)
+
+
+async def connect_relay_target(chain, contract_info):
+    """
+        Returns (other_w3, other_contract, signer) for relaying events from chain to the other chain
+    """
+    other = 'destination' if chain == 'source' else 'source'
+    other_w3 = await connect_to_async(other)
+    other_info = get_contract_info(other, contract_info)
+    other_contract = other_w3.eth.contract(address=other_info['address'], abi=other_info['abi'])
+    signer = other_w3.eth.account.from_key(other_info['warden_key'])
+    return other_w3, other_contract, signer
+
+
+async def get_block_hashes_async(w3, buffer, head):
+    """
+        Same as get_block_hashes, for an AsyncWeb3 connection
+        The block lookups are sent concurrently rather than batched
+    """
+    due = buffer.due(head)
+    if not buffer.depth or not due:
+        return {n: buffer.blocks[n][0] for n in due}
+    responses = await asyncio.gather(*[w3.provider.make_request('eth_getBlockByNumber', [hex(n), False])
+                                       for n in due])
+    return {n: resp['result']['hash'] for n, resp in zip(due, responses) if resp.get('result')}
+
+
+async def relay_released(chain, w3, buffer, head, scanned_blk, other_w3, other_contract, signer, index, cursor_file):
+    """
+        w3 - (AsyncWeb3) connection to chain
+        buffer - (ConfirmationBuffer) the chain's buffer
+        head - (int) current head of chain
+        scanned_blk - (int) last block that has been scanned into buffer
+        Releases the buffered events that are confirmed at head (see release_events), relays them to the
+        other chain and checkpoints chain
+    """
+    hashes = await get_block_hashes_async(w3, buffer, head)
+    logs, cursor_blk = release_events(chain, buffer, hashes, head, scanned_blk)
+    await relay_events_async(chain, logs, other_w3, other_contract, signer, index)
+    save_cursor(chain, cursor_blk, cursor_file)
+
+
+async def relay_chain(chain, contract_info="contract_info.json", cursor_file=CURSOR_FILE, confirmations=0,
+                      poll_interval=POLL_INTERVAL, relay_db=RELAY_DB):
+    """
+        chain - (string) the chain to watch, either "source" or "destination"
+        Watch chain for new heads and relay its bridge events to the other chain as soon as they appear
+        Deposits on the source chain are wrapped on the destination chain, and Unwraps on the
+        destination chain are withdrawn on the source chain. Runs until cancelled.
+        Events are held back until confirmations blocks have been built on top of them, and dropped if
+        their block is reorged out first.
+    """
+    event_name = RELAY_ROUTES[chain][0]
+
+    w3 = await connect_to_async(chain)
+    info = get_contract_info(chain, contract_info)
+    event = AsyncLogQuery(w3, info['address'], get_decoder(chain, contract_info), [event_name], chain=chain)
+    other_w3, other_contract, signer = await connect_relay_target(chain, contract_info)
+    index = get_relay_index(relay_db)
+
+    buffer = get_confirmation_buffer(chain, confirmations)
+    while True:
+        try:
+            await recover_relays_async(chain, other_w3, index)
+            head = await w3.eth.block_number
+            start_blk = scan_start(chain, buffer, load_cursor(chain, cursor_file), head)
+
+            if start_blk <= head or buffer.due(head):
+                logs, skipped = await get_logs_async(event, start_blk, head) if start_blk <= head else ([], [])
+                buffer.add(logs)
+                # Never checkpoint past a block we failed to read
+                scanned_blk = skipped[0] - 1 if skipped else head
+                await relay_released(chain, w3, buffer, head, scanned_blk, other_w3, other_contract, signer,
+                                     index, cursor_file)
         except Exception as err:
-            print(f"[ERROR] Wrap phase failed: {err}")
+            _scan_positions.pop(chain, None)
+            print(f"[{chain.upper()}] [ERROR] Relay round failed: {err}")
 
-    elif chain == 'destination':
-        time.sleep(30)
+        await asyncio.sleep(poll_interval)
 
-        src_w3 = connect_to('source')
-        src_info = get_contract_info('source', contract_info)
-        src_contract = src_w3.eth.contract(address=src_info['address'], abi=src_info['abi'])
 
-        unwrap_logs = []
-        retries = 5
-        print(f"Monitoring Unwrap events one block at a time...")
+async def subscribe_chain(chain, contract_info="contract_info.json", cursor_file=CURSOR_FILE, confirmations=0,
+                          poll_interval=POLL_INTERVAL, relay_db=RELAY_DB, ws_url=None):
+    """
+        chain - (string) the chain to watch, either "source" or "destination"
+        ws_url - (string) WebSocket endpoint for chain (defaults to WS_URLS[chain])
+        Same as relay_chain, but events are pushed over an eth_subscribe('logs') stream into the chain's
+        ConfirmationBuffer, and released on every head pushed over eth_subscribe('newHeads') once they are
+        confirmations deep. Events whose block was reorged out are dropped at release (the replacement
+        block's logs are pushed by the stream), so removed logs need no handling of their own.
+        On every (re)connect the gap since the scan position is backfilled with eth_getLogs; blocks it
+        could not read are fetched again on every head. After WS_MAX_FAILURES consecutive connection
+        failures, or when no WebSocket endpoint is configured, the chain falls back to polling with relay_chain.
+    """
+    ws_url = ws_url or WS_URLS.get(chain)
+    if not ws_url:
+        print(f"[{chain.upper()}] No WebSocket endpoint, polling instead")
+        return await relay_chain(chain, contract_info, cursor_file, confirmations, poll_interval, relay_db)
 
-        for blk in range(start_blk, end_blk + 1):
-            for attempt in range(retries):
-                try:
-                    logs = contract.events.Unwrap().get_logs(from_block=blk, to_block=blk)
-                    logs.sort(key=lambda log: (log.blockNumber, log.logIndex))
-                    unwrap_logs.extend(logs)
-                    print(f"✓ Block {blk} processed")
-                    break
-                except Exception as e:
-                    print(f"Retry {attempt + 1}/{retries} failed on block {blk}: {e}")
-                    time.sleep(min(2 ** attempt + uniform(0.1, 0.6), 10))
-            else:
-                print(f"[WARN] Skipped block {blk} after retries")
+    event_name = RELAY_ROUTES[chain][0]
+    info = get_contract_info(chain, contract_info)
+    decoder = get_decoder(chain, contract_info)
+    other_w3, other_contract, signer = await connect_relay_target(chain, contract_info)
+    index = get_relay_index(relay_db)
+    buffer = get_confirmation_buffer(chain, confirmations)
+
+    failures = 0
+    while failures < WS_MAX_FAILURES:
+        try:
+            async with AsyncWeb3(WebSocketProvider(ws_url)) as w3:
+                # Subscribe before backfilling so nothing falls between the two
+                logs_subscription = await w3.eth.subscribe('logs', {'address': info['address'],
+                                                                    'topics': [[decoder.topics[event_name]]]})
+                await w3.eth.subscribe('newHeads')
+                failures = 0
 
-        print(f"Found {len(unwrap_logs)} unwrap request(s)")
+                head = await w3.eth.block_number
+                query = AsyncLogQuery(w3, info['address'], decoder, [event_name], chain=chain)
+                await recover_relays_async(chain, other_w3, index)
+                # Blocks that still have to be read with eth_getLogs; later ones are pushed by the stream
+                missing = (scan_start(chain, buffer, load_cursor(chain, cursor_file), head), head)
+                print(f"[{chain.upper()}] Subscribed to {event_name} events, backfilling blocks {missing[0]} to {head}")
 
-        for idx, evt in enumerate(unwrap_logs):
-            token = evt.args['underlying_token']
-            target = evt.args['to']
-            amount = evt.args['amount']
+                async def on_head(head):
+                    nonlocal missing
+                    if missing:
+                        logs, skipped = await get_logs_async(query, *missing)
+                        buffer.add(logs)
+                        missing = (skipped[0], missing[1]) if skipped else None
+                    # The logs of the head block may still be on their way, so it only counts as scanned
+                    # once the next head arrives
+                    scanned_blk = missing[0] - 1 if missing else head - 1
+                    await relay_released(chain, w3, buffer, head, scanned_blk, other_w3, other_contract, signer,
+                                         index, cursor_file)
 
-            print(f"[{idx+1}] Preparing withdrawal of {amount} {token} to {target}")
-            key = src_info.get('warden_key')
-            signer = src_w3.eth.account.from_key(key)
-            nonce = src_w3.eth.get_transaction_count(signer.address)
+                await on_head(head)
+                async for message in w3.socket.process_subscriptions():
+                    if message['subscription'] != logs_subscription:
+                        head = max(head, message['result']['number'])
+                        await on_head(head)
+                        continue
+                    evt = decoder.decode(message['result'])
+                    if evt is not None and not message['result'].get('removed'):
+                        buffer.add([evt])
+        except Exception as err:
+            failures += 1
+            _scan_positions.pop(chain, None)
+            print(f"[{chain.upper()}] [ERROR] Subscription failed ({failures}/{WS_MAX_FAILURES}): {err}")
+            await asyncio.sleep(poll_interval)
 
-            try:
-                gas = src_contract.functions.withdraw(token, target, amount).estimate_gas({'from': signer.address})
-                limit = int(gas * 1.2)
-            except:
-                limit = 200000
+    print(f"[{chain.upper()}] Giving up on WebSocket subscriptions, polling instead")
+    await relay_chain(chain, contract_info, cursor_file, confirmations, poll_interval, relay_db)
 
-            tx = src_contract.functions.withdraw(token, target, amount).build_transaction({
-                'from': signer.address,
-                'nonce': nonce,
-                'gas': limit,
-                'gasPrice': src_w3.eth.gas_price
-            })
 
-            signed_tx = src_w3.eth.account.sign_transaction(tx, key)
-            tx_hash = src_w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-            print(f"Withdraw TX sent: {tx_hash.hex()}")
+async def run_relay(contract_info="contract_info.json", cursor_file=CURSOR_FILE, confirmations=CONFIRMATIONS,
+                    poll_interval=POLL_INTERVAL, relay_db=RELAY_DB, subscribe=False, ws_urls=None, metrics_port=None):
+    """
+        Relay both bridge directions concurrently, each on its own task
+        confirmations - (dictionary) chain -> how many blocks must be built on an event's block before it is
+            relayed; a single int applies to both chains
+        subscribe - (boolean) use eth_subscribe streams (subscribe_chain) instead of head polling
+        ws_urls - (dictionary) chain -> WebSocket endpoint, overriding WS_URLS (e.g. a local anvil node)
+        metrics_port - (int) if given, serve Prometheus metrics on this port (/metrics, and /metrics.json)
+    """
+    if metrics_port:
+        serve_metrics(metrics_port)
+    if isinstance(confirmations, int):
+        confirmations = {chain: confirmations for chain in RELAY_ROUTES}
+    if subscribe:
+        ws_urls = ws_urls or {}
+        await asyncio.gather(*[subscribe_chain(chain, contract_info, cursor_file, confirmations.get(chain, 0),
+                                               poll_interval, relay_db, ws_urls.get(chain))
+                               for chain in RELAY_ROUTES])
+    else:
+        await asyncio.gather(*[relay_chain(chain, contract_info, cursor_file, confirmations.get(chain, 0),
+                                           poll_interval, relay_db)
+                               for chain in RELAY_ROUTES])
+
+
+def parse_backfill_ranges(args):
+    """
+        args - (list of strings) "chain:from_block[:to_block]" entries, e.g. ["source:40000000", "destination:51000000:51100000"]
+        Returns chain -> (from_block, to_block or None)
+    """
+    ranges = {}
+    for arg in args:
+        chain, *blocks = arg.split(':')
+        ranges[chain] = (int(blocks[0]), int(blocks[1]) if len(blocks) > 1 else None)
+    return ranges
 
-            rcpt = src_w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-            print(f"Confirmed withdrawal in block {rcpt.blockNumber}")
 
-            if idx + 1 < len(unwrap_logs):
-                time.sleep(2)
+if __name__ == "__main__":
+    if '--backfill' in sys.argv:
+        backfill_chains(parse_backfill_ranges(sys.argv[sys.argv.index('--backfill') + 1:]))
+        sys.exit(0)
+    asyncio.run(run_relay(subscribe='--subscribe' in sys.argv, metrics_port=METRICS_PORT if '--metrics' in sys.argv else None))
@@ -0,0 +1,244 @@
+"""
+    Columnar on-disk cache of decoded bridge events
+    Events are stored as Parquet files under <root>/<chain>/<contract address>/<event>/<partition>/, where a
+    partition covers PARTITION_BLOCKS blocks and each file is named after the block range it covers
+    (<first>-<last>.parquet). A file is written for every range read, even an empty one, so the file names
+    alone record which blocks are already cached. Files are only ever added; compaction merges a
+    partition's fragments into one file and then removes them, and readers tolerate overlapping files.
+
+    Integers wider than 64 bits (uint256 amounts) are stored as decimal strings, and turned back into
+    Python ints when read.
+
+    Usage: python bridge_cache.py CHAIN EVENT [--token ADDRESS] [--from-block N] [--to-block N]
+"""
+import argparse
+import json
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from eth_utils import to_checksum_address
+from bridge_events import LOG_FIELDS
+
+
+EVENT_CACHE_DIR = "bridge_event_cache"
+PARTITION_BLOCKS = 100000  # Blocks per partition directory
+MAX_FRAGMENTS = 64  # Files a partition may hold before write compacts it
+INT_COLUMNS_KEY = b'bridge_int_columns'  # Schema metadata listing the columns stored as decimal strings
+
+INT64_FIELDS = ('blockNumber', 'logIndex')  # Integer fields that always fit in an int64 column
+
+
+def _range_of(filename):
+    first, last = filename[:-len('.parquet')].split('-')
+    return int(first), int(last)
+
+
+def merge_ranges(ranges):
+    """
+        ranges - (iterable) inclusive (first, last) block ranges
+        Returns the ranges merged into sorted, disjoint, non-adjacent ranges
+    """
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def to_frame(events):
+    """
+        events - (list) decoded events, all of the same type
+        Returns (DataFrame, names of the columns stored as decimal strings)
+    """
+    if not events:
+        return pd.DataFrame({field: pd.Series(dtype='int64' if field in INT64_FIELDS else 'object')
+                             for field in LOG_FIELDS}), []
+    columns = {field: [getattr(evt, field) for evt in events] for field in events[0]._fields}
+    int_columns = [field for field, values in columns.items()
+                   if field not in INT64_FIELDS and isinstance(values[0], int)]
+    for field in int_columns:
+        columns[field] = [str(value) for value in columns[field]]
+    return pd.DataFrame(columns), int_columns
+
+
+class EventCache:
+    """
+        root - (string) directory the cache lives in
+        Append-only, block-partitioned Parquet store of decoded events, keyed by (chain, contract address, event)
+    """
+    def __init__(self, root=EVENT_CACHE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def path(self, chain, address, event_name, partition=None):
+        path = os.path.join(self.root, chain, address.lower(), event_name)
+        return path if partition is None else os.path.join(path, f"{partition:012d}")
+
+    def files(self, chain, address, event_name, from_block=None, to_block=None):
+        """
+            Returns [(first, last, path)] for the cached files that overlap [from_block, to_block], in order
+        """
+        base = self.path(chain, address, event_name)
+        if not os.path.isdir(base):
+            return []
+        found = []
+        for partition in sorted(os.listdir(base)):
+            start = int(partition)
+            if (to_block is not None and start > to_block) or \
+                    (from_block is not None and start + PARTITION_BLOCKS <= from_block):
+                continue
+            for name in os.listdir(os.path.join(base, partition)):
+                if not name.endswith('.parquet'):
+                    continue
+                lo, hi = _range_of(name)
+                if (from_block is None or hi >= from_block) and (to_block is None or lo <= to_block):
+                    found.append((lo, hi, os.path.join(base, partition, name)))
+        return sorted(found)
+
+    def covered(self, chain, address, event_name, from_block=None, to_block=None):
+        """
+            Returns the merged block ranges that are cached
+        """
+        return merge_ranges((lo, hi) for lo, hi, _ in self.files(chain, address, event_name, from_block, to_block))
+
+    def missing(self, chain, address, event_name, from_block, to_block):
+        """
+            Returns the sub-ranges of [from_block, to_block] that are not cached and must be read from the chain
+        """
+        gaps, next_blk = [], from_block
+        for lo, hi in self.covered(chain, address, event_name, from_block, to_block):
+            if lo > next_blk:
+                gaps.append((next_blk, lo - 1))
+            next_blk = max(next_blk, hi + 1)
+        if next_blk <= to_block:
+            gaps.append((next_blk, to_block))
+        return gaps
+
+    def write(self, chain, address, event_name, from_block, to_block, events):
+        """
+            from_block, to_block - (int) the inclusive range the events were read from; every event of
+                event_name the contract emitted in this range must be included
+            events - (list) decoded events of one type
+            Appends the events, split along partition boundaries
+        """
+        if from_block > to_block:
+            return
+        for start in range(from_block - from_block % PARTITION_BLOCKS, to_block + 1, PARTITION_BLOCKS):
+            lo, hi = max(from_block, start), min(to_block, start + PARTITION_BLOCKS - 1)
+            frame, int_columns = to_frame([evt for evt in events if lo <= evt.blockNumber <= hi])
+            directory = self.path(chain, address, event_name, start)
+            with self.lock:
+                os.makedirs(directory, exist_ok=True)
+                self._write_file(os.path.join(directory, f"{lo:012d}-{hi:012d}.parquet"), frame, int_columns)
+                if len(os.listdir(directory)) > MAX_FRAGMENTS:
+                    self._compact(directory)
+
+    def _write_file(self, path, frame, int_columns):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               INT_COLUMNS_KEY: json.dumps(int_columns).encode()})
+        tmp_file = f"{path}.tmp"
+        pq.write_table(table, tmp_file)
+        os.replace(tmp_file, path)
+
+    def _compact(self, directory):
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.parquet'))
+        ranges = merge_ranges(_range_of(name) for name in names)
+        frames = [self._read_file(os.path.join(directory, name), as_ints=False) for name in names]
+        int_columns = sorted({column for frame in frames for column in frame.attrs['int_columns']})
+        for lo, hi in ranges:
+            parts = [frame for name, frame in zip(names, frames) if lo <= _range_of(name)[0] <= hi and len(frame)]
+            merged = self._combine(parts) if parts else to_frame([])[0]
+            self._write_file(os.path.join(directory, f"{lo:012d}-{hi:012d}.parquet"), merged, int_columns)
+        keep = {f"{lo:012d}-{hi:012d}.parquet" for lo, hi in ranges}
+        for name in names:
+            if name not in keep:
+                os.remove(os.path.join(directory, name))
+
+    def _read_file(self, path, filters=None, as_ints=True):
+        table = pq.read_table(path, filters=filters)
+        metadata = table.schema.metadata or {}
+        int_columns = json.loads(metadata.get(INT_COLUMNS_KEY, b'[]'))
+        frame = table.to_pandas()
+        if as_ints:
+            for column in int_columns:
+                frame[column] = frame[column].map(int)
+        frame.attrs['int_columns'] = int_columns
+        return frame
+
+    @staticmethod
+    def _combine(frames):
+        frame = pd.concat(frames, ignore_index=True)
+        frame = frame.drop_duplicates(subset=['transactionHash', 'logIndex'])
+        return frame.sort_values(['blockNumber', 'logIndex'], ignore_index=True)
+
+    def read(self, chain, address, event_name, from_block=None, to_block=None, filters=None):
+        """
+            filters - (list) pyarrow filter tuples pushed down to the Parquet reader,
+                e.g. [('token', '==', token_address)]
+            Returns a DataFrame of the cached events in [from_block, to_block], sorted by (blockNumber, logIndex)
+            Integer arguments come back as Python ints (object columns)
+        """
+        frames = []
+        for lo, hi, path in self.files(chain, address, event_name, from_block, to_block):
+            if pq.read_metadata(path).num_rows == 0:
+                continue
+            frame = self._read_file(path, filters)
+            if len(frame):
+                frames.append(frame)
+        if not frames:
+            return to_frame([])[0]
+        frame = self._combine(frames)
+        if from_block is not None:
+            frame = frame[frame.blockNumber >= from_block]
+        if to_block is not None:
+            frame = frame[frame.blockNumber <= to_block]
+        return frame.reset_index(drop=True)
+
+    def read_events(self, chain, address, event_name, decoder, from_block, to_block):
+        """
+            decoder - (EventDecoder) decoder for the contract, which supplies the event's record type
+            Returns the cached events in [from_block, to_block] as decoded events, like LogQuery.get_logs
+        """
+        record = next(record for name, record, _, _ in decoder.events.values() if name == event_name)
+        frame = self.read(chain, address, event_name, from_block, to_block)
+        if not len(frame):
+            return []
+        return [record(*row) for row in frame[list(record._fields)].itertuples(index=False, name=None)]
+
+
+_caches = {}  # root -> EventCache
+
+
+def get_event_cache(root=EVENT_CACHE_DIR):
+    """
+        Returns the EventCache for root, creating it once per process
+    """
+    if root not in _caches:
+        _caches[root] = EventCache(root)
+    return _caches[root]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the cached bridge events of one chain")
+    parser.add_argument('chain', choices=['source', 'destination'])
+    parser.add_argument('event', help="e.g. Deposit, Withdrawal, Wrap, Unwrap")
+    parser.add_argument('--token', help="only events for this token (token or underlying_token)")
+    parser.add_argument('--from-block', type=int)
+    parser.add_argument('--to-block', type=int)
+    parser.add_argument('--contract-info', default="contract_info.json")
+    parser.add_argument('--cache', default=EVENT_CACHE_DIR)
+    args = parser.parse_args()
+
+    with open(args.contract_info) as f:
+        address = json.load(f)[args.chain]['address']
+    filters = None
+    if args.token:
+        column = 'token' if args.chain == 'source' else 'underlying_token'
+        filters = [(column, '==', to_checksum_address(args.token))]
+    events = get_event_cache(args.cache).read(args.chain, address, args.event, args.from_block, args.to_block, filters)
+    print(events.to_string(index=False) if len(events) else "No cached events")
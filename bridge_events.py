@@ -0,0 +1,231 @@
+"""
+    Fast decoding for the bridge contract events (Deposit, Withdrawal, Wrap, Unwrap)
+    Topic hashes and eth_abi decoders are built once per ABI. Raw eth_getLogs results are decoded
+    straight into named tuples, without going through web3's contract event machinery.
+"""
+from collections import namedtuple
+from eth_abi import decode
+from eth_utils import keccak, to_checksum_address
+import time
+from bridge_metrics import METRICS
+
+
+BRIDGE_EVENTS = ('Deposit', 'Withdrawal', 'Wrap', 'Unwrap')
+
+# Fields every decoded event starts with, followed by the event's own arguments
+LOG_FIELDS = ('event', 'address', 'blockNumber', 'blockHash', 'transactionHash', 'logIndex')
+
+
+def _to_bytes(value):
+    return bytes.fromhex(value[2:]) if isinstance(value, str) else bytes(value)
+
+
+def _to_hex(value):
+    return value if isinstance(value, str) else '0x' + bytes(value).hex()
+
+
+def _to_int(value):
+    return value if isinstance(value, int) else int(value, 16)
+
+
+class EventDecoder:
+    """
+        abi - (list) contract ABI, as stored in contract_info.json
+        names - (iterable) which events to decode
+        Decodes raw logs of the named events into one named tuple type per event
+        Indexed arguments are read directly from the topics, the rest are decoded from data in one call
+    """
+    def __init__(self, abi, names=BRIDGE_EVENTS):
+        self.events = {}  # topic0 (bytes) -> (name, record type, indexed inputs, data inputs)
+        self.topics = {}  # name -> topic0 as a 0x-prefixed hex string
+        for item in abi:
+            if item.get('type') != 'event' or item['name'] not in names:
+                continue
+            inputs = item['inputs']
+            signature = f"{item['name']}({','.join(i['type'] for i in inputs)})"
+            topic0 = keccak(text=signature)
+            record = namedtuple(item['name'], LOG_FIELDS + tuple(i['name'] for i in inputs))
+            indexed = [(n, i['type']) for n, i in enumerate(inputs) if i['indexed']]
+            data = [(n, i['type']) for n, i in enumerate(inputs) if not i['indexed']]
+            self.events[topic0] = (item['name'], record, indexed, data)
+            self.topics[item['name']] = '0x' + topic0.hex()
+
+    def decode(self, log):
+        """
+            log - (dict) a raw eth_getLogs entry (hex strings, as returned by the node)
+            Logs already formatted by web3 (ints and HexBytes, e.g. from a subscription) are accepted too
+            Returns the decoded event, or None if the log is not one of this decoder's events
+        """
+        topics = [_to_bytes(t) for t in log['topics']]
+        if not topics or topics[0] not in self.events:
+            return None
+        name, record, indexed, data = self.events[topics[0]]
+
+        args = [None] * (len(indexed) + len(data))
+        for (n, typ), topic in zip(indexed, topics[1:]):
+            args[n] = to_checksum_address(topic[12:]) if typ == 'address' else decode([typ], topic)[0]
+        if data:
+            values = decode([typ for _, typ in data], _to_bytes(log['data']))
+            for (n, typ), value in zip(data, values):
+                args[n] = to_checksum_address(value) if typ == 'address' else value
+
+        return record(name, to_checksum_address(log['address']), _to_int(log['blockNumber']),
+                      _to_hex(log['blockHash']), _to_hex(log['transactionHash']), _to_int(log['logIndex']), *args)
+
+    def decode_logs(self, logs):
+        """
+            logs - (list) raw eth_getLogs entries
+            Decodes every log that belongs to one of this decoder's events
+            Returns them sorted by (blockNumber, logIndex)
+        """
+        events = [evt for evt in map(self.decode, logs) if evt is not None]
+        events.sort(key=lambda evt: (evt.blockNumber, evt.logIndex))
+        return events
+
+
+def bloom_bits(value):
+    """
+        value - (bytes) an address or a topic
+        Returns the three (byte index, mask) pairs that value sets in a 2048-bit logsBloom
+    """
+    digest = keccak(value)
+    bits = []
+    for i in (0, 2, 4):
+        bit = ((digest[i] << 8) | digest[i + 1]) & 2047
+        bits.append((255 - bit // 8, 1 << (bit % 8)))
+    return bits
+
+
+def in_bloom(bloom, bits):
+    """
+        bloom - (bytes) a block's logsBloom
+        bits - (list) from bloom_bits
+        False means the value is definitely not in any log of the block; True means it may be
+    """
+    return all(bloom[i] & mask for i, mask in bits)
+
+
+def to_columns(events):
+    """
+        events - (list) decoded events, all of the same type
+        Returns a columnar batch: a dictionary mapping each field name to the list of its values
+    """
+    if not events:
+        return {}
+    return {field: [getattr(evt, field) for evt in events] for field in events[0]._fields}
+
+
+class LogQuery:
+    """
+        w3 - (Web3) connection to the chain
+        address - (string) contract address
+        decoder - (EventDecoder) decoder for the contract's ABI
+        names - (iterable) events to fetch
+        chain - (string) if given, time spent fetching and decoding is recorded under the
+            'scan' and 'decode' stages for this chain
+        Fetches raw eth_getLogs results for the named events and decodes them with decoder
+        get_logs has the same shape as a web3 contract event, so it can be used with bridge.get_logs
+        might_match tests a block's logsBloom, so blocks that can't hold the events need not be queried
+    """
+    def __init__(self, w3, address, decoder, names, chain=None):
+        self.w3 = w3
+        self.address = address
+        self.decoder = decoder
+        self.topics = [decoder.topics[name] for name in names]
+        self.chain = chain
+        self.address_bits = bloom_bits(_to_bytes(address))
+        self.topic_bits = [bloom_bits(_to_bytes(topic)) for topic in self.topics]
+
+    def might_match(self, bloom):
+        """
+            bloom - (string or bytes) a block header's logsBloom
+            Returns False if the block has no log from address with one of the topics
+        """
+        bloom = _to_bytes(bloom)
+        return in_bloom(bloom, self.address_bits) and any(in_bloom(bloom, bits) for bits in self.topic_bits)
+
+    def params(self, from_block, to_block):
+        return [{
+            'address': self.address,
+            'fromBlock': hex(from_block),
+            'toBlock': hex(to_block),
+            'topics': [self.topics],
+        }]
+
+    def decode_response(self, response, start):
+        fetched = time.perf_counter()
+        if 'error' in response:
+            raise ValueError(response['error'])
+        events = self.decoder.decode_logs(response['result'])
+        if self.chain is not None:
+            METRICS.observe('stage_seconds', fetched - start, stage='scan', chain=self.chain)
+            METRICS.observe('stage_seconds', time.perf_counter() - fetched, stage='decode', chain=self.chain)
+            METRICS.inc('logs_decoded', len(events), chain=self.chain)
+        return events
+
+    def get_logs(self, from_block, to_block):
+        start = time.perf_counter()
+        response = self.w3.provider.make_request('eth_getLogs', self.params(from_block, to_block))
+        return self.decode_response(response, start)
+
+
+class AsyncLogQuery(LogQuery):
+    """
+        Same as LogQuery, for an AsyncWeb3 connection
+    """
+    async def get_logs(self, from_block, to_block):
+        start = time.perf_counter()
+        response = await self.w3.provider.make_request('eth_getLogs', self.params(from_block, to_block))
+        return self.decode_response(response, start)
+
+
+class ConfirmationBuffer:
+    """
+        depth - (int) how many blocks must be built on top of an event's block before it is released
+        Holds decoded events in memory until they are depth blocks deep
+        The hash of each buffered block is kept, and re-checked against the canonical chain before its
+        events are released, so events from blocks that were reorged out are dropped instead of relayed.
+        Blocks that had no events are not held here; the caller rescans blocks until they are depth deep
+        (see bridge.release_events), so events a reorg adds to them are still added.
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.blocks = {}  # block number -> (block hash, {(transactionHash, logIndex): event})
+
+    def add(self, events):
+        for evt in events:
+            block_hash, entries = self.blocks.get(evt.blockNumber, (evt.blockHash, {}))
+            if block_hash != evt.blockHash:
+                # A rescan saw a different version of this block, so the old one was reorged out
+                block_hash, entries = evt.blockHash, {}
+            entries[(evt.transactionHash, evt.logIndex)] = evt
+            self.blocks[evt.blockNumber] = (block_hash, entries)
+
+    def due(self, head):
+        """
+            Returns the buffered block numbers that are deep enough to release at head, in order
+            Their canonical hashes must be looked up and passed to release
+        """
+        return sorted(n for n in self.blocks if n <= head - self.depth)
+
+    def release(self, canonical_hashes):
+        """
+            canonical_hashes - (dictionary) block number -> current canonical block hash, for the due blocks
+            Returns (ready, orphaned): events from blocks still on the canonical chain, sorted by
+            (blockNumber, logIndex), and events from blocks that were reorged out
+        """
+        ready, orphaned = [], []
+        for n in sorted(canonical_hashes):
+            block_hash, entries = self.blocks.pop(n)
+            events = sorted(entries.values(), key=lambda evt: evt.logIndex)
+            (ready if canonical_hashes[n] == block_hash else orphaned).extend(events)
+        return ready, orphaned
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self.blocks.values())
+
+    def oldest(self):
+        """
+            Returns the lowest buffered block number, or None if the buffer is empty
+        """
+        return min(self.blocks) if self.blocks else None
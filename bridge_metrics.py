@@ -0,0 +1,229 @@
+"""
+    In-process metrics for the relay path
+    Counters, gauges and latency histograms keyed by name and labels (chain, stage, method, ...).
+    Recording is a dictionary update under a lock, so it stays on in the scan_blocks hot path.
+    Metrics can be read as Prometheus text (serve_metrics, to_prometheus) or as JSON (to_json, dump_json).
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from inspect import iscoroutinefunction
+import json
+import os
+import threading
+import time
+
+
+METRICS_PORT = 9464  # Port of the Prometheus endpoint started by serve_metrics
+PREFIX = 'bridge_'  # Prepended to every metric name on export
+
+# Upper bounds (seconds) of the latency histogram buckets, everything slower lands in +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Stages of a relay, in the order an event goes through them
+STAGES = ('scan', 'decode', 'estimate', 'sign', 'send', 'confirm')
+
+
+class Metrics:
+    """
+        A registry of counters, gauges and histograms
+        Every metric is identified by its name plus a sorted tuple of (label, value) pairs
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket (+Inf last), sum, count]
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def add(self, name, delta, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        n = bisect_left(self.buckets, value)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            hist[0][n] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+            stage - (string) one of STAGES (or any other name)
+            Times the with-block into the stage_seconds histogram, and counts it in stage_errors
+            if it raises
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('stage_errors', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def snapshot(self):
+        """
+            Returns a consistent copy of (counters, gauges, histograms)
+        """
+        with self.lock:
+            return (dict(self.counters), dict(self.gauges),
+                    {key: [list(hist[0]), hist[1], hist[2]] for key, hist in self.histograms.items()})
+
+    def to_json(self):
+        """
+            Returns every metric as a JSON-serializable dictionary
+            Histograms include cumulative bucket counts, sum, count and mean
+        """
+        counters, gauges, histograms = self.snapshot()
+        as_list = lambda metrics: [{'name': name, 'labels': dict(labels), 'value': value}
+                                   for (name, labels), value in sorted(metrics.items())]
+        hists = []
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            cumulative, running = {}, 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                running += n
+                cumulative[str(bound)] = running
+            hists.append({'name': name, 'labels': dict(labels), 'buckets': cumulative, 'sum': total,
+                          'count': count, 'mean': total / count if count else 0.0})
+        return {'timestamp': time.time(), 'uptime': time.time() - self.started,
+                'counters': as_list(counters), 'gauges': as_list(gauges), 'histograms': hists}
+
+    def to_prometheus(self):
+        """
+            Returns every metric in the Prometheus text exposition format
+        """
+        counters, gauges, histograms = self.snapshot()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(f"{name}_total", 'counter')
+            lines.append(f"{PREFIX}{name}_total{_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            header(name, 'histogram')
+            running = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                running += n
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', bound),))} {running}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def dump_json(self, path):
+        """
+            Writes to_json() to path atomically
+        """
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+        os.replace(tmp_file, path)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+METRICS = Metrics()  # Registry used by the bridge
+
+
+def count_requests(provider, chain, metrics=METRICS):
+    """
+        provider - (web3 provider) sync or async HTTP provider, or bridge_rpc.RPCPool
+        chain - (string) label for the chain the provider serves
+        Counts every JSON-RPC call made through provider in rpc_requests, by chain and method, including
+        calls that bypass web3 (raw provider.make_request) and each call inside a batch request
+    """
+    make_request = provider.make_request
+    make_batch_request = provider.make_batch_request
+
+    def count(requests):
+        for method, _ in requests:
+            metrics.inc('rpc_requests', chain=chain, method=method)
+
+    if iscoroutinefunction(make_request):
+        async def counted_request(method, params):
+            count([(method, params)])
+            return await make_request(method, params)
+
+        async def counted_batch(requests):
+            count(requests)
+            metrics.inc('rpc_batches', chain=chain)
+            return await make_batch_request(requests)
+    else:
+        def counted_request(method, params):
+            count([(method, params)])
+            return make_request(method, params)
+
+        def counted_batch(requests):
+            count(requests)
+            metrics.inc('rpc_batches', chain=chain)
+            return make_batch_request(requests)
+
+    provider.make_request = counted_request
+    provider.make_batch_request = counted_batch
+    return provider
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+        GET /metrics returns Prometheus text, GET /metrics.json returns the JSON dump
+    """
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body, content_type = json.dumps(self.metrics.to_json()).encode(), 'application/json'
+        elif self.path.startswith('/metrics'):
+            body, content_type = self.metrics.to_prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port=METRICS_PORT, host='0.0.0.0', metrics=METRICS):
+    """
+        Serves metrics over HTTP from a daemon thread
+        Returns the server, so the caller can shut it down
+    """
+    handler = type('Handler', (MetricsHandler,), {'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
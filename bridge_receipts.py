@@ -0,0 +1,161 @@
+"""
+    Shared receipt tracking for sent transactions
+    Instead of one eth_getTransactionReceipt polling loop per transaction, a ReceiptTracker follows the chain's
+    head from a single background thread. The receipts of every new block are fetched with eth_getBlockReceipts
+    (all new blocks in one JSON-RPC batch) and matched against every transaction being waited on, so polling
+    cost grows with the number of blocks rather than the number of transactions in flight.
+    Nodes without eth_getBlockReceipts fall back to one batch of eth_getTransactionReceipt per poll.
+"""
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import threading
+import time
+from web3.datastructures import AttributeDict
+from web3.exceptions import TimeExhausted
+from web3._utils.method_formatters import receipt_formatter
+
+
+POLL_INTERVAL = 0.5  # Seconds between polls while transactions are being waited on
+RECEIPT_TIMEOUT = 120  # Default seconds to wait for a receipt
+MAX_BLOCKS_PER_POLL = 50  # Blocks whose receipts are fetched in one poll, when the tracker has fallen behind
+
+
+def _key(tx_hash):
+    return (tx_hash if isinstance(tx_hash, str) else '0x' + bytes(tx_hash).hex()).lower()
+
+
+class ReceiptTracker:
+    """
+        w3 - (Web3) connection to the chain the transactions are sent on
+        Resolves one Future per tracked transaction hash with its receipt (formatted like
+        w3.eth.wait_for_transaction_receipt). The polling thread only runs while something is tracked.
+    """
+    def __init__(self, w3, poll_interval=POLL_INTERVAL):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.waiting = {}  # tx hash (lowercase hex) -> Future
+        # Hashes tracked since the last poll. They may have been mined in a block the tracker already passed,
+        # so they are looked up directly once (all in one batch)
+        self.unchecked = set()
+        self.next_block = None  # First block whose receipts have not been fetched yet
+        self.block_receipts = True  # Whether the node supports eth_getBlockReceipts
+        self.thread = None
+
+    def track(self, tx_hash):
+        """
+            Returns a Future that resolves to the receipt of tx_hash
+        """
+        key = _key(tx_hash)
+        with self.lock:
+            future = self.waiting.get(key)
+            if future is None:
+                future = self.waiting[key] = Future()
+                self.unchecked.add(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return future
+
+    def wait(self, tx_hash, timeout=RECEIPT_TIMEOUT):
+        """
+            Drop-in replacement for w3.eth.wait_for_transaction_receipt(tx_hash, timeout)
+        """
+        future = self.track(tx_hash)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            self.forget(tx_hash)
+            raise TimeExhausted(f"Transaction {_key(tx_hash)} is not in the chain after {timeout} seconds")
+
+    def forget(self, tx_hash):
+        """
+            Stops tracking tx_hash, e.g. once nobody will wait for it any more
+        """
+        with self.lock:
+            future = self.waiting.pop(_key(tx_hash), None)
+        if future is not None:
+            future.cancel()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    # Stop until something is tracked again; blocks mined meanwhile are covered by the direct lookup
+                    self.thread = None
+                    self.next_block = None
+                    return
+                unchecked, self.unchecked = self.unchecked, set()
+            try:
+                self.poll(unchecked)
+            except Exception as e:
+                print(f"Receipt poll failed: {e}")
+                with self.lock:
+                    self.unchecked |= unchecked
+            time.sleep(self.poll_interval)
+
+    def poll(self, unchecked):
+        """
+            unchecked - (set) hashes to look up directly
+            Fetches the receipts of the blocks mined since the last poll and resolves the matching futures
+        """
+        # The head is read first: anything mined after it is picked up from its block on a later poll
+        head = int(self.w3.provider.make_request('eth_blockNumber', [])['result'], 16)
+        if self.next_block is None:
+            self.next_block = head + 1
+        last_blk = min(head, self.next_block + MAX_BLOCKS_PER_POLL - 1)
+
+        if not self.block_receipts:
+            with self.lock:
+                unchecked = set(self.waiting)
+        lookups = [('eth_getTransactionReceipt', [tx_hash]) for tx_hash in unchecked]
+        blocks = [('eth_getBlockReceipts', [hex(n)]) for n in range(self.next_block, last_blk + 1)] \
+            if self.block_receipts else []
+        responses = self.batch(lookups + blocks) if lookups or blocks else []
+
+        receipts = [resp['result'] for resp in responses[:len(lookups)] if resp.get('result')]
+        for resp in responses[len(lookups):]:
+            if 'error' in resp:
+                # Most likely the method is not supported: look the waiting hashes up directly from now on
+                print(f"eth_getBlockReceipts failed, polling receipts per transaction: {resp['error']}")
+                self.block_receipts = False
+                with self.lock:
+                    self.unchecked |= set(self.waiting)
+                break
+            if resp.get('result') is None:
+                # The node serving this batch (a lagging one, or another endpoint of an RPCPool) hasn't seen
+                # the block yet: stop here and fetch it again on the next poll
+                break
+            receipts += resp['result']
+            self.next_block += 1
+        self.resolve(receipts)
+
+    def batch(self, requests):
+        """
+            Sends requests as one JSON-RPC batch, or one at a time if the node rejects batches
+            Returns the raw responses in request order
+        """
+        responses = self.w3.provider.make_batch_request(requests)
+        if isinstance(responses, list):
+            return responses
+        return [self.w3.provider.make_request(method, params) for method, params in requests]
+
+    def resolve(self, receipts):
+        with self.lock:
+            for raw in receipts:
+                future = self.waiting.pop(raw['transactionHash'].lower(), None)
+                if future is not None:
+                    future.set_result(AttributeDict.recursive(receipt_formatter(raw)))
+
+
+_trackers = {}  # id(w3) -> (w3, ReceiptTracker)
+_trackers_lock = threading.Lock()
+
+
+def get_receipt_tracker(w3):
+    """
+        Returns the ReceiptTracker for w3, creating it once per connection
+    """
+    with _trackers_lock:
+        if id(w3) not in _trackers:
+            _trackers[id(w3)] = (w3, ReceiptTracker(w3))
+        return _trackers[id(w3)][1]
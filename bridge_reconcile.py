@@ -0,0 +1,229 @@
+"""
+    Cross-chain reconciliation of the bridge
+    Deposits on the source chain are matched to Wraps on the destination chain, and Unwraps on the destination
+    chain to Withdrawals on the source chain. Both sides are loaded into dataframes (through the event cache)
+    and joined on (token, recipient, amount) plus the order of the events within that key: the n-th Deposit of
+    an amount to a recipient matches the n-th Wrap of that amount to them.
+
+    Relays left over after the join are classified:
+    - duplicated: more relays than origin events for the same (token, recipient, amount)
+    - netted: a relay whose amount is the sum of consecutive origin events of the same (token, recipient),
+      as produced by bridge.net_events
+    - unmatched: everything else, i.e. origin events that were never relayed and relays without an origin
+    Outstanding balances are reported per token.
+
+    Usage: python bridge_reconcile.py --source FROM[:TO] --destination FROM[:TO] [--out report.json]
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pandas as pd
+import bridge
+from bridge_events import to_columns
+
+
+# (name, origin (chain, event, token field, recipient field), relay (chain, event, token field, recipient field))
+PAIRS = (
+    ('wrap', ('source', 'Deposit', 'token', 'recipient'), ('destination', 'Wrap', 'underlying_token', 'to')),
+    ('withdraw', ('destination', 'Unwrap', 'underlying_token', 'to'), ('source', 'Withdrawal', 'token', 'recipient')),
+)
+
+KEY = ['token', 'recipient', 'amount']
+COLUMNS = KEY + ['blockNumber', 'logIndex', 'transactionHash']
+SAMPLE_SIZE = 20  # Events listed per category in the printed summary (the JSON report lists them all)
+
+
+def events_frame(events, token_field, recipient_field):
+    """
+        events - (list) decoded events of one type
+        token_field, recipient_field - (string) the event's fields holding the underlying token and recipient
+        Returns a DataFrame with COLUMNS, in (blockNumber, logIndex) order
+        Amounts are kept as Python ints (object column), since uint256 sums overflow int64
+    """
+    columns = to_columns(events)
+    frame = pd.DataFrame({
+        'token': pd.Series(columns.get(token_field, []), dtype=object),
+        'recipient': pd.Series(columns.get(recipient_field, []), dtype=object),
+        'amount': pd.Series(columns.get('amount', []), dtype=object),
+        'blockNumber': pd.Series(columns.get('blockNumber', []), dtype='int64'),
+        'logIndex': pd.Series(columns.get('logIndex', []), dtype='int64'),
+        'transactionHash': pd.Series(columns.get('transactionHash', []), dtype=object),
+    })
+    return frame.sort_values(['blockNumber', 'logIndex'], ignore_index=True)
+
+
+def add_keys(origins, relays, columns):
+    """
+        Adds a 'key' column to both frames: one int64 per distinct combination of columns, shared by the two
+        frames, so grouping and joining run on integers instead of address strings and Python ints
+    """
+    both = pd.concat([origins[columns], relays[columns]], ignore_index=True)
+    key = np.zeros(len(both), dtype=np.int64)
+    for column in columns:
+        codes, uniques = pd.factorize(both[column])
+        key = pd.factorize(key * len(uniques) + codes)[0]
+    origins['key'], relays['key'] = key[:len(origins)], key[len(origins):]
+
+
+def match(origins, relays):
+    """
+        origins, relays - (DataFrame) from events_frame
+        Returns a dictionary of DataFrames: matched (one row per pair, with _origin and _relay columns),
+        netted_origins, netted_relays, duplicated, unmatched_origins and unmatched_relays
+    """
+    origins, relays = origins.copy(), relays.copy()
+    add_keys(origins, relays, KEY)
+    for frame in (origins, relays):
+        frame['rank'] = frame.groupby('key').cumcount()
+
+    joined = origins.merge(relays, on=['key', 'rank'], how='outer', suffixes=('_origin', '_relay'), indicator=True)
+    matched = joined[joined['_merge'] == 'both']
+    pairs = matched.set_index(['key', 'rank']).index
+    left = origins[~origins.set_index(['key', 'rank']).index.isin(pairs)]
+    right = relays[~relays.set_index(['key', 'rank']).index.isin(pairs)]
+
+    # Extra relays of a (token, recipient, amount) that has origins are duplicates
+    duplicated = right[right['key'].isin(origins['key'])]
+    right = right[~right['key'].isin(origins['key'])]
+
+    netted_left, netted_right = net_matches(left, right)
+    matched = matched.drop(columns=['key', 'rank', '_merge', 'token_relay', 'recipient_relay', 'amount_relay'])
+    matched = matched.rename(columns={'token_origin': 'token', 'recipient_origin': 'recipient', 'amount_origin': 'amount'})
+    ints = [f"{field}_{side}" for field in ('blockNumber', 'logIndex') for side in ('origin', 'relay')]
+    return {
+        'matched': matched.astype({column: 'int64' for column in ints}),
+        'netted_origins': left[left.index.isin(netted_left)][COLUMNS],
+        'netted_relays': right[right.index.isin(netted_right)][COLUMNS],
+        'duplicated': duplicated[COLUMNS],
+        'unmatched_origins': left[~left.index.isin(netted_left)][COLUMNS],
+        'unmatched_relays': right[~right.index.isin(netted_right)][COLUMNS],
+    }
+
+
+def net_matches(origins, relays):
+    """
+        origins, relays - (DataFrame) the events left over after the one to one join
+        Pairs each relay with a run of consecutive origins of the same (token, recipient) whose amounts add
+        up to the relay's amount, which is how bridge.net_events folds deposits together
+        Only the leftovers are walked here, so the loop stays small next to the join
+        Returns (row labels of the netted origins, row labels of the netted relays)
+    """
+    netted_origins, netted_relays = [], []
+    origin_groups = origins.groupby(['token', 'recipient'], sort=False).groups
+    for key, relay_rows in relays.groupby(['token', 'recipient'], sort=False).groups.items():
+        origin_rows = origin_groups.get(key)
+        if origin_rows is None:
+            continue
+        pos = 0
+        for row in relay_rows:
+            target, total, end = relays.at[row, 'amount'], 0, pos
+            while end < len(origin_rows) and total < target:
+                total += origins.at[origin_rows[end], 'amount']
+                end += 1
+            if total == target and end - pos > 1:
+                netted_origins += list(origin_rows[pos:end])
+                netted_relays.append(row)
+                pos = end
+    return netted_origins, netted_relays
+
+
+def balances(frames):
+    """
+        frames - (dictionary) event name -> DataFrame from events_frame, for Deposit, Wrap, Unwrap and Withdrawal
+        Returns a DataFrame indexed by token with the total of each event, what is pending in each direction,
+        and the imbalance between what is locked on the source chain and the wrapped supply
+    """
+    totals = pd.DataFrame({event.lower(): frame.groupby('token')['amount'].sum() for event, frame in frames.items()})
+    totals = totals.astype(object).where(totals.notna(), 0)
+    totals['pending_wrap'] = totals['deposit'] - totals['wrap']
+    totals['pending_withdrawal'] = totals['unwrap'] - totals['withdrawal']
+    totals['locked'] = totals['deposit'] - totals['withdrawal']
+    totals['wrapped_supply'] = totals['wrap'] - totals['unwrap']
+    totals['imbalance'] = totals['locked'] - totals['wrapped_supply']
+    return totals
+
+
+def reconcile(frames):
+    """
+        frames - (dictionary) event name -> DataFrame from events_frame, for Deposit, Wrap, Unwrap and Withdrawal
+        Returns (results, balances) where results maps each PAIRS name to the output of match
+    """
+    results = {}
+    for name, origin, relay in PAIRS:
+        results[name] = match(frames[origin[1]], frames[relay[1]])
+    return results, balances(frames)
+
+
+def load_frames(ranges, contract_info="contract_info.json", event_cache=bridge.EVENT_CACHE_DIR,
+                workers=bridge.BACKFILL_WORKERS):
+    """
+        ranges - (dictionary) chain -> (from_block, to_block), to_block may be None for the head
+        Loads the four bridge events of both chains through bridge.load_events
+        Returns (event name -> DataFrame, (chain, block) pairs that could not be read)
+    """
+    frames, skipped = {}, []
+    for _, origin, relay in PAIRS:
+        for chain, event_name, token_field, recipient_field in (origin, relay):
+            start = time.time()
+            events, missed = bridge.load_events(chain, event_name, *ranges[chain], contract_info, event_cache, workers)
+            print(f"[{chain.upper()}] Loaded {len(events)} {event_name} event(s) in {time.time() - start:.1f}s")
+            frames[event_name] = events_frame(events, token_field, recipient_field)
+            skipped += [(chain, blk) for blk in missed]
+    return frames, skipped
+
+
+def to_report(results, totals):
+    """
+        Returns the reconciliation as a JSON-serializable dictionary (amounts as decimal strings)
+    """
+    records = lambda frame: json.loads(frame.astype({'amount': str} if 'amount' in frame else {})
+                                       .to_json(orient='records'))
+    report = {'pairs': {}, 'balances': {}}
+    for name, result in results.items():
+        report['pairs'][name] = {category: {'count': len(frame), 'events': records(frame)}
+                                 for category, frame in result.items()}
+    for token, row in totals.iterrows():
+        report['balances'][token] = {column: str(value) for column, value in row.items()}
+    return report
+
+
+def print_summary(results, totals):
+    for name, result in results.items():
+        print(f"\n== {name} ==")
+        for category, frame in result.items():
+            print(f"{category}: {len(frame)}")
+        for category in ('duplicated', 'unmatched_origins', 'unmatched_relays'):
+            if len(result[category]):
+                print(f"\n{category} (first {SAMPLE_SIZE}):")
+                print(result[category].head(SAMPLE_SIZE).to_string(index=False))
+    print("\n== balances ==")
+    print(totals.to_string() if len(totals) else "No events")
+
+
+def parse_range(arg):
+    blocks = arg.split(':')
+    return int(blocks[0]), int(blocks[1]) if len(blocks) > 1 else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the bridge events of the source and destination chains")
+    parser.add_argument('--source', type=parse_range, required=True, help="FROM[:TO] blocks on the source chain")
+    parser.add_argument('--destination', type=parse_range, required=True, help="FROM[:TO] blocks on the destination chain")
+    parser.add_argument('--contract-info', default="contract_info.json")
+    parser.add_argument('--out', default=None, help="write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    frames, skipped = load_frames({'source': args.source, 'destination': args.destination}, args.contract_info)
+    start = time.time()
+    results, totals = reconcile(frames)
+    print(f"Reconciled {sum(len(frame) for frame in frames.values())} event(s) in {time.time() - start:.1f}s")
+    print_summary(results, totals)
+    if skipped:
+        print(f"\n[WARN] {len(skipped)} block(s) could not be read, the report may be incomplete: {skipped[:SAMPLE_SIZE]}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(to_report(results, totals), f, indent=2)
+    sys.exit(1 if skipped or any(len(result[category]) for result in results.values()
+                                 for category in ('duplicated', 'unmatched_origins', 'unmatched_relays')) else 0)
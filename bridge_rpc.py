@@ -0,0 +1,431 @@
+"""
+    Multi-endpoint RPC pool for the bridge
+    Each chain can be served by several RPC endpoints. The pool tracks latency and error rate for each
+    one, sends requests to the fastest healthy endpoint, fails over when an endpoint stops answering,
+    and hedges slow eth_getLogs calls with a duplicate request to a second endpoint.
+    Endpoints can lag each other by a few blocks, so eth_getLogs only goes to endpoints that have reached
+    its toBlock: a lagging node would answer with no logs for the blocks it hasn't seen yet.
+
+    Every endpoint also has a RateLimiter: a token bucket that paces requests, plus a cap on requests in
+    flight. Both limits grow additively while the endpoint keeps up and are halved when it answers with
+    HTTP 429, a rate-limit JSON-RPC error or a timeout (AIMD), so the bridge runs at whatever the provider
+    can actually take instead of a guessed rate.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from inspect import iscoroutinefunction
+import threading
+import time
+from urllib.parse import urlparse
+from requests.exceptions import Timeout
+from web3 import HTTPProvider
+from bridge_metrics import METRICS
+
+
+STATS_WINDOW = 50  # Requests remembered per endpoint for latency and error rate
+MAX_ERROR_RATE = 0.5  # Endpoints failing more often than this are only used when nothing else is left
+HEDGE_PERCENTILE = 95  # eth_getLogs is hedged once the primary is slower than this percentile of its history
+HEDGE_MIN_SAMPLES = 5  # Latency samples needed before the percentile is trusted
+HEDGE_DEFAULT_DELAY = 2.0  # Seconds to wait before hedging an endpoint with too little history
+HEDGED_METHODS = ('eth_getLogs',)
+
+RATE_LIMIT = 25.0  # Requests per second each endpoint starts at
+MIN_RATE = 1.0  # Requests per second the rate is never halved below
+MAX_RATE = 1000.0  # Requests per second the rate never grows past
+RATE_STEP = 2.0  # Additive increase: requests per second gained per second of unthrottled traffic
+CONCURRENCY = 4  # Requests in flight each endpoint starts at
+MAX_CONCURRENCY = 64  # Requests in flight never grow past this
+DECREASE_FACTOR = 0.5  # Multiplicative decrease applied to both limits when the endpoint throttles
+DECREASE_COOLDOWN = 1.0  # Seconds after a decrease during which further throttling signals are ignored
+THROTTLE_RETRIES = 5  # Times a throttled request is retried (paced by the limiter) before the error is raised
+# JSON-RPC error codes that always mean rate limiting. -32005 (EIP-1474 "limit exceeded") is left out:
+# providers also use it to reject oversized eth_getLogs ranges and results, so it only counts as throttling
+# when its message is one of RATE_LIMIT_PHRASES
+THROTTLE_CODES = (429,)
+# Phrases of rate-limit error messages (messages are lowercased)
+RATE_LIMIT_PHRASES = ('rate limit', 'rate-limit', 'ratelimit', 'too many requests', 'requests per second',
+                      'throttl')
+SLOT_POLL = 0.005  # Seconds an async caller sleeps while every in-flight slot is taken
+
+OK, THROTTLED, FAILED = 'ok', 'throttled', 'failed'  # Outcomes reported to RateLimiter.release
+
+
+class EndpointStats:
+    """
+        Rolling latency and error history for one endpoint
+    """
+    def __init__(self):
+        self.latencies = deque(maxlen=STATS_WINDOW)  # Seconds, successful requests only
+        self.log_latencies = deque(maxlen=STATS_WINDOW)  # Seconds, successful hedged-method requests
+        self.outcomes = deque(maxlen=STATS_WINDOW)  # True for success, False for a transport error
+
+    def record(self, method, seconds=None):
+        """
+            seconds - (float) request latency, or None if the request failed
+        """
+        self.outcomes.append(seconds is not None)
+        if seconds is not None:
+            self.latencies.append(seconds)
+            if method in HEDGED_METHODS:
+                self.log_latencies.append(seconds)
+
+    def error_rate(self):
+        return 0.0 if not self.outcomes else 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def median(self):
+        if not self.latencies:
+            return 0.0
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def hedge_delay(self):
+        if len(self.log_latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.log_latencies)
+        return ordered[min(len(ordered) - 1, len(ordered) * HEDGE_PERCENTILE // 100)]
+
+
+class LaggingError(Exception):
+    """
+        Raised by RPCPool when no endpoint has reached the block a request needs
+    """
+
+
+def logs_to_block(params):
+    """
+        params - (list) eth_getLogs params
+        Returns the request's toBlock as an int, or None if it is a tag such as 'latest' or a blockHash query
+    """
+    to_block = params[0].get('toBlock') if params and isinstance(params[0], dict) else None
+    if isinstance(to_block, int):
+        return to_block
+    if isinstance(to_block, str) and to_block.startswith('0x'):
+        return int(to_block, 16)
+    return None
+
+
+class RPCPool(HTTPProvider):
+    """
+        endpoint_uris - (list) RPC endpoints serving the same chain, in order of preference
+        sessions - (dictionary) endpoint -> requests.Session to use for it
+        A web3 provider that routes every request to the fastest healthy endpoint
+        Transport failures (connection errors, timeouts, HTTP errors such as 429) fail over to the next
+        endpoint. JSON-RPC error responses are returned as-is, since another node would give the same answer.
+        The head each endpoint reports is remembered, and eth_getLogs skips endpoints that are behind its
+        toBlock (see synced), so the head read on one endpoint never pairs with logs read from a lagging one.
+        endpoint_uri is the first endpoint, so per-endpoint state keyed on it stays per chain.
+    """
+    def __init__(self, endpoint_uris, sessions=None):
+        sessions = sessions or {}
+        super().__init__(endpoint_uris[0], session=sessions.get(endpoint_uris[0]))
+        # The pool does its own failover, so the endpoints don't retry on their own; each one is paced by
+        # its RateLimiter, and a throttled request fails over right away
+        self.providers = [limit_requests(HTTPProvider(uri, session=sessions.get(uri), exception_retry_configuration=None),
+                                         retries=0)
+                          for uri in endpoint_uris]
+        self.stats = {provider.endpoint_uri: EndpointStats() for provider in self.providers}
+        self.heads = {}  # endpoint -> highest block number it has reported
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.providers))
+
+    def ranked(self):
+        """
+            Returns the endpoints ordered healthy first, then by median latency
+            Endpoints without history sort first so they get measured
+        """
+        with self.lock:
+            return sorted(self.providers, key=lambda p: (self.stats[p.endpoint_uri].error_rate() > MAX_ERROR_RATE,
+                                                         self.stats[p.endpoint_uri].median()))
+
+    def record_head(self, provider, response):
+        """
+            response - (dict) the endpoint's eth_blockNumber response
+            Returns response
+        """
+        if isinstance(response, dict) and response.get('result'):
+            with self.lock:
+                head = int(response['result'], 16)
+                self.heads[provider.endpoint_uri] = max(self.heads.get(provider.endpoint_uri, head), head)
+        return response
+
+    def synced(self, providers, block):
+        """
+            providers - (list) endpoints in the order they should be tried
+            block - (int) block number the request needs, or None
+            Yields the endpoints that have reached block, asking an endpoint for its head first if the last
+            one it reported is behind
+        """
+        for provider in providers:
+            if block is not None and self.heads.get(provider.endpoint_uri, -1) < block:
+                try:
+                    self.record_head(provider, provider.make_request('eth_blockNumber', []))
+                except Exception as e:
+                    print(f"RPC eth_blockNumber failed on {provider.endpoint_uri}: {e}")
+                    continue
+                if self.heads.get(provider.endpoint_uri, -1) < block:
+                    print(f"RPC {provider.endpoint_uri} has not reached block {block} yet, skipping it")
+                    continue
+            yield provider
+
+    def timed(self, provider, method, call):
+        start = time.monotonic()
+        try:
+            response = call()
+        except Exception:
+            with self.lock:
+                self.stats[provider.endpoint_uri].record(method)
+            raise
+        with self.lock:
+            self.stats[provider.endpoint_uri].record(method, time.monotonic() - start)
+        return response
+
+    def failover(self, method, call, block=None):
+        """
+            call - (function) takes a provider and makes the request on it
+            block - (int) only endpoints that have reached this block are tried
+            Tries each endpoint in ranked order until one answers
+        """
+        error = LaggingError(f"No endpoint has reached block {block} yet")
+        for provider in self.synced(self.ranked(), block):
+            try:
+                return self.timed(provider, method, lambda: call(provider))
+            except Exception as e:
+                print(f"RPC {method} failed on {provider.endpoint_uri}, failing over: {e}")
+                error = e
+        raise error
+
+    def hedged(self, method, params, block=None):
+        """
+            Sends the request to the best endpoint, and a duplicate to the next one if the first has
+            not answered within its HEDGE_PERCENTILE latency. Returns whichever answers first.
+            block - (int) only endpoints that have reached this block are used
+        """
+        providers = self.synced(self.ranked(), block)
+        first = next(providers, None)
+        if first is None:
+            raise LaggingError(f"No endpoint has reached block {block} yet")
+        delay = self.stats[first.endpoint_uri].hedge_delay()
+        submit = lambda p: self.executor.submit(self.timed, p, method, lambda: p.make_request(method, params))
+
+        running = {submit(first)}
+        remaining = next(providers, None)
+        error = None
+        while running:
+            done, running = wait(running, timeout=delay if remaining else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            if remaining and (not done or not running):
+                # Either the hedge delay passed or everything in flight failed: try the next endpoint
+                running.add(submit(remaining))
+                remaining = next(providers, None)
+        raise error
+
+    def make_request(self, method, params):
+        if method == 'eth_blockNumber':
+            return self.failover(method, lambda p: self.record_head(p, p.make_request(method, params)))
+        block = logs_to_block(params) if method == 'eth_getLogs' else None
+        if method in HEDGED_METHODS and len(self.providers) > 1:
+            return self.hedged(method, params, block)
+        return self.failover(method, lambda p: p.make_request(method, params), block)
+
+    def make_batch_request(self, batch_requests):
+        return self.failover('batch', lambda p: p.make_batch_request(batch_requests))
+
+
+def is_throttled_error(error):
+    """
+        Returns True if error (raised by a provider) is a 429 or a timeout
+    """
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status', None)
+    return status == 429 or isinstance(error, (Timeout, TimeoutError, asyncio.TimeoutError))
+
+
+def is_throttled_response(response):
+    """
+        Returns True if response (a JSON-RPC response, or a list of them for a batch) reports rate limiting
+        A -32005 error alone is not enough: it is also how providers reject an eth_getLogs range
+        or result that is too big, which bridge.get_logs handles by splitting the range, and retrying it
+        unchanged or slowing the endpoint down would not help
+    """
+    for resp in response if isinstance(response, list) else [response]:
+        error = resp.get('error') if isinstance(resp, dict) else None
+        if not isinstance(error, dict):
+            continue
+        message = str(error.get('message', '')).lower()
+        if error.get('code') in THROTTLE_CODES or any(phrase in message for phrase in RATE_LIMIT_PHRASES):
+            return True
+    return False
+
+
+class RateLimiter:
+    """
+        name - (string) label for the endpoint in metrics
+        Token bucket (rate requests per second, bursts of up to one second's worth) plus a limit on
+        requests in flight, for one endpoint. Both are adjusted AIMD-style from the outcome of each request.
+    """
+    def __init__(self, name, rate=RATE_LIMIT, concurrency=CONCURRENCY):
+        self.name = name
+        self.rate = rate
+        self.concurrency = float(concurrency)
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.decreased = 0.0  # When the limits were last halved
+        self.slow_start = True  # Until the first throttle, limits grow exponentially to find the capacity quickly
+        self.cond = threading.Condition()
+
+    def reserve(self, cost=1):
+        """
+            Takes an in-flight slot and cost tokens if both are available
+            Returns 0 when they were taken, the seconds until enough tokens refill, or None if every slot is taken
+        """
+        with self.cond:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.in_flight >= int(self.concurrency):
+                return None
+            cost = min(cost, self.rate)
+            if self.tokens < cost:
+                return (cost - self.tokens) / self.rate
+            self.tokens -= cost
+            self.in_flight += 1
+            return 0
+
+    def acquire(self, cost=1):
+        while True:
+            delay = self.reserve(cost)
+            if delay == 0:
+                return
+            with self.cond:
+                self.cond.wait(delay)
+
+    async def acquire_async(self, cost=1):
+        while True:
+            delay = self.reserve(cost)
+            if delay == 0:
+                return
+            await asyncio.sleep(SLOT_POLL if delay is None else delay)
+
+    def release(self, outcome):
+        """
+            outcome - OK, THROTTLED or FAILED (an error that says nothing about load, left out of the adjustment)
+        """
+        with self.cond:
+            # Limits only grow while they are what holds the traffic back
+            rate_bound = self.tokens < 1
+            slots_bound = self.in_flight >= int(self.concurrency)
+            self.in_flight -= 1
+            if outcome == OK:
+                if self.slow_start:
+                    # Doubles about once per second (rate) or per window of requests (slots)
+                    rate_step, slot_step = 1.0, 1.0
+                else:
+                    # Additive increase: about RATE_STEP per second at full rate, one slot per window of successes
+                    rate_step, slot_step = RATE_STEP / self.rate, 1 / self.concurrency
+                if rate_bound:
+                    self.rate = min(MAX_RATE, self.rate + rate_step)
+                if slots_bound:
+                    self.concurrency = min(MAX_CONCURRENCY, self.concurrency + slot_step)
+            elif outcome == THROTTLED:
+                METRICS.inc('rpc_throttled', endpoint=self.name)
+                now = time.monotonic()
+                if now - self.decreased >= DECREASE_COOLDOWN:
+                    # Multiplicative decrease, once per cooldown so a burst of 429s only counts once
+                    self.decreased = now
+                    self.slow_start = False
+                    self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                    self.concurrency = max(1.0, self.concurrency * DECREASE_FACTOR)
+                    self.tokens = 0.0
+            METRICS.set('rpc_rate_limit', self.rate, endpoint=self.name)
+            METRICS.set('rpc_concurrency_limit', int(self.concurrency), endpoint=self.name)
+            self.cond.notify_all()
+
+    def call(self, request, cost=1, retries=THROTTLE_RETRIES):
+        """
+            request - (function) makes the RPC request
+            cost - (int) tokens the request uses, e.g. the number of calls in a batch
+            Makes the request once a slot and tokens are available, retrying it while it is throttled
+        """
+        for attempt in range(retries + 1):
+            self.acquire(cost)
+            try:
+                response = request()
+            except Exception as e:
+                self.release(THROTTLED if is_throttled_error(e) else FAILED)
+                if is_throttled_error(e) and attempt < retries:
+                    continue
+                raise
+            throttled = is_throttled_response(response)
+            self.release(THROTTLED if throttled else OK)
+            # A batch with some throttled calls is returned as-is, the caller handles per-call errors
+            if throttled and not isinstance(response, list) and attempt < retries:
+                continue
+            return response
+
+    async def call_async(self, request, cost=1, retries=THROTTLE_RETRIES):
+        """
+            Same as call, for a coroutine function request
+        """
+        for attempt in range(retries + 1):
+            await self.acquire_async(cost)
+            try:
+                response = await request()
+            except Exception as e:
+                self.release(THROTTLED if is_throttled_error(e) else FAILED)
+                if is_throttled_error(e) and attempt < retries:
+                    continue
+                raise
+            throttled = is_throttled_response(response)
+            self.release(THROTTLED if throttled else OK)
+            if throttled and not isinstance(response, list) and attempt < retries:
+                continue
+            return response
+
+
+_limiters = {}  # endpoint -> RateLimiter
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint_uri):
+    """
+        Returns the RateLimiter for endpoint_uri, shared by every provider (sync or async) that talks to it
+        Metrics are labelled with the endpoint's host only, since some endpoint paths carry API keys
+    """
+    with _limiters_lock:
+        if endpoint_uri not in _limiters:
+            _limiters[endpoint_uri] = RateLimiter(urlparse(endpoint_uri).netloc or endpoint_uri)
+        return _limiters[endpoint_uri]
+
+
+def limit_requests(provider, retries=THROTTLE_RETRIES):
+    """
+        provider - (web3 provider) sync or async HTTP provider
+        retries - (int) times a throttled request is retried; 0 leaves retrying to the caller (e.g. RPCPool failover)
+        Sends every request made through provider via its endpoint's RateLimiter
+        The provider's own retry loop (fixed exponential sleeps) should be disabled, so the limiter sees
+        the throttling and paces the retries
+    """
+    limiter = get_rate_limiter(provider.endpoint_uri)
+    make_request = provider.make_request
+    make_batch_request = provider.make_batch_request
+
+    if iscoroutinefunction(make_request):
+        async def limited_request(method, params):
+            return await limiter.call_async(lambda: make_request(method, params), 1, retries)
+
+        async def limited_batch(requests):
+            return await limiter.call_async(lambda: make_batch_request(requests), len(requests), retries)
+    else:
+        def limited_request(method, params):
+            return limiter.call(lambda: make_request(method, params), 1, retries)
+
+        def limited_batch(requests):
+            return limiter.call(lambda: make_batch_request(requests), len(requests), retries)
+
+    provider.make_request = limited_request
+    provider.make_batch_request = limited_batch
+    return provider
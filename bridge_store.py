@@ -0,0 +1,128 @@
+"""
+    Durable index of bridge events that have already been relayed
+    Each event is keyed by (chain, transactionHash, logIndex) and moves through
+    pending -> sent -> confirmed (or reverted), along with the hash of the relay transaction.
+"""
+from collections import namedtuple
+import sqlite3
+import threading
+import time
+
+
+RELAY_DB = "bridge_relays.db"
+
+PENDING = 'pending'  # About to be relayed; the relay transaction may not have been broadcast
+SENT = 'sent'  # Relay transaction broadcast, receipt not seen yet
+CONFIRMED = 'confirmed'  # Relay transaction mined successfully
+REVERTED = 'reverted'  # Relay transaction mined but reverted; not retried automatically
+
+# Events in these states are never relayed again. SENT events move on once their relay transaction is
+# looked up again (see bridge.recover_relays), or back to PENDING if it was dropped
+HANDLED = (SENT, CONFIRMED, REVERTED)
+
+LOOKUP_CHUNK = 500  # Keys per lookup query, well under SQLite's bound parameter limit
+
+# An event as stored in the index, for marking rows without the decoded event
+RelayedEvent = namedtuple('RelayedEvent', 'transactionHash logIndex')
+
+
+class RelayIndex:
+    """
+        path - (string) SQLite database file
+        Lookups go through the (chain, tx_hash, log_index) primary key, so they stay fast as the table grows
+    """
+    def __init__(self, path=RELAY_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS relays (
+                chain TEXT NOT NULL,
+                tx_hash TEXT NOT NULL,
+                log_index INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                relay_tx TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (chain, tx_hash, log_index)
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS relays_status ON relays (status, chain)")
+        self.db.commit()
+
+    def statuses(self, chain, events):
+        """
+            chain - (string) chain the events were emitted on
+            events - (list) decoded events (anything with transactionHash and logIndex)
+            Returns {(tx_hash, log_index): (status, relay_tx)} for the events that are in the index
+        """
+        found = {}
+        wanted = {(evt.transactionHash, evt.logIndex) for evt in events}
+        tx_hashes = sorted({tx_hash for tx_hash, _ in wanted})
+        with self.lock:
+            for i in range(0, len(tx_hashes), LOOKUP_CHUNK):
+                chunk = tx_hashes[i:i + LOOKUP_CHUNK]
+                rows = self.db.execute(
+                    f"SELECT tx_hash, log_index, status, relay_tx FROM relays "
+                    f"WHERE chain = ? AND tx_hash IN ({','.join('?' * len(chunk))})",
+                    [chain] + chunk)
+                for tx_hash, log_index, status, relay_tx in rows:
+                    if (tx_hash, log_index) in wanted:
+                        found[(tx_hash, log_index)] = (status, relay_tx)
+        return found
+
+    def unhandled(self, chain, events):
+        """
+            Returns the events that have not been relayed yet, in their original order
+        """
+        found = self.statuses(chain, events)
+        return [evt for evt in events
+                if found.get((evt.transactionHash, evt.logIndex), (None,))[0] not in HANDLED]
+
+    def sent(self, chain):
+        """
+            Returns {relay_tx: (events, time they were marked SENT)} for chain's events in the SENT state,
+            events as RelayedEvent
+        """
+        found = {}
+        with self.lock:
+            rows = self.db.execute("SELECT tx_hash, log_index, relay_tx, updated FROM relays WHERE status = ? AND chain = ?",
+                                   (SENT, chain)).fetchall()
+        for tx_hash, log_index, relay_tx, updated in rows:
+            events, sent_at = found.get(relay_tx, ([], updated))
+            events.append(RelayedEvent(tx_hash, log_index))
+            found[relay_tx] = (events, min(sent_at, updated))
+        return found
+
+    def mark(self, chain, events, status, relay_tx=None):
+        """
+            chain - (string) chain the events were emitted on
+            events - (list) decoded events
+            status - (string) one of PENDING, SENT, CONFIRMED, REVERTED
+            relay_tx - (string) hash of the relay transaction the events were folded into
+        """
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO relays (chain, tx_hash, log_index, status, relay_tx, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (chain, tx_hash, log_index) DO UPDATE SET "
+                "status = excluded.status, relay_tx = COALESCE(excluded.relay_tx, relay_tx), updated = excluded.updated",
+                [(chain, evt.transactionHash, evt.logIndex, status, relay_tx, now) for evt in events])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_indexes = {}  # path -> RelayIndex
+
+
+def get_relay_index(path=RELAY_DB):
+    """
+        Returns the RelayIndex for path, opening it once per process
+    """
+    if path not in _indexes:
+        _indexes[path] = RelayIndex(path)
+    return _indexes[path]
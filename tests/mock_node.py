@@ -0,0 +1,166 @@
+"""
+    Minimal JSON-RPC node for the bridge tests
+    Serves just enough of the eth_ API for scan_blocks, get_logs and ReceiptTracker: a settable head,
+    range-filtered logs, block hashes and receipts for the transactions sent to it. Batch requests are
+    supported, and every request is recorded so tests can count round trips.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from eth_abi import encode
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+
+DEFAULT_HASH = '0x' + 'ab' * 32  # Canonical hash of every block without an override
+FEE_HISTORY = {
+    'oldestBlock': '0x1',
+    'baseFeePerGas': ['0x5'] * 6,
+    'gasUsedRatio': [0.5] * 5,
+    'reward': [['0x1'], ['0x2'], ['0x3'], ['0x2'], ['0x2']],
+}
+
+
+def address_topic(address):
+    return '0x' + encode(['address'], [address]).hex()
+
+
+def make_log(decoder, event_name, address, block, log_index, args, block_hash=DEFAULT_HASH):
+    """
+        decoder - (EventDecoder) decoder for the contract's ABI, which supplies the event's topic
+        args - (list) (type, value, indexed) for each of the event's arguments, in order
+        Returns a raw eth_getLogs entry
+    """
+    indexed = [address_topic(value) if typ == 'address' else '0x' + encode([typ], [value]).hex()
+               for typ, value, is_indexed in args if is_indexed]
+    data = [(typ, value) for typ, value, is_indexed in args if not is_indexed]
+    return {
+        'address': address.lower(),
+        'blockNumber': hex(block),
+        'blockHash': block_hash,
+        'transactionHash': '0x' + keccak(text=f"{block}:{log_index}").hex(),
+        'logIndex': hex(log_index),
+        'topics': [decoder.topics[event_name]] + indexed,
+        'data': '0x' + encode([typ for typ, _ in data], [value for _, value in data]).hex(),
+    }
+
+
+def receipt(tx_hash, block, status=True):
+    return {
+        'transactionHash': tx_hash, 'blockNumber': hex(block), 'blockHash': DEFAULT_HASH, 'status': hex(status),
+        'logs': [], 'gasUsed': '0x5208', 'cumulativeGasUsed': '0x5208', 'transactionIndex': '0x0',
+        'from': '0x' + '00' * 20, 'to': '0x' + '00' * 20, 'contractAddress': None,
+        'logsBloom': '0x' + '00' * 256, 'type': '0x0', 'effectiveGasPrice': '0x1',
+    }
+
+
+class MockNode:
+    """
+        head - (int) initial block number
+        Attributes tests may change while the node runs: head, logs (list of raw logs), block_hashes
+        (block number -> hash), null_receipts (block numbers whose eth_getBlockReceipts returns null once),
+        reverts (function(transaction calldata) returning True if the transaction should revert) and handlers
+        (method -> function(params) returning a result, or raising to send an error)
+    """
+    def __init__(self, head=100):
+        self.head = head
+        self.logs = []
+        self.block_hashes = {}
+        self.mined = {}  # block number -> transaction hashes sent while it was the head
+        self.null_receipts = set()
+        self.reverts = lambda data: False
+        self.reverted = set()  # hashes of the transactions that reverted
+        self.handlers = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def calls(self):
+        """
+            Returns a Counter of the methods called so far (each call inside a batch counts)
+        """
+        with self.lock:
+            return Counter(req['method'] for body in self.requests for req in (body if isinstance(body, list) else [body]))
+
+    def handler_class(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with node.lock:
+                    node.requests.append(body)
+                    out = [node.respond(req) for req in body] if isinstance(body, list) else node.respond(body)
+                data = json.dumps(out).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, req):
+        try:
+            result = self.result(req['method'], req.get('params', []))
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': req['id'], 'error': {'code': -32000, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': req['id'], 'result': result}
+
+    def result(self, method, params):
+        if method in self.handlers:
+            return self.handlers[method](params)
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_chainId':
+            return '0x1'
+        if method == 'eth_gasPrice':
+            return '0x3b9aca00'
+        if method == 'eth_feeHistory':
+            return FEE_HISTORY
+        if method == 'eth_getTransactionCount':
+            return '0x0'
+        if method == 'eth_estimateGas':
+            return '0x5208'
+        if method == 'eth_getLogs':
+            query = params[0]
+            lo, hi = int(query['fromBlock'], 16), int(query['toBlock'], 16)
+            # Like a real node, blocks past the head have no logs yet
+            return [log for log in self.logs if log['address'] == query['address'].lower()
+                    and lo <= int(log['blockNumber'], 16) <= min(hi, self.head) and log['topics'][0] in query['topics'][0]]
+        if method == 'eth_getBlockByNumber':
+            n = int(params[0], 16)
+            return None if n > self.head else {'number': hex(n), 'hash': self.block_hashes.get(n, DEFAULT_HASH)}
+        if method == 'eth_sendRawTransaction':
+            tx_hash = '0x' + keccak(hexstr=params[0]).hex()
+            if self.reverts(TypedTransaction.from_bytes(HexBytes(params[0])).as_dict()['data']):
+                self.reverted.add(tx_hash)
+            self.mined.setdefault(self.head, []).append(tx_hash)
+            return tx_hash
+        if method == 'eth_getTransactionReceipt':
+            return next((receipt(params[0], n, params[0] not in self.reverted) for n, hashes in self.mined.items()
+                         if params[0] in hashes and n <= self.head), None)
+        if method == 'eth_getTransactionByHash':
+            return next(({'hash': params[0], 'blockNumber': hex(n) if n <= self.head else None}
+                         for n, hashes in self.mined.items() if params[0] in hashes), None)
+        if method == 'eth_getBlockReceipts':
+            n = int(params[0], 16)
+            if n in self.null_receipts or n > self.head:
+                self.null_receipts.discard(n)
+                return None
+            return [receipt(tx_hash, n, tx_hash not in self.reverted) for tx_hash in self.mined.get(n, [])]
+        raise ValueError(f"method {method} not supported")
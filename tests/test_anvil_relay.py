@@ -0,0 +1,59 @@
+"""
+    End-to-end relay against a local anvil pair, with the contracts from Bridge/src deployed by benchmark.setup
+    Needs anvil and forge (Foundry) on the PATH; skipped otherwise.
+"""
+import shutil
+import pytest
+import benchmark
+import bridge
+from bridge_store import CONFIRMED, get_relay_index
+
+pytestmark = pytest.mark.skipif(not (shutil.which('anvil') and shutil.which('forge')),
+                                reason="needs anvil and forge (Foundry)")
+
+N = 5
+
+
+@pytest.fixture
+def chains(monkeypatch):
+    procs, w3s = [], {}
+    try:
+        for chain in benchmark.ANVIL_PORTS:
+            proc, w3s[chain] = benchmark.start_anvil(chain)
+            procs.append(proc)
+            monkeypatch.setitem(bridge.RPC_URLS, chain, [f"http://127.0.0.1:{benchmark.ANVIL_PORTS[chain]}"])
+        for name in ('_confirmation_buffers', '_scan_positions', '_cache_pending'):
+            monkeypatch.setattr(bridge, name, {})
+        yield w3s
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+
+def test_deposits_are_relayed_in_one_batch_wrap(chains, tmp_path):
+    contract_info = str(tmp_path / "contract_info.json")
+    cursor_file = str(tmp_path / "cursor.json")
+    relay_db = str(tmp_path / "relays.db")
+    source, destination, token, wrapped = benchmark.setup(chains, N, contract_info)
+    user = chains['source'].eth.account.from_key(benchmark.USER_KEY).address
+
+    bridge.save_cursor('source', chains['source'].eth.block_number, cursor_file)
+    for _ in range(N):
+        tx_hash = benchmark.transact(chains['source'], benchmark.USER_KEY,
+                                     source.functions.deposit(token.address, user, benchmark.EVENT_AMOUNT))
+        chains['source'].eth.wait_for_transaction_receipt(tx_hash)
+
+    bridge.scan_blocks('source', contract_info, cursor_file, relay_db=relay_db, event_cache=None)
+
+    wraps = destination.events.Wrap().get_logs(from_block=0)
+    assert len(wraps) == N
+    assert {evt.args.to for evt in wraps} == {user}
+    assert wrapped.functions.balanceOf(user).call() == N * benchmark.EVENT_AMOUNT
+
+    relay_txs = {evt.transactionHash for evt in wraps}
+    assert len(relay_txs) == 1
+    tx = chains['destination'].eth.get_transaction(relay_txs.pop())
+    assert destination.decode_function_input(tx.input)[0].fn_name == 'batchWrap'
+
+    statuses = get_relay_index(relay_db).db.execute("SELECT status FROM relays WHERE chain = 'source'").fetchall()
+    assert statuses == [(CONFIRMED,)] * N
@@ -0,0 +1,86 @@
+import json
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import bridge
+import bridge_cache
+from bridge_cache import EventCache
+from mock_node import make_log
+
+
+TOKEN = '0x' + '11' * 20
+RECIPIENT = '0x' + '22' * 20
+
+
+def deposit_log(decoders, block, log_index, amount):
+    address = bridge.get_contract_info('source', "contract_info.json")['address']
+    return make_log(decoders['source'], 'Deposit', address, block, log_index,
+                    [('address', TOKEN, True), ('address', RECIPIENT, True), ('uint256', amount, False)])
+
+
+def test_write_read_roundtrip(tmp_path, decoders):
+    cache = EventCache(str(tmp_path))
+    events = [decoders['source'].decode(deposit_log(decoders, n, 0, 2**255 + n)) for n in (5, 15, 150000)]
+    cache.write('source', events[0].address, 'Deposit', 0, 200000, events)
+
+    assert cache.read_events('source', events[0].address, 'Deposit', decoders['source'], 0, 200000) == events
+    assert cache.missing('source', events[0].address, 'Deposit', 0, 300000) == [(200001, 300000)]
+    frame = cache.read('source', events[0].address, 'Deposit', 10, 20)
+    assert list(frame.amount) == [2**255 + 15]
+
+
+def test_compaction_keeps_every_event(tmp_path, decoders, monkeypatch):
+    monkeypatch.setattr(bridge_cache, 'MAX_FRAGMENTS', 3)
+    cache = EventCache(str(tmp_path))
+    events = [decoders['source'].decode(deposit_log(decoders, n, 0, n)) for n in range(0, 100, 7)]
+    address = events[0].address
+    for lo in range(0, 100, 20):
+        cache.write('source', address, 'Deposit', lo, lo + 19, [evt for evt in events if lo <= evt.blockNumber <= lo + 19])
+    assert len(list((tmp_path / 'source' / address.lower() / 'Deposit' / f"{0:012d}").iterdir())) <= 3
+    assert cache.read_events('source', address, 'Deposit', decoders['source'], 0, 99) == events
+    assert cache.covered('source', address, 'Deposit') == [(0, 99)]
+
+
+def scan(tmp_path, **kwargs):
+    bridge.scan_blocks('source', cursor_file=str(tmp_path / "cursor.json"), relay_db=str(tmp_path / "relays.db"),
+                       event_cache=str(tmp_path / "cache"), **kwargs)
+
+
+def test_scan_only_caches_deep_blocks(node, decoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, 'EVENT_CACHE_DEPTH', 10)
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 990}))
+    node.logs = [deposit_log(decoders, 995, 0, 7)]
+    cache = bridge_cache.get_event_cache(str(tmp_path / "cache"))
+    address = bridge.get_contract_info('source', "contract_info.json")['address']
+
+    node.head = 1000
+    scan(tmp_path)
+    assert cache.covered('source', address, 'Deposit') == []
+
+    node.head = 1100
+    scan(tmp_path)
+    assert cache.covered('source', address, 'Deposit') == [(991, 1090)]
+    assert list(cache.read('source', address, 'Deposit').blockNumber) == [995]
+
+
+def test_scan_caches_events_released_ahead_of_the_cursor(node, decoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, 'EVENT_CACHE_DEPTH', 5)
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 990}))
+    node.logs = [deposit_log(decoders, 995, 0, 7), deposit_log(decoders, 1050, 0, 8)]
+    # The hash of block 995 can't be read at first, which holds the cursor back while 1050 is released
+    node.handlers['eth_getBlockByNumber'] = lambda params: None if int(params[0], 16) == 995 else \
+        {'hash': '0x' + 'ab' * 32}
+    cache = bridge_cache.get_event_cache(str(tmp_path / "cache"))
+    address = bridge.get_contract_info('source', "contract_info.json")['address']
+
+    node.head = 1060
+    scan(tmp_path, confirmations=2)
+    assert json.loads((tmp_path / "cursor.json").read_text())['source'] == 994
+
+    del node.handlers['eth_getBlockByNumber']
+    node.head = 1200
+    scan(tmp_path, confirmations=2)
+    assert json.loads((tmp_path / "cursor.json").read_text())['source'] == 1198
+    assert cache.covered('source', address, 'Deposit') == [(991, 1195)]
+    assert list(cache.read('source', address, 'Deposit').blockNumber) == [995, 1050]
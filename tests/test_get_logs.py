@@ -0,0 +1,89 @@
+import asyncio
+from collections import namedtuple
+from types import SimpleNamespace
+import pytest
+import bridge
+
+
+Log = namedtuple('Log', 'blockNumber logIndex')
+
+
+class FakeEvent:
+    """
+        Stands in for a LogQuery on a provider that rejects ranges wider than limit blocks
+        fail - (set) ranges that raise a timeout once
+    """
+    def __init__(self, limit, fail=()):
+        self.w3 = SimpleNamespace(provider=SimpleNamespace(endpoint_uri=f"mock://{id(self)}"))
+        self.limit = limit
+        self.fail = set(fail)
+        self.calls = []
+
+    def get_logs(self, from_block, to_block):
+        self.calls.append((from_block, to_block))
+        if (from_block, to_block) in self.fail:
+            self.fail.discard((from_block, to_block))
+            raise TimeoutError("read timed out")
+        if to_block - from_block + 1 > self.limit:
+            raise ValueError({'code': -32600, 'message': f"exceed maximum block range: {self.limit}"})
+        return [Log(n, 0) for n in range(from_block, to_block + 1) if n % 10 == 0]
+
+    @property
+    def endpoint(self):
+        return self.w3.provider.endpoint_uri
+
+
+class AsyncFakeEvent(FakeEvent):
+    async def get_logs(self, from_block, to_block):
+        return FakeEvent.get_logs(self, from_block, to_block)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(bridge, '_log_span_limit', {})
+    monkeypatch.setattr(bridge, '_log_span_successes', {})
+    monkeypatch.setattr(bridge.time, 'sleep', lambda seconds: None)
+
+
+def test_splits_rejected_ranges_and_remembers_the_span():
+    event = FakeEvent(limit=25)
+    logs, skipped = bridge.get_logs(event, 0, 99)
+    assert [log.blockNumber for log in logs] == list(range(0, 100, 10))
+    assert skipped == []
+    assert bridge._log_span_limit[event.endpoint] <= 25
+
+    event.calls.clear()
+    bridge.get_logs(event, 100, 199)
+    assert all(hi - lo + 1 <= 25 for lo, hi in event.calls)
+
+
+def test_transient_error_does_not_shrink_the_span():
+    event = FakeEvent(limit=2, fail={(12, 13)})
+    bridge._log_span_limit[event.endpoint] = 2
+    logs, skipped = bridge.get_logs(event, 12, 13)
+    assert skipped == []
+    assert event.calls == [(12, 13), (12, 13)]
+    assert bridge._log_span_limit[event.endpoint] == 2
+
+
+def test_span_grows_back_after_successes():
+    event = FakeEvent(limit=500)
+    bridge._log_span_limit[event.endpoint] = 50
+    logs, skipped = bridge.get_logs(event, 0, 9999)
+    assert len(logs) == 1000 and skipped == []
+    assert bridge._log_span_limit[event.endpoint] > 50
+    assert len(event.calls) < 10000 // 50
+
+
+def test_single_block_is_skipped_after_retries():
+    event = FakeEvent(limit=0)
+    logs, skipped = bridge.get_logs(event, 7, 7)
+    assert logs == [] and skipped == [7]
+    assert len(event.calls) == bridge.LOG_RETRIES
+
+
+def test_async_follows_the_same_plan():
+    event = AsyncFakeEvent(limit=25)
+    logs, skipped = asyncio.run(bridge.get_logs_async(event, 0, 99))
+    assert [log.blockNumber for log in logs] == list(range(0, 100, 10))
+    assert bridge._log_span_limit[event.endpoint] <= 25
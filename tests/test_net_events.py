@@ -0,0 +1,49 @@
+from collections import namedtuple
+import bridge
+
+
+Deposit = namedtuple('Deposit', 'blockNumber logIndex token recipient amount')
+ARGS = ('token', 'recipient', 'amount')
+
+
+def test_zero_window_relays_every_event():
+    events = [Deposit(1, 0, 'A', 'x', 5), Deposit(1, 1, 'A', 'x', 7)]
+    groups, args_list = bridge.net_events(events, ARGS, 0)
+    assert groups == [[events[0]], [events[1]]]
+    assert args_list == [('A', 'x', 5), ('A', 'x', 7)]
+
+
+def test_repeat_deposits_are_summed_within_the_window():
+    events = [Deposit(1, 0, 'A', 'x', 5), Deposit(2, 0, 'B', 'x', 1), Deposit(3, 0, 'A', 'x', 7),
+              Deposit(3, 1, 'A', 'y', 2)]
+    groups, args_list = bridge.net_events(events, ARGS, 10)
+    assert args_list == [('A', 'x', 12), ('B', 'x', 1), ('A', 'y', 2)]
+    assert groups[0] == [events[0], events[2]]
+
+
+def test_group_closes_once_the_window_has_passed():
+    events = [Deposit(1, 0, 'A', 'x', 5), Deposit(4, 0, 'A', 'x', 7), Deposit(11, 0, 'A', 'x', 1)]
+    groups, args_list = bridge.net_events(events, ARGS, 10)
+    assert args_list == [('A', 'x', 12), ('A', 'x', 1)]
+
+
+def test_relay_batches_uses_the_batch_function_when_deployed():
+    contract = namedtuple('Contract', 'abi')([{'type': 'function', 'name': 'batchWrap'}])
+    groups = [[Deposit(1, i, 'A', 'x', i)] for i in range(5)]
+    args_list = [('A', 'x', i) for i in range(5)]
+    batches = bridge.relay_batches(contract, 'wrap', groups, args_list, [100] * 5, max_batch=3)
+    assert [(function, len(events), gas) for function, _, events, gas in batches] == \
+        [('batchWrap', 3, 300), ('batchWrap', 2, 200)]
+    assert batches[1][1] == (['A', 'A'], ['x', 'x'], [3, 4])
+
+    single = bridge.relay_batches(namedtuple('Contract', 'abi')([]), 'wrap', groups, args_list, [100] * 5)
+    assert [function for function, _, _, _ in single] == ['wrap'] * 5
+
+
+def test_calls_without_an_estimate_get_their_own_transaction():
+    contract = namedtuple('Contract', 'abi')([{'type': 'function', 'name': 'batchWrap'}])
+    groups = [[Deposit(1, i, 'A', 'x', i)] for i in range(4)]
+    args_list = [('A', 'x', i) for i in range(4)]
+    batches = bridge.relay_batches(contract, 'wrap', groups, args_list, [100, None, 100, 100])
+    assert [(function, args, gas) for function, args, _, gas in batches] == \
+        [('wrap', ('A', 'x', 1), bridge.FALLBACK_GAS), ('batchWrap', (['A'] * 3, ['x'] * 3, [0, 2, 3]), 300)]
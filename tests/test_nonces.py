@@ -0,0 +1,40 @@
+import json
+from hexbytes import HexBytes
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import keccak
+from web3 import Web3
+import bridge
+from test_scan import deposit_log, scan
+
+
+def test_prime_only_moves_back_when_nothing_is_in_flight(node):
+    nonces = bridge.NonceManager(Web3(Web3.HTTPProvider(node.url)), '0x' + '44' * 20)
+    nonces.prime(5)
+    assert nonces.allocate() == 5
+    # The chain doesn't show nonce 5 yet, but it is still in flight
+    nonces.prime(5)
+    assert nonces.allocate() == 6
+    nonces.settle()
+    nonces.settle()
+    # Nonce 6 was dropped: the chain's count is used again
+    nonces.prime(6)
+    assert nonces.allocate() == 6
+
+
+def test_dropped_relay_does_not_leave_a_nonce_gap(node, decoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, 'RELAY_TIMEOUT', 0.5)
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = [deposit_log(decoders, 95, 0, 7)]
+    sent = []
+    def send(params):
+        # Nothing is ever mined, as if every transaction was dropped
+        sent.append(TypedTransaction.from_bytes(HexBytes(params[0])).as_dict()['nonce'])
+        return '0x' + keccak(hexstr=params[0]).hex()
+    node.handlers['eth_sendRawTransaction'] = send
+
+    scan(tmp_path)
+    node.logs.append(deposit_log(decoders, 98, 0, 8))
+    scan(tmp_path)
+    # The chain's pending count is still 0, so the second scan starts again from nonce 0 instead of
+    # queueing behind the dropped transaction
+    assert sent[:2] == [0, 0]
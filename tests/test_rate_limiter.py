@@ -0,0 +1,32 @@
+import bridge
+from bridge_rpc import RATE_LIMIT, RateLimiter, is_throttled_response
+
+
+def error(code, message):
+    return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': code, 'message': message}}
+
+
+def test_result_size_rejection_is_not_throttling():
+    assert not is_throttled_response(error(-32005, "query returned more than 10000 results"))
+    assert is_throttled_response(error(-32005, "Request rate limit exceeded"))
+    assert is_throttled_response(error(429, "Too Many Requests"))
+    assert is_throttled_response([{'result': '0x1'}, error(-32000, "daily request count exceeded, request rate limited")])
+
+
+def test_oversized_logs_request_is_not_retried_or_slowed_down():
+    limiter = RateLimiter('mock')
+    calls = []
+    def request():
+        calls.append(1)
+        return error(-32005, "query returned more than 10000 results")
+    assert 'error' in limiter.call(request)
+    assert len(calls) == 1
+    assert limiter.rate >= RATE_LIMIT and limiter.slow_start
+    assert bridge.is_range_error(ValueError(request()['error']))
+
+
+def test_throttled_request_is_retried_and_slows_the_endpoint():
+    limiter = RateLimiter('mock')
+    responses = [error(-32005, "rate limit exceeded"), {'jsonrpc': '2.0', 'id': 1, 'result': '0x1'}]
+    assert limiter.call(lambda: responses.pop(0)) == {'jsonrpc': '2.0', 'id': 1, 'result': '0x1'}
+    assert limiter.rate < RATE_LIMIT and not limiter.slow_start
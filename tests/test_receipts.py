@@ -0,0 +1,41 @@
+import time
+import pytest
+from web3 import Web3
+from web3.exceptions import TimeExhausted
+from bridge_receipts import ReceiptTracker
+
+
+def tx_hash(n):
+    return '0x' + f"{n:064x}"
+
+
+@pytest.fixture
+def tracker(node):
+    return ReceiptTracker(Web3(Web3.HTTPProvider(node.url)), poll_interval=0.02)
+
+
+def test_receipts_are_fetched_per_block(node, tracker):
+    hashes = [tx_hash(n) for n in range(30)]
+    futures = [tracker.track(h) for h in hashes]
+    for n, h in enumerate(hashes):
+        node.mined.setdefault(101 + n // 10, []).append(h)
+    node.head = 103
+    receipts = [future.result(5) for future in futures]
+    assert [rcpt.blockNumber for rcpt in receipts] == [101 + n // 10 for n in range(30)]
+    assert node.calls()['eth_getBlockReceipts'] <= 10
+
+
+def test_null_block_receipts_are_fetched_again(node, tracker):
+    h = tx_hash(1)
+    future = tracker.track(h)
+    time.sleep(0.1)
+    # The node answers null for the block that mined the transaction the first time it is asked
+    node.mined[101] = [h]
+    node.null_receipts.add(101)
+    node.head = 101
+    assert future.result(5).blockNumber == 101
+
+
+def test_wait_times_out(tracker):
+    with pytest.raises(TimeExhausted):
+        tracker.wait(tx_hash(2), timeout=0.2)
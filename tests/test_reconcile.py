@@ -0,0 +1,63 @@
+from bridge_reconcile import PAIRS, events_frame, match, reconcile
+
+
+TOKEN = '0x' + '11' * 20
+ALICE = '0x' + 'a1' * 20
+BOB = '0x' + 'b0' * 20
+
+
+def frame(decoders, chain, event_name, rows):
+    """
+        rows - (list) (block, token, recipient, amount)
+        Returns the events_frame of event_name events built from rows
+    """
+    record = next(record for name, record, _, _ in decoders[chain].events.values() if name == event_name)
+    fields = next(spec for _, origin, relay in PAIRS for spec in (origin, relay) if spec[1] == event_name)
+    events = []
+    for n, (block, token, recipient, amount) in enumerate(rows):
+        values = {field: None for field in record._fields}
+        values.update(event=event_name, blockNumber=block, logIndex=n, transactionHash=f"0x{event_name}{n}",
+                      amount=amount, **{fields[2]: token, fields[3]: recipient})
+        events.append(record(**values))
+    return events_frame(events, fields[2], fields[3])
+
+
+def test_match_classifies_relays(decoders):
+    deposits = frame(decoders, 'source', 'Deposit', [
+        (1, TOKEN, ALICE, 5),  # matched
+        (2, TOKEN, ALICE, 5),  # matched (second of the same key)
+        (3, TOKEN, BOB, 2),  # netted with the next one
+        (4, TOKEN, BOB, 3),
+        (5, TOKEN, BOB, 9),  # never relayed
+    ])
+    wraps = frame(decoders, 'destination', 'Wrap', [
+        (10, TOKEN, ALICE, 5),
+        (11, TOKEN, ALICE, 5),
+        (12, TOKEN, ALICE, 5),  # one more than was deposited
+        (13, TOKEN, BOB, 5),  # 2 + 3
+        (14, TOKEN, BOB, 2**200),  # no origin at all
+    ])
+    result = match(deposits, wraps)
+    assert len(result['matched']) == 2
+    assert list(result['duplicated'].blockNumber) == [12]
+    assert list(result['netted_origins'].blockNumber) == [3, 4]
+    assert list(result['netted_relays'].blockNumber) == [13]
+    assert list(result['unmatched_origins'].blockNumber) == [5]
+    assert list(result['unmatched_relays'].amount) == [2**200]
+
+
+def test_balances_keep_uint256_precision(decoders):
+    big = 2**255
+    frames = {
+        'Deposit': frame(decoders, 'source', 'Deposit', [(1, TOKEN, ALICE, big), (2, TOKEN, ALICE, big)]),
+        'Wrap': frame(decoders, 'destination', 'Wrap', [(3, TOKEN, ALICE, big)]),
+        'Unwrap': frame(decoders, 'destination', 'Unwrap', [(4, TOKEN, ALICE, 1)]),
+        'Withdrawal': frame(decoders, 'source', 'Withdrawal', []),
+    }
+    results, totals = reconcile(frames)
+    assert set(results) == {'wrap', 'withdraw'}
+    row = totals.loc[TOKEN]
+    assert row['deposit'] == 2 * big
+    assert row['pending_wrap'] == big
+    assert row['pending_withdrawal'] == 1
+    assert row['imbalance'] == 2 * big - (big - 1)
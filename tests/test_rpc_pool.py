@@ -0,0 +1,45 @@
+import json
+import pytest
+import bridge
+from bridge_rpc import RPCPool
+from mock_node import MockNode
+from test_scan import deposit_log, relayed, scan
+
+
+@pytest.fixture
+def lagging(node, monkeypatch):
+    """
+        A second source endpoint, five blocks behind node, with the same logs
+    """
+    lagging = MockNode(head=node.head - 5).start()
+    monkeypatch.setitem(bridge.RPC_URLS, 'source', [lagging.url, node.url])
+    yield lagging
+    lagging.stop()
+
+
+def test_logs_are_not_read_from_a_lagging_endpoint(node, lagging, decoders, tmp_path, monkeypatch):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = lagging.logs = [deposit_log(decoders, 103, 0, 7)]
+    node.head = 105
+
+    # The head is read from node, and right after that the lagging endpoint ranks best
+    preferred = [node.url]
+    def head(params):
+        preferred.append(lagging.url)
+        return hex(node.head)
+    node.handlers['eth_blockNumber'] = head
+    monkeypatch.setattr(RPCPool, 'ranked', lambda self: sorted(self.providers, key=lambda p: p.endpoint_uri != preferred[-1]))
+
+    assert scan(tmp_path) == 105
+    assert [status for _, status in relayed(tmp_path)] == ['confirmed']
+    assert lagging.calls()['eth_getLogs'] == 0
+
+
+def test_blocks_no_endpoint_has_reached_are_skipped(node, lagging, decoders, monkeypatch):
+    monkeypatch.setattr(bridge.time, 'sleep', lambda seconds: None)
+    node.head = 105
+    query = bridge.LogQuery(bridge.connect_to('source'), bridge.get_contract_info('source', "contract_info.json")['address'],
+                            decoders['source'], ['Deposit'])
+    logs, skipped = bridge.get_logs(query, 101, 110)
+    assert skipped == list(range(106, 111))
+    assert node.calls()['eth_getLogs'] > 0 and lagging.calls()['eth_getLogs'] == 0
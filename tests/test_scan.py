@@ -0,0 +1,155 @@
+import json
+import bridge
+from bridge_store import CONFIRMED, REVERTED, SENT, get_relay_index
+from eth_utils import keccak
+from mock_node import make_log
+
+
+TOKEN = '0x' + '11' * 20
+RECIPIENT = '0x' + '22' * 20
+
+
+def deposit_log(decoders, block, log_index, amount):
+    address = bridge.get_contract_info('source', "contract_info.json")['address']
+    return make_log(decoders['source'], 'Deposit', address, block, log_index,
+                    [('address', TOKEN, True), ('address', RECIPIENT, True), ('uint256', amount, False)])
+
+
+def scan(tmp_path, **kwargs):
+    bridge.scan_blocks('source', cursor_file=str(tmp_path / "cursor.json"), relay_db=str(tmp_path / "relays.db"),
+                       event_cache=None, **kwargs)
+    return json.loads((tmp_path / "cursor.json").read_text())['source']
+
+
+def relayed(tmp_path):
+    return get_relay_index(str(tmp_path / "relays.db")).db.execute(
+        "SELECT tx_hash, status FROM relays").fetchall()
+
+
+def test_relays_each_event_once_and_checkpoints(node, decoders, tmp_path):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = [deposit_log(decoders, 95, 0, 7), deposit_log(decoders, 96, 0, 8), deposit_log(decoders, 96, 1, 9)]
+    assert scan(tmp_path) == 100
+    assert sorted(status for _, status in relayed(tmp_path)) == [CONFIRMED] * 3
+    # One eth_chainId for the whole run, not one per relay transaction
+    assert node.calls()['eth_sendRawTransaction'] == 3
+    assert node.calls()['eth_chainId'] == 1
+
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    scan(tmp_path)
+    assert node.calls()['eth_sendRawTransaction'] == 3
+
+
+def test_reorg_into_a_shallow_empty_block_is_relayed(node, decoders, tmp_path):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 990}))
+    node.head = 1000
+    scan(tmp_path, confirmations=6)
+    assert relayed(tmp_path) == []
+
+    # Block 999 was empty when it was scanned; the reorg that replaced it added a Deposit
+    node.logs = [deposit_log(decoders, 999, 0, 7)]
+    node.block_hashes[999] = '0x' + 'cd' * 32
+    node.logs[0]['blockHash'] = node.block_hashes[999]
+    node.head = 1020
+    assert scan(tmp_path, confirmations=6) == 1014
+    assert [status for _, status in relayed(tmp_path)] == [CONFIRMED]
+
+
+def test_orphaned_events_are_dropped(node, decoders, tmp_path):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 990}))
+    node.logs = [deposit_log(decoders, 998, 0, 7)]
+    node.head = 1000
+    scan(tmp_path, confirmations=6)
+
+    # Block 998 is reorged out before it is confirmed, and the new version has no Deposit
+    node.logs = []
+    node.block_hashes[998] = '0x' + 'cd' * 32
+    node.head = 1010
+    scan(tmp_path, confirmations=6)
+    assert relayed(tmp_path) == []
+    assert node.calls()['eth_sendRawTransaction'] == 0
+
+
+BATCH_WRAP = {'type': 'function', 'name': 'batchWrap', 'stateMutability': 'nonpayable', 'outputs': [],
+              'inputs': [{'name': name, 'type': typ} for name, typ in
+                         (('_underlying_tokens', 'address[]'), ('_recipients', 'address[]'), ('_amounts', 'uint256[]'))]}
+
+
+def with_batch_wrap(tmp_path):
+    """
+        Returns a contract_info file whose destination contract also has batchWrap
+    """
+    info = json.loads(open("contract_info.json").read())
+    info['destination']['abi'].append(BATCH_WRAP)
+    (tmp_path / "contract_info.json").write_text(json.dumps(info))
+    return str(tmp_path / "contract_info.json")
+
+
+def test_reverted_batch_is_relayed_one_call_at_a_time(node, decoders, tmp_path):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = [deposit_log(decoders, 95, 0, 7), deposit_log(decoders, 96, 0, 13), deposit_log(decoders, 97, 0, 9)]
+    # Wrapping 13 reverts, and so does any batch that includes it
+    node.reverts = lambda data: (13).to_bytes(32, 'big') in bytes(data)
+
+    scan(tmp_path, contract_info=with_batch_wrap(tmp_path))
+    statuses = get_relay_index(str(tmp_path / "relays.db")).db.execute(
+        "SELECT tx_hash, status FROM relays ORDER BY tx_hash").fetchall()
+    assert sorted(status for _, status in statuses) == [CONFIRMED, CONFIRMED, REVERTED]
+    # One batchWrap, then one wrap per event
+    assert node.calls()['eth_sendRawTransaction'] == 4
+
+
+def test_calls_without_an_estimate_are_not_batched(node, decoders, tmp_path):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    other_token = '0x' + '33' * 20
+    node.logs = [deposit_log(decoders, 95, 0, 7), deposit_log(decoders, 96, 0, 8),
+                 make_log(decoders['source'], 'Deposit', bridge.get_contract_info('source', "contract_info.json")['address'],
+                          97, 0, [('address', other_token, True), ('address', RECIPIENT, True), ('uint256', 9, False)])]
+    # other_token is not registered, so estimating its wrap fails and the call would revert
+    def estimate(params):
+        if other_token[2:] in params[0]['data']:
+            raise ValueError("execution reverted")
+        return '0x5208'
+    node.handlers['eth_estimateGas'] = estimate
+    node.reverts = lambda data: bytes.fromhex(other_token[2:]) in bytes(data)
+
+    scan(tmp_path, contract_info=with_batch_wrap(tmp_path))
+    assert sorted(status for _, status in relayed(tmp_path)) == [CONFIRMED, CONFIRMED, REVERTED]
+    # One batchWrap for the two estimated calls, and the other on its own
+    assert node.calls()['eth_sendRawTransaction'] == 2
+
+
+def test_dropped_relay_is_sent_again(node, decoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, 'RELAY_TIMEOUT', 0.5)
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = [deposit_log(decoders, 95, 0, 7)]
+    def drop(params):
+        # The first relay transaction never reaches the mempool; later ones are mined as usual
+        del node.handlers['eth_sendRawTransaction']
+        return '0x' + '99' * 32
+    node.handlers['eth_sendRawTransaction'] = drop
+
+    scan(tmp_path)
+    assert [status for _, status in relayed(tmp_path)] == [SENT]
+    assert scan(tmp_path) == 100
+    assert [status for _, status in relayed(tmp_path)] == [CONFIRMED]
+    assert node.calls()['eth_sendRawTransaction'] == 2
+
+
+def test_relay_mined_after_the_timeout_is_not_sent_again(node, decoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, 'RELAY_TIMEOUT', 0.5)
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 90}))
+    node.logs = [deposit_log(decoders, 95, 0, 7)]
+    def send(params):
+        # Mined in the next block, which only arrives after the receipt wait has given up
+        tx_hash = '0x' + keccak(hexstr=params[0]).hex()
+        node.mined.setdefault(node.head + 1, []).append(tx_hash)
+        return tx_hash
+    node.handlers['eth_sendRawTransaction'] = send
+
+    scan(tmp_path)
+    assert [status for _, status in relayed(tmp_path)] == [SENT]
+    node.head += 1
+    scan(tmp_path)
+    assert [status for _, status in relayed(tmp_path)] == [CONFIRMED]
+    assert node.calls()['eth_sendRawTransaction'] == 1
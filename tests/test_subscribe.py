@@ -0,0 +1,75 @@
+import asyncio
+import json
+import pytest
+from web3 import AsyncWeb3
+from web3.providers.rpc import AsyncHTTPProvider
+import bridge
+from bridge_store import CONFIRMED
+from test_scan import deposit_log, relayed
+
+
+class FakeSubscription:
+    """
+        Stands in for AsyncWeb3(WebSocketProvider(...)): requests go to node over HTTP, and the subscription
+        stream is messages (callables in it are run between messages, e.g. to move the node's head)
+        The stream ends by cancelling the subscriber
+    """
+    def __init__(self, node, messages):
+        self.node = node
+        self.messages = messages
+        self.provider = AsyncHTTPProvider(node.url)
+        self.eth = self.socket = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def subscribe(self, kind, params=None):
+        return kind
+
+    @property
+    def block_number(self):
+        return self.head()
+
+    async def head(self):
+        return self.node.head
+
+    async def process_subscriptions(self):
+        for message in self.messages:
+            if callable(message):
+                message()
+            else:
+                yield message
+        raise asyncio.CancelledError
+
+
+def new_head(node, n):
+    def move():
+        node.head = n
+    return [move, {'subscription': 'newHeads', 'result': {'number': n}}]
+
+
+def test_subscribed_events_wait_for_confirmations(node, decoders, tmp_path, monkeypatch):
+    (tmp_path / "cursor.json").write_text(json.dumps({'source': 100}))
+    sent = []  # relay transactions sent by each check point (subscribe_chain catches assertion errors)
+    orphan = deposit_log(decoders, 102, 0, 8)
+    orphan['blockHash'] = '0x' + 'cd' * 32  # block 102 is reorged to a version without the Deposit
+    check = lambda: sent.append(node.calls()['eth_sendRawTransaction'])
+    stream = FakeSubscription(node, [
+        *new_head(node, 101), {'subscription': 'logs', 'result': deposit_log(decoders, 101, 0, 7)},
+        *new_head(node, 102), {'subscription': 'logs', 'result': orphan}, check,
+        *new_head(node, 103), check,
+        *new_head(node, 104), check,
+    ])
+    monkeypatch.setattr(bridge, 'WebSocketProvider', lambda url: stream)
+    monkeypatch.setattr(bridge, 'AsyncWeb3', lambda provider: provider if provider is stream else AsyncWeb3(provider))
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(bridge.subscribe_chain('source', confirmations=2, cursor_file=str(tmp_path / "cursor.json"),
+                                           relay_db=str(tmp_path / "relays.db"), ws_url="ws://mock"))
+    # Nothing is relayed before block 101 is two blocks deep, and the orphaned Deposit never is
+    assert sent == [0, 1, 1]
+    assert [status for _, status in relayed(tmp_path)] == [CONFIRMED]
+    assert json.loads((tmp_path / "cursor.json").read_text())['source'] == 101